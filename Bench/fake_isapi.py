@@ -0,0 +1,242 @@
+"""A local stand-in for a Hikvision camera's ISAPI, for exercising Core/isapi.py.
+
+Checks HTTP digest auth (MD5, qop=auth) like a camera does, keeps the streaming
+channel settings and PTZ state it is sent, serves a JPEG snapshot, and counts
+connections, requests and 401 challenges so connection and nonce reuse can be
+checked. Run it on its own to point the edge at it:
+
+    python -m Bench.fake_isapi --port 8080 --user admin --password secret
+"""
+import argparse
+import hashlib
+import logging
+import os
+import threading
+import time
+import xml.etree.ElementTree as ET
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import cv2
+import numpy as np
+from requests.utils import parse_dict_header
+
+logging.basicConfig(level=logging.INFO,
+                    format="%(asctime)s - %(levelname)s - %(message)s")
+
+REALM = "IP Camera(fake)"
+NONCE_LIFETIME = 300.0  # Seconds before the server asks for a new nonce
+
+STREAMING_CHANNEL_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<StreamingChannel version="2.0" xmlns="http://www.hikvision.com/ver20/XMLSchema">
+<id>{channel}</id>
+<channelName>Camera 01</channelName>
+<enabled>true</enabled>
+<Video>
+<enabled>true</enabled>
+<videoInputChannelID>1</videoInputChannelID>
+<videoCodecType>{codec}</videoCodecType>
+<videoResolutionWidth>{width}</videoResolutionWidth>
+<videoResolutionHeight>{height}</videoResolutionHeight>
+<videoQualityControlType>VBR</videoQualityControlType>
+<constantBitRate>{bitrate}</constantBitRate>
+<vbrUpperCap>{bitrate}</vbrUpperCap>
+<maxFrameRate>{max_frame_rate}</maxFrameRate>
+</Video>
+</StreamingChannel>
+"""
+
+
+CAPABILITIES_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<StreamingChannel version="2.0" xmlns="http://www.hikvision.com/ver20/XMLSchema">
+<id>{channel}</id>
+<Video>
+<videoCodecType opt="{codecs}">{codec}</videoCodecType>
+<videoResolutionWidth opt="{widths}">{width}</videoResolutionWidth>
+<videoResolutionHeight opt="{heights}">{height}</videoResolutionHeight>
+<maxFrameRate opt="{frame_rates}">{max_frame_rate}</maxFrameRate>
+</Video>
+</StreamingChannel>
+"""
+
+
+def _md5(text):
+    return hashlib.md5(text.encode('utf-8')).hexdigest()
+
+
+def _local_name(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+class FakeIsapiCamera:
+    """Fake ISAPI camera on 127.0.0.1 (port 0 picks a free port; see .host).
+
+    Attributes:
+        channels: channel id -> dict of width, height, bitrate (kbit/s), max_frame_rate, codec.
+        capabilities: Options every channel offers: 'resolutions' [(width, height)],
+            'frame_rates' (in hundredths, as ISAPI lists them) and 'codecs'.
+        ptz: Last continuous PTZ speeds {'pan', 'tilt', 'zoom'}.
+        connections, requests, challenges: Counters since start.
+        delay: Seconds every request takes, to simulate a slow camera.
+    """
+
+    def __init__(self, username='admin', password='admin', port=0, delay=0.0):
+        self.username = username
+        self.password = password
+        self.delay = delay
+        self.channels = {101: {'width': 1920, 'height': 1080, 'bitrate': 4096, 'max_frame_rate': 2500, 'codec': 'H.264'},
+                         102: {'width': 640, 'height': 360, 'bitrate': 512, 'max_frame_rate': 1500, 'codec': 'H.265'}}
+        self.capabilities = {'resolutions': [(704, 576), (640, 480), (640, 360), (352, 288), (320, 240)],
+                             'frame_rates': [2500, 2000, 1500, 1000, 500, 100],
+                             'codecs': ['H.264', 'MJPEG', 'H.265']}
+        self.ptz = {'pan': 0, 'tilt': 0, 'zoom': 0}
+        self.connections = 0
+        self.requests = 0
+        self.challenges = 0
+        self._lock = threading.Lock()
+        self._nonce = None
+        self._nonce_time = 0.0
+        self._server = ThreadingHTTPServer(('127.0.0.1', port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def host(self):
+        return f"127.0.0.1:{self._server.server_address[1]}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="FakeISAPI", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _current_nonce(self):
+        with self._lock:
+            if self._nonce is None or time.monotonic() - self._nonce_time > NONCE_LIFETIME:
+                self._nonce = os.urandom(16).hex()
+                self._nonce_time = time.monotonic()
+            return self._nonce
+
+    def _authorized(self, method, authorization):
+        if not authorization or not authorization.lower().startswith('digest '):
+            return False
+        fields = parse_dict_header(authorization[len('digest '):])
+        if fields.get('username') != self.username or fields.get('nonce') != self._current_nonce():
+            return False
+        ha1 = _md5(f"{self.username}:{REALM}:{self.password}")
+        ha2 = _md5(f"{method}:{fields.get('uri')}")
+        expected = _md5(f"{ha1}:{fields['nonce']}:{fields.get('nc')}:{fields.get('cnonce')}:auth:{ha2}")
+        return fields.get('response') == expected
+
+    def _handler_class(self):
+        camera = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # Keep-alive, like a real camera
+
+            def setup(self):
+                super().setup()
+                with camera._lock:
+                    camera.connections += 1
+
+            def log_message(self, format, *args):
+                pass
+
+            def _reply(self, status, body=b'', content_type='application/xml', headers=()):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                for name, value in headers:
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _handle(self, method):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0) or 0))
+                with camera._lock:
+                    camera.requests += 1
+                if camera.delay:
+                    time.sleep(camera.delay)
+                if not camera._authorized(method, self.headers.get('Authorization')):
+                    with camera._lock:
+                        camera.challenges += 1
+                    challenge = (f'Digest qop="auth", realm="{REALM}", '
+                                 f'nonce="{camera._current_nonce()}", stale="FALSE"')
+                    self._reply(401, b'', headers=[('WWW-Authenticate', challenge)])
+                    return
+                try:
+                    self._route(method, self.path.split('?', 1)[0].rstrip('/'), body)
+                except ET.ParseError:
+                    self._reply(400, b'<ResponseStatus><statusString>Invalid XML Content</statusString></ResponseStatus>')
+
+            def _route(self, method, path, body):
+                parts = path.split('/')
+                if path.startswith('/ISAPI/Streaming/channels/') and len(parts) == 5:
+                    channel = camera.channels.get(int(parts[4]) if parts[4].isdigit() else None)
+                    if channel is None:
+                        self._reply(404)
+                    elif method == 'GET':
+                        xml = STREAMING_CHANNEL_XML.format(channel=parts[4], **channel)
+                        self._reply(200, xml.encode('utf-8'))
+                    else:
+                        values = {_local_name(element.tag): element.text for element in ET.fromstring(body).iter()}
+                        channel.update({'width': int(values['videoResolutionWidth']),
+                                        'height': int(values['videoResolutionHeight']),
+                                        'bitrate': int(values.get('vbrUpperCap') or values['constantBitRate']),
+                                        'max_frame_rate': int(values['maxFrameRate']),
+                                        'codec': values['videoCodecType']})
+                        self._reply(200, b'<ResponseStatus><statusCode>1</statusCode></ResponseStatus>')
+                elif path.startswith('/ISAPI/Streaming/channels/') and path.endswith('/capabilities') and method == 'GET':
+                    channel = camera.channels.get(int(parts[4]) if parts[4].isdigit() else None)
+                    if channel is None:
+                        self._reply(404)
+                        return
+                    options = camera.capabilities
+                    xml = CAPABILITIES_XML.format(
+                        channel=parts[4],
+                        codecs=','.join(options['codecs']),
+                        widths=','.join(str(width) for width, _ in options['resolutions']),
+                        heights=','.join(str(height) for _, height in options['resolutions']),
+                        frame_rates=','.join(str(rate) for rate in options['frame_rates']),
+                        **channel)
+                    self._reply(200, xml.encode('utf-8'))
+                elif path.startswith('/ISAPI/Streaming/channels/') and path.endswith('/picture') and method == 'GET':
+                    channel = camera.channels.get(int(parts[4]), camera.channels[101])
+                    frame = np.zeros((channel['height'] // 4, channel['width'] // 4, 3), dtype=np.uint8)
+                    _, jpeg = cv2.imencode('.jpg', frame)
+                    self._reply(200, jpeg.tobytes(), content_type='image/jpeg')
+                elif path.startswith('/ISAPI/PTZCtrl/channels/') and path.endswith('/continuous') and method == 'PUT':
+                    values = {_local_name(element.tag): element.text for element in ET.fromstring(body).iter()}
+                    camera.ptz = {name: int(values.get(name) or 0) for name in ('pan', 'tilt', 'zoom')}
+                    self._reply(200, b'<ResponseStatus><statusCode>1</statusCode></ResponseStatus>')
+                else:
+                    self._reply(404)
+
+            def do_GET(self):
+                self._handle('GET')
+
+            def do_PUT(self):
+                self._handle('PUT')
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--user', default='admin')
+    parser.add_argument('--password', default='admin')
+    parser.add_argument('--delay', type=float, default=0.0, help="Seconds every request takes")
+    args = parser.parse_args()
+    camera = FakeIsapiCamera(args.user, args.password, args.port, args.delay).start()
+    logging.info(f"Fake ISAPI camera on http://{camera.host}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        camera.stop()
+
+
+if __name__ == '__main__':
+    main()
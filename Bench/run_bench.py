@@ -0,0 +1,223 @@
+"""Throughput/latency benchmark for the streaming pipeline, without cameras or a VPS.
+
+For every configuration (camera count x resize_frame x JPEG quality) it starts:
+
+- a sink process (Bench/sink.py) that speaks the framed protocol on 127.0.0.1;
+- a streamer process running N synthetic cameras (Bench/synthetic.py) through
+  capture_camera, LatestFrameSlot and stream_merged_frames, i.e. the same code
+  path as real cameras.
+
+After a warmup it measures for --duration seconds and reports received fps, p50/p99
+glass-to-sink latency (capture stamp to arrival at the sink), the p50 time from
+capture until the edge started sending (from the frame headers), frames lost on
+the edge, uplink throughput, and the streamer process's CPU and peak memory.
+
+With --transport udp the frames go out as datagrams, --loss of which are dropped
+on purpose to stand in for a lossy link; 'lost' then includes frames that did not
+survive it, and 'fec' counts frames that only arrived thanks to parity.
+
+Run from the repository root, e.g.:
+
+    python -m Bench.run_bench --cameras 1,4,8 --resize 720x480,320x240 --quality 50,70
+    python -m Bench.run_bench --source sample.mp4 --json results.json
+    python -m Bench.run_bench --transport udp --loss 0.02 --fec-group 4
+"""
+import argparse
+import itertools
+import json
+import logging
+import multiprocessing
+import time
+from functools import partial
+from threading import Thread, Event
+import numpy as np
+import psutil
+from Core.frame_slot import LatestFrameSlot
+from Core.stream_image import capture_camera, stream_merged_frames
+from Bench.synthetic import SyntheticCapture, SYNTHETIC_SOURCE
+from Bench.sink import run_sink
+
+logging.basicConfig(level=logging.INFO,
+                    format="%(asctime)s - %(levelname)s - %(message)s")
+
+MEMORY_SAMPLE_INTERVAL = 0.2
+
+
+def parse_size(value):
+    """Parses '<width>x<height>' into a (width, height) tuple."""
+    try:
+        width, height = (int(part) for part in value.lower().split('x'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid size '{value}'. Expected '<width>x<height>'.")
+    return width, height
+
+
+def parse_list(value, item_type=int):
+    return [item_type(item) for item in value.split(',') if item.strip()]
+
+
+def run_streamer(config, port, warmup_event, stop_event, result_queue):
+    """Streamer process: synthetic cameras -> capture_camera -> stream_merged_frames -> sink."""
+    logging.getLogger().setLevel(config['log_level'])
+    num_cameras = config['cameras']
+    resize_frame = tuple(config['resize'])
+    capture_factory = partial(SyntheticCapture, fps=config['source_fps'],
+                              size=tuple(config['source_size']))
+
+    frames_ready = Event()
+    slots = [LatestFrameSlot(ready_event=frames_ready) for _ in range(num_cameras)]
+    local_stop = Event()
+    threads = [Thread(target=capture_camera,
+                      args=(f"synthetic-{i}", '', '', resize_frame, slot, local_stop),
+                      kwargs={'source': config['source'], 'capture_factory': capture_factory},
+                      daemon=True)
+               for i, slot in enumerate(slots)]
+    threads.append(Thread(target=stream_merged_frames,
+                          args=(slots, None, '127.0.0.1', port, local_stop, num_cameras),
+                          kwargs={'resize_frame': resize_frame,
+                                  'jpeg_quality': config['quality'],
+                                  'encode_workers': config['encode_workers'],
+                                  'frames_ready': frames_ready,
+                                  'target_fps': config['target_fps'],
+                                  'transport': config['transport'],
+                                  'datagram_options': {'fec_group': config['fec_group'],
+                                                       'simulated_loss': config['loss']}},
+                          daemon=True))
+    for thread in threads:
+        thread.start()
+
+    process = psutil.Process()
+    warmup_event.wait()
+    cpu_start = process.cpu_times()
+    wall_start = time.monotonic()
+    dropped_start = sum(slot.frames_dropped for slot in slots)
+    peak_rss = process.memory_info().rss
+    while not stop_event.wait(MEMORY_SAMPLE_INTERVAL):
+        peak_rss = max(peak_rss, process.memory_info().rss)
+    cpu_end = process.cpu_times()
+    wall = time.monotonic() - wall_start
+
+    local_stop.set()
+    for thread in threads:
+        thread.join(timeout=2.0)
+
+    cpu_seconds = (cpu_end.user - cpu_start.user) + (cpu_end.system - cpu_start.system)
+    result_queue.put({
+        'cpu_percent': 100.0 * cpu_seconds / wall if wall > 0 else 0.0,
+        'peak_rss_mb': peak_rss / (1024 * 1024),
+        'frames_dropped': sum(slot.frames_dropped for slot in slots) - dropped_start,
+    })
+
+
+def run_config(config, warmup, duration):
+    """Runs one configuration and returns its result dict."""
+    port_queue = multiprocessing.Queue()
+    sink_results = multiprocessing.Queue()
+    streamer_results = multiprocessing.Queue()
+    warmup_event = multiprocessing.Event()
+    stop_event = multiprocessing.Event()
+
+    sink = multiprocessing.Process(
+        target=run_sink, args=(port_queue, sink_results, stop_event, warmup_event), name="BenchSink")
+    sink.start()
+    port = port_queue.get(timeout=10)
+
+    streamer = multiprocessing.Process(
+        target=run_streamer, args=(config, port, warmup_event, stop_event, streamer_results),
+        name="BenchStreamer")
+    streamer.start()
+
+    time.sleep(warmup)
+    warmup_event.set()
+    time.sleep(duration)
+    stop_event.set()
+
+    streamer_stats = streamer_results.get(timeout=30)
+    sink_stats = sink_results.get(timeout=30)
+    streamer.join(timeout=5)
+    sink.join(timeout=5)
+
+    latencies = np.array([latency for samples in sink_stats['latencies'].values()
+                          for latency in samples])
+    edge_latencies = np.array(sink_stats['edge_latencies'])
+    frames = sum(sink_stats['frames'].values())
+    result = {key: value for key, value in config.items() if key != 'log_level'}
+    result.update({
+        'fps_total': frames / duration,
+        'fps_per_camera': frames / duration / config['cameras'],
+        'latency_p50_ms': float(np.percentile(latencies, 50)) * 1000 if latencies.size else None,
+        'latency_p99_ms': float(np.percentile(latencies, 99)) * 1000 if latencies.size else None,
+        'edge_p50_ms': float(np.percentile(edge_latencies, 50)) * 1000 if edge_latencies.size else None,
+        'frames_lost': sink_stats['lost'],
+        'mbit_per_s': sink_stats['bytes'] * 8 / duration / 1e6,
+        'bad_stamps': sink_stats['bad_stamps'],
+        'fec_repaired': sink_stats['repaired'],
+    })
+    result.update(streamer_stats)
+    return result
+
+
+def format_row(result):
+    def ms(value):
+        return f"{value:8.1f}" if value is not None else "       -"
+    resize = "x".join(str(part) for part in result['resize'])
+    return (f"{result['cameras']:>4} {resize:>9} {result['quality']:>4} "
+            f"{result['fps_total']:>8.1f} {result['fps_per_camera']:>7.1f} "
+            f"{ms(result['latency_p50_ms'])} {ms(result['latency_p99_ms'])} {ms(result['edge_p50_ms'])} "
+            f"{result['mbit_per_s']:>7.1f} {result['cpu_percent']:>6.0f} "
+            f"{result['peak_rss_mb']:>7.0f} {result['frames_dropped']:>7} {result['frames_lost']:>7} "
+            f"{result['fec_repaired']:>5}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--cameras', type=parse_list, default=[1, 4],
+                        help="Comma-separated camera counts (default: 1,4)")
+    parser.add_argument('--resize', type=lambda value: [parse_size(item) for item in value.split(',')],
+                        default=[(720, 480)], help="Comma-separated resize_frame sizes (default: 720x480)")
+    parser.add_argument('--quality', type=parse_list, default=[70],
+                        help="Comma-separated JPEG qualities (default: 70)")
+    parser.add_argument('--source', default=SYNTHETIC_SOURCE,
+                        help="'synthetic' for generated frames, or a video file to loop")
+    parser.add_argument('--source-size', type=parse_size, default=(1280, 720),
+                        help="Size of generated frames (default: 1280x720)")
+    parser.add_argument('--source-fps', type=float, default=25.0,
+                        help="Frame rate of generated frames (default: 25)")
+    parser.add_argument('--encode-workers', type=int, default=2)
+    parser.add_argument('--target-fps', type=float, default=0.0,
+                        help="Streamer output fps cap, as target_fps in cam.cfg (default: 0, uncapped)")
+    parser.add_argument('--transport', choices=('tcp', 'udp'), default='tcp',
+                        help="Uplink transport, as transport in cam.cfg (default: tcp)")
+    parser.add_argument('--loss', type=float, default=0.0,
+                        help="UDP: fraction of datagrams dropped to simulate a lossy link (default: 0)")
+    parser.add_argument('--fec-group', type=int, default=4,
+                        help="UDP: datagrams per parity datagram, 0 for none (default: 4)")
+    parser.add_argument('--warmup', type=float, default=2.0, help="Seconds before measuring")
+    parser.add_argument('--duration', type=float, default=10.0, help="Seconds measured per configuration")
+    parser.add_argument('--json', dest='json_path', help="Also write the results to this JSON file")
+    parser.add_argument('--verbose', action='store_true', help="Show the pipeline's own log output")
+    args = parser.parse_args()
+    log_level = logging.INFO if args.verbose else logging.WARNING
+    logging.getLogger().setLevel(log_level)
+
+    results = []
+    print(f"{'cams':>4} {'resize':>9} {'q':>4} {'fps':>8} {'fps/cam':>7} "
+          f"{'p50 ms':>8} {'p99 ms':>8} {'edge ms':>8} {'Mbit/s':>7} {'cpu%':>6} {'rss MB':>7} "
+          f"{'dropped':>7} {'lost':>7} {'fec':>5}")
+    for cameras, resize, quality in itertools.product(args.cameras, args.resize, args.quality):
+        config = {'cameras': cameras, 'resize': list(resize), 'quality': quality,
+                  'source': args.source, 'source_size': list(args.source_size),
+                  'source_fps': args.source_fps, 'encode_workers': args.encode_workers,
+                  'target_fps': args.target_fps, 'transport': args.transport,
+                  'loss': args.loss, 'fec_group': args.fec_group, 'log_level': log_level}
+        result = run_config(config, args.warmup, args.duration)
+        results.append(result)
+        print(format_row(result), flush=True)
+
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+import socket
+import threading
+import logging
+import time
+import cv2
+import numpy as np
+from Core.datagram import FrameAssembler, MAX_DATAGRAM_SIZE
+from Core.protocol import recv_frame, unpack_message, ProtocolError, PAYLOAD_JPEG, PAYLOAD_KEEPALIVE, PAYLOAD_TILES
+from Bench.synthetic import read_stamp, stamp_clock, stamp_elapsed
+
+logging.basicConfig(level=logging.INFO,
+                    format="%(asctime)s - %(levelname)s - %(message)s")
+
+
+def run_sink(port_queue, result_queue, stop_event, warmup_event):
+    """Benchmark sink process: a local stand-in for the VPS receiver.
+
+    Accepts streamer connections (and datagrams on the same port, for the UDP
+    transport), reads framed messages, and for every camera JPEG
+    decodes the stamp written by the synthetic source to get its glass-to-sink latency.
+    The header's capture time gives the capture-to-sink and capture-to-send (edge)
+    latencies, and gaps in each camera's seq the frames lost on the edge.
+    Samples only count once warmup_event is set. On stop_event, a summary dict is put
+    on result_queue.
+
+    Args:
+        port_queue: Receives the port the sink listens on (bound to 127.0.0.1:0).
+    """
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(('127.0.0.1', 0))
+    server.listen(4)
+    server.settimeout(0.5)
+    datagram_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    datagram_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 8 * 1024 * 1024)
+    datagram_socket.bind(server.getsockname())
+    datagram_socket.settimeout(0.5)
+    logging.getLogger().setLevel(logging.WARNING)
+    port_queue.put(server.getsockname()[1])
+
+    lock = threading.Lock()
+    latencies = {}      # camera id -> list of seconds
+    capture_latencies = []  # Seconds from the header's capture time to arrival
+    edge_latencies = []     # Seconds from capture until the edge started sending
+    last_seqs = {}      # camera id -> last seq received
+    lost = [0]
+    frames = {}         # camera id -> frames received after warmup
+    total_bytes = [0]
+    bad_stamps = [0]
+    repaired = [0]      # Messages completed with a parity datagram
+
+    def process(header, payload):
+        now = stamp_clock()
+        arrived = time.monotonic()
+        if header.payload_type not in (PAYLOAD_JPEG, PAYLOAD_KEEPALIVE, PAYLOAD_TILES):
+            return
+        with lock:
+            last_seq = last_seqs.get(header.camera_id)
+            last_seqs[header.camera_id] = header.seq
+            if last_seq is not None and header.seq > last_seq + 1 and warmup_event.is_set():
+                lost[0] += header.seq - last_seq - 1
+        if not warmup_event.is_set() or header.payload_type != PAYLOAD_JPEG:
+            return
+        if header.capture_monotonic is not None:
+            # Same host, so the edge's monotonic clock is ours too
+            with lock:
+                capture_latencies.append(arrived - header.capture_monotonic)
+                edge_latencies.append(header.send_delay)
+        # Half-size decode is plenty for the stamp and keeps the sink off the critical path
+        gray = cv2.imdecode(np.frombuffer(payload, dtype=np.uint8),
+                            cv2.IMREAD_REDUCED_GRAYSCALE_2)
+        with lock:
+            total_bytes[0] += len(payload)
+            frames[header.camera_id] = frames.get(header.camera_id, 0) + 1
+            if gray is None:
+                bad_stamps[0] += 1
+                return
+            latency = stamp_elapsed(read_stamp(gray), now)
+            if latency > 60.0:
+                bad_stamps[0] += 1  # Misread stamp, not a real measurement
+                return
+            latencies.setdefault(header.camera_id, []).append(latency)
+
+    def handle(conn):
+        conn.settimeout(0.5)
+        with conn:
+            while not stop_event.is_set():
+                try:
+                    message = recv_frame(conn)
+                except socket.timeout:
+                    continue
+                except (ConnectionError, OSError):
+                    break
+                if message is None:
+                    break
+                process(*message)
+
+    def handle_datagrams():
+        assembler = FrameAssembler()
+        buffer = bytearray(MAX_DATAGRAM_SIZE)
+        while not stop_event.is_set():
+            try:
+                count = datagram_socket.recv_into(buffer)
+            except socket.timeout:
+                continue
+            result = assembler.add(memoryview(buffer)[:count])
+            if result is None:
+                continue
+            try:
+                header, payload = unpack_message(result[0])
+            except ProtocolError:
+                continue
+            if result[1] and warmup_event.is_set():
+                with lock:
+                    repaired[0] += 1
+            process(header, payload)
+
+    handlers = [threading.Thread(target=handle_datagrams, daemon=True)]
+    handlers[0].start()
+    try:
+        while not stop_event.is_set():
+            try:
+                conn, _ = server.accept()
+            except socket.timeout:
+                continue
+            thread = threading.Thread(target=handle, args=(conn,), daemon=True)
+            thread.start()
+            handlers.append(thread)
+    finally:
+        server.close()
+        for thread in handlers:
+            thread.join(timeout=2.0)
+        datagram_socket.close()
+        with lock:
+            result_queue.put({'frames': frames, 'latencies': latencies,
+                              'capture_latencies': capture_latencies, 'edge_latencies': edge_latencies,
+                              'lost': lost[0], 'bytes': total_bytes[0], 'bad_stamps': bad_stamps[0],
+                              'repaired': repaired[0]})
@@ -0,0 +1,139 @@
+import time
+import cv2
+import numpy as np
+
+# Every synthetic frame carries the time it was "captured" (grabbed), written as a
+# grid of black/white cells in its top rows. The cells scale with the frame, so the
+# stamp survives resize_frame and JPEG compression and the sink can read it back to
+# measure glass-to-sink latency.
+STAMP_COLUMNS = 16
+STAMP_ROWS = 2
+STAMP_BITS = STAMP_COLUMNS * STAMP_ROWS
+STAMP_MASK = (1 << STAMP_BITS) - 1
+SYNTHETIC_SOURCE = "synthetic"
+
+
+def stamp_clock():
+    """Microsecond clock the stamps are taken from (wraps every ~71 minutes).
+    time.monotonic is system-wide, so source and sink processes share it.
+    """
+    return (time.monotonic_ns() // 1000) & STAMP_MASK
+
+
+def stamp_elapsed(stamp, now=None):
+    """Seconds between a stamp and now, allowing for one wrap of the clock."""
+    now = stamp_clock() if now is None else now
+    return ((now - stamp) & STAMP_MASK) / 1e6
+
+
+def _cells(width, height):
+    cell_width = width / STAMP_COLUMNS
+    cell_height = height / (STAMP_ROWS * 8)  # The stamp uses the top eighth of the frame
+    for bit in range(STAMP_BITS):
+        row, column = divmod(bit, STAMP_COLUMNS)
+        yield (bit, int(column * cell_width), int(row * cell_height),
+               int((column + 1) * cell_width), int((row + 1) * cell_height))
+
+
+def write_stamp(frame, value):
+    """Writes a STAMP_BITS-bit value into the top of a BGR frame, in place."""
+    height, width = frame.shape[:2]
+    for bit, x0, y0, x1, y1 in _cells(width, height):
+        frame[y0:y1, x0:x1] = 255 if (value >> bit) & 1 else 0
+
+
+def read_stamp(gray):
+    """Reads the value written by write_stamp from a (decoded, possibly resized) grayscale frame."""
+    height, width = gray.shape[:2]
+    value = 0
+    for bit, x0, y0, x1, y1 in _cells(width, height):
+        # Sample the middle of the cell, away from blurred JPEG block edges
+        dx, dy = (x1 - x0) // 4, (y1 - y0) // 4
+        if gray[y0 + dy:y1 - dy, x0 + dx:x1 - dx].mean() > 127:
+            value |= 1 << bit
+    return value
+
+
+class SyntheticCapture:
+    """Stand-in for cv2.VideoCapture that behaves like a live camera.
+
+    grab() blocks until the next frame is due at the source frame rate, like a camera
+    stream would, and retrieve() renders the frame with its capture time stamped in.
+    The source is either SYNTHETIC_SOURCE, for generated frames (a gradient with a
+    moving bar, so consecutive frames differ), or the path of a video file that is
+    looped at its own frame rate.
+    """
+
+    def __init__(self, source=SYNTHETIC_SOURCE, fps=25.0, size=(1280, 720)):
+        self._file = None
+        if source != SYNTHETIC_SOURCE:
+            self._file = cv2.VideoCapture(source)
+            if not self._file.isOpened():
+                raise ValueError(f"Could not open video file '{source}'.")
+            fps = self._file.get(cv2.CAP_PROP_FPS) or fps
+            size = (int(self._file.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                    int(self._file.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+        self.fps = fps
+        self.width, self.height = size
+
+        self._background = None
+        if self._file is None:
+            gradient = np.linspace(0, 255, self.width, dtype=np.uint8)
+            self._background = np.empty((self.height, self.width, 3), dtype=np.uint8)
+            self._background[:] = gradient[np.newaxis, :, np.newaxis]
+        self._next_frame_time = time.monotonic()
+        self._count = 0
+        self._stamp = 0
+        self._opened = True
+
+    def isOpened(self):
+        return self._opened
+
+    def set(self, prop, value):
+        return False
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FPS:
+            return self.fps
+        return 0.0
+
+    def grab(self):
+        if not self._opened:
+            return False
+        delay = self._next_frame_time - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        self._next_frame_time = max(self._next_frame_time + 1.0 / self.fps,
+                                    time.monotonic() - 1.0 / self.fps)
+        self._stamp = stamp_clock()
+        self._count += 1
+        if self._file is not None:
+            if not self._file.grab():
+                # End of file: loop
+                self._file.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                return self._file.grab()
+        return True
+
+    def retrieve(self):
+        # Like cv2.VideoCapture, every call returns a new array
+        if self._file is not None:
+            ok, frame = self._file.retrieve()
+            if not ok:
+                return False, None
+        else:
+            frame = self._background.copy()
+            bar_width = max(self.width // 20, 1)
+            x = (self._count * 8) % max(self.width - bar_width, 1)
+            frame[:, x:x + bar_width] = (0, 0, 255)
+        write_stamp(frame, self._stamp)
+        return True, frame
+
+    def read(self):
+        if not self.grab():
+            return False, None
+        return self.retrieve()
+
+    def release(self):
+        self._opened = False
+        if self._file is not None:
+            self._file.release()
@@ -40,11 +40,152 @@ def load_configuration():
         config_data['vps_ip'] = config.get('Network', 'vps_ip')
         config_data['video_port'] = config.getint('Network', 'video_port')
         config_data['control_port'] = config.getint('Network', 'control_port')
+        config_data['uplink_channels'] = config.getint(
+            'Network', 'uplink_channels', fallback=1)
+        if config_data['uplink_channels'] < 1:
+            raise ValueError(
+                f"uplink_channels must be at least 1, got {config_data['uplink_channels']}")
+        config_data['transport'] = config.get(
+            'Network', 'transport', fallback='tcp').strip().lower()
+        if config_data['transport'] not in ('tcp', 'udp'):
+            raise ValueError(
+                f"transport must be 'tcp' or 'udp', got '{config_data['transport']}'")
+        config_data['udp_mtu'] = config.getint(
+            'Network', 'udp_mtu', fallback=1400)
+        if not 576 <= config_data['udp_mtu'] <= 65535:
+            raise ValueError(
+                f"udp_mtu must be between 576 and 65535, got {config_data['udp_mtu']}")
+        config_data['udp_fec_group'] = config.getint(
+            'Network', 'udp_fec_group', fallback=4)
+        if not 0 <= config_data['udp_fec_group'] <= 255:
+            raise ValueError(
+                f"udp_fec_group must be between 0 and 255, got {config_data['udp_fec_group']}")
 
         # Load Video settings
         resize_width = config.getint('Video', 'resize_width')
         resize_height = config.getint('Video', 'resize_height')
         config_data['resize_frame'] = (resize_width, resize_height)
+        config_data['jpeg_quality'] = config.getint(
+            'Video', 'jpeg_quality', fallback=70)
+        config_data['stream_mode'] = config.get(
+            'Video', 'stream_mode', fallback='split').strip().lower()
+        if config_data['stream_mode'] not in ('split', 'mosaic', 'passthrough'):
+            raise ValueError(
+                f"stream_mode must be 'split', 'mosaic' or 'passthrough', got '{config_data['stream_mode']}'")
+        config_data['mosaic_layout'] = config.get(
+            'Video', 'mosaic_layout', fallback='horizontal').strip().lower()
+        config_data['encode_workers'] = config.getint(
+            'Video', 'encode_workers', fallback=2)
+        config_data['target_fps'] = config.getfloat(
+            'Video', 'target_fps', fallback=25.0)
+        config_data['batch_window_ms'] = config.getfloat(
+            'Video', 'batch_window_ms', fallback=5.0)
+
+        # Load Capture settings
+        config_data['capture_mode'] = config.get(
+            'Capture', 'capture_mode', fallback='thread').strip().lower()
+        if config_data['capture_mode'] not in ('thread', 'process'):
+            raise ValueError(
+                f"capture_mode must be 'thread' or 'process', got '{config_data['capture_mode']}'")
+        config_data['ring_slots'] = config.getint(
+            'Capture', 'ring_slots', fallback=4)
+        config_data['decode_on_demand'] = config.getboolean(
+            'Capture', 'decode_on_demand', fallback=True)
+        config_data['negotiate_substream'] = config.getboolean(
+            'Capture', 'negotiate_substream', fallback=True)
+        config_data['substream_fps'] = config.getfloat(
+            'Capture', 'substream_fps', fallback=0.0)
+        config_data['substream_codec'] = config.get(
+            'Capture', 'substream_codec', fallback='H.264').strip()
+
+        # Load Adaptive quality settings
+        config_data['adaptive_enabled'] = config.getboolean(
+            'Adaptive', 'enabled', fallback=False)
+        config_data['adaptive_min_quality'] = config.getint(
+            'Adaptive', 'min_quality', fallback=30)
+        config_data['adaptive_min_scale'] = config.getfloat(
+            'Adaptive', 'min_scale', fallback=0.5)
+        config_data['adaptive_min_fps'] = config.getfloat(
+            'Adaptive', 'min_fps', fallback=2.0)
+        config_data['adaptive_max_fps'] = config.getfloat(
+            'Adaptive', 'max_fps', fallback=25.0)
+        config_data['adaptive_interval'] = config.getfloat(
+            'Adaptive', 'adjust_interval', fallback=1.0)
+        if not 0 < config_data['adaptive_min_scale'] <= 1.0:
+            raise ValueError("Adaptive min_scale must be in (0, 1].")
+        if config_data['adaptive_min_quality'] > config_data['jpeg_quality']:
+            raise ValueError(
+                "Adaptive min_quality must not be above Video jpeg_quality.")
+
+        # Load Motion gating settings
+        config_data['motion_enabled'] = config.getboolean(
+            'Motion', 'enabled', fallback=False)
+        config_data['motion_change_ratio'] = config.getfloat(
+            'Motion', 'change_ratio', fallback=0.01)
+        config_data['motion_pixel_threshold'] = config.getint(
+            'Motion', 'pixel_threshold', fallback=25)
+        config_data['motion_keepalive_interval'] = config.getfloat(
+            'Motion', 'keepalive_interval', fallback=2.0)
+        config_data['motion_refresh_interval'] = config.getfloat(
+            'Motion', 'refresh_interval', fallback=30.0)
+
+        # Load Tile delta settings
+        config_data['tiles_enabled'] = config.getboolean(
+            'Tiles', 'enabled', fallback=False)
+        config_data['tiles_grid'] = config.get(
+            'Tiles', 'grid', fallback='8x6').strip()
+        config_data['tiles_keyframe_interval'] = config.getfloat(
+            'Tiles', 'keyframe_interval', fallback=10.0)
+        config_data['tiles_pixel_threshold'] = config.getint(
+            'Tiles', 'pixel_threshold', fallback=25)
+        config_data['tiles_change_ratio'] = config.getfloat(
+            'Tiles', 'change_ratio', fallback=0.005)
+        if config_data['tiles_enabled'] and config_data['stream_mode'] != 'split':
+            logging.warning(
+                "[Tiles] delta updates only apply to stream_mode = split; ignoring them.")
+            config_data['tiles_enabled'] = False
+
+        # Load Simulcast settings
+        config_data['simulcast_enabled'] = config.getboolean(
+            'Simulcast', 'enabled', fallback=False)
+        config_data['simulcast_tiers'] = config.get(
+            'Simulcast', 'tiers', fallback='').strip()
+        if config_data['simulcast_enabled'] and config_data['stream_mode'] != 'split':
+            logging.warning(
+                "[Simulcast] tiers only apply to stream_mode = split; ignoring them.")
+            config_data['simulcast_enabled'] = False
+
+        # Load Spool settings
+        config_data['spool_enabled'] = config.getboolean(
+            'Spool', 'enabled', fallback=False)
+        config_data['spool_directory'] = config.get(
+            'Spool', 'directory', fallback='spool').strip()
+        config_data['spool_max_mb'] = config.getfloat(
+            'Spool', 'max_mb', fallback=1024.0)
+        config_data['spool_fps'] = config.getfloat(
+            'Spool', 'fps', fallback=5.0)
+        config_data['spool_replay_kbps'] = config.getfloat(
+            'Spool', 'replay_kbps', fallback=2000.0)
+        if config_data['spool_enabled'] and config_data['transport'] == 'udp':
+            logging.warning(
+                "[Spool] needs the receiver's acks over transport = tcp; ignoring it.")
+            config_data['spool_enabled'] = False
+
+        # Load Metrics settings
+        config_data['metrics_enabled'] = config.getboolean(
+            'Metrics', 'enabled', fallback=False)
+        config_data['metrics_port'] = config.getint(
+            'Metrics', 'port', fallback=9108)
+        config_data['metrics_bind'] = config.get(
+            'Metrics', 'bind', fallback='127.0.0.1').strip()
+
+        # Load Discovery cache settings
+        config_data['cache_enabled'] = config.getboolean(
+            'Cache', 'enabled', fallback=True)
+        config_data['cache_path'] = config.get(
+            'Cache', 'path', fallback='Config/discovery_cache.json').strip()
+        config_data['cache_ttl'] = config.getfloat(
+            'Cache', 'ttl', fallback=86400.0)
 
         # Load Scanning settings
         filter_devices_raw = config.get(
@@ -63,6 +204,21 @@ def load_configuration():
                 f"'filter_devices' not found or empty in [{config_file} -> Scanning]. Scanning might include unwanted devices.")
             config_data['filter_devices'] = ['Hikvision']
 
+        # Empty means the /24 of the host's own address
+        config_data['scan_networks'] = [
+            item.strip()
+            for item in config.get('Scanning', 'networks', fallback='').split(',')
+            if item.strip()
+        ]
+        config_data['scan_timeout'] = config.getfloat(
+            'Scanning', 'timeout', fallback=1.0)
+        config_data['scan_concurrency'] = config.getint(
+            'Scanning', 'concurrency', fallback=256)
+        config_data['scan_onvif'] = config.getboolean(
+            'Scanning', 'onvif_discovery', fallback=False)
+        config_data['rescan_interval'] = config.getfloat(
+            'Scanning', 'rescan_interval', fallback=300.0)
+
     except (configparser.NoSectionError, configparser.NoOptionError, ValueError) as e:
         logging.error(f"Error reading configuration from '{config_file}': {e}")
         return None
@@ -76,6 +232,8 @@ def load_configuration():
     logging.debug(f"Video Port: {config_data['video_port']}")
     logging.debug(f"Control Port: {config_data['control_port']}")
     logging.debug(f"Resize Frame: {config_data['resize_frame']}")
+    logging.debug(f"Stream Mode: {config_data['stream_mode']}")
+    logging.debug(f"Capture Mode: {config_data['capture_mode']}")
     logging.debug(f"Cam User: {config_data['cam_user']}")
 
     return config_data
@@ -0,0 +1,47 @@
+import threading
+
+
+class CameraSet:
+    """The cameras currently being streamed, shared by the capture side and the merger.
+
+    Each camera has a stable id (the camera_id on the wire) and the frame slot its
+    capture worker publishes into. Every add or remove bumps `version`, so the merger
+    can notice a change with one comparison per pass and rebuild its per-camera state.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cameras = {}  # camera id -> (ip, slot)
+        self.version = 0
+
+    @classmethod
+    def from_slots(cls, slots, ip_addresses=None):
+        """Builds a fixed set with ids 0..n-1 from a list of frame slots."""
+        camera_set = cls()
+        for camera_id, slot in enumerate(slots):
+            ip = ip_addresses[camera_id] if ip_addresses else None
+            camera_set.add(camera_id, ip, slot)
+        return camera_set
+
+    def add(self, camera_id, ip, slot):
+        with self._lock:
+            self._cameras[camera_id] = (ip, slot)
+            self.version += 1
+
+    def remove(self, camera_id):
+        """Removes a camera and returns its slot, or None if it was not in the set."""
+        with self._lock:
+            entry = self._cameras.pop(camera_id, None)
+            if entry is not None:
+                self.version += 1
+        return entry[1] if entry is not None else None
+
+    def snapshot(self):
+        """Returns (version, [(camera_id, ip, slot), ...]) ordered by camera id."""
+        with self._lock:
+            return self.version, [(camera_id, ip, slot) for camera_id, (ip, slot)
+                                  in sorted(self._cameras.items())]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._cameras)
@@ -0,0 +1,73 @@
+import cv2
+import numpy as np
+
+
+class ChangeDetector:
+    """Cheap per-camera change detector used to skip encoding and sending static scenes.
+
+    Each frame is shrunk to a small grayscale thumbnail and compared with the thumbnail
+    of the last frame that was actually sent. Comparing against the last *sent* frame
+    (not the previous one) means slow changes, like light drifting over an hour, still
+    add up and eventually trigger a send.
+    """
+
+    def __init__(self, change_ratio=0.01, pixel_threshold=25, sample_size=(64, 36), refresh_interval=30.0, keepalive_interval=2.0):
+        """
+        Args:
+            change_ratio: Fraction of thumbnail pixels that must change to send a frame.
+            pixel_threshold: Gray level difference (0-255) for a pixel to count as changed.
+            sample_size: (width, height) of the thumbnail the diff runs on.
+            refresh_interval: Seconds after which a frame is sent even without change.
+            keepalive_interval: Seconds without any message after which a keepalive is due.
+        """
+        self.change_ratio = change_ratio
+        self.pixel_threshold = pixel_threshold
+        self.sample_size = sample_size
+        self.refresh_interval = refresh_interval
+        self.keepalive_interval = keepalive_interval
+
+        self._references = {}   # camera id -> thumbnail of last sent frame
+        self._last_sent = {}    # camera id -> time the last frame was sent
+        self._last_message = {} # camera id -> time of the last frame or keepalive
+        self.frames_suppressed = 0
+
+    def _thumbnail(self, frame):
+        small = cv2.resize(frame, self.sample_size, interpolation=cv2.INTER_AREA)
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        return small
+
+    def should_send(self, camera_id, frame, now):
+        """True if the frame differs materially from the last sent one, or a refresh is due."""
+        thumbnail = self._thumbnail(frame)
+        reference = self._references.get(camera_id)
+
+        send = (reference is None
+                or now - self._last_sent.get(camera_id, 0.0) >= self.refresh_interval)
+        if not send:
+            diff = cv2.absdiff(thumbnail, reference)
+            changed = np.count_nonzero(diff > self.pixel_threshold)
+            send = changed >= self.change_ratio * diff.size
+
+        if send:
+            self._references[camera_id] = thumbnail
+            self._last_sent[camera_id] = now
+            self._last_message[camera_id] = now
+        else:
+            self.frames_suppressed += 1
+        return send
+
+    def keepalive_due(self, camera_id, now):
+        """True if a suppressed camera has been quiet long enough to need a keepalive."""
+        last = self._last_message.get(camera_id)
+        if last is None or now - last < self.keepalive_interval:
+            return False
+        self._last_message[camera_id] = now
+        return True
+
+    def forget(self, camera_id=None):
+        """Drops the reference of one camera (or all), forcing the next frame to be sent."""
+        if camera_id is None:
+            self._references.clear()
+        else:
+            self._references.pop(camera_id, None)
@@ -0,0 +1,85 @@
+import math
+import cv2
+import numpy as np
+
+LAYOUT_HORIZONTAL = "horizontal"  # All cameras in a single row (the original strip)
+LAYOUT_AUTO = "auto"              # Smallest near-square grid that fits every camera
+
+
+def parse_layout(layout, num_cameras):
+    """Turns a layout setting into a (columns, rows) grid for num_cameras tiles.
+
+    Args:
+        layout: 'horizontal', 'auto', or an explicit '<columns>x<rows>' grid such as '2x2'.
+        num_cameras: Number of tiles the grid must hold.
+
+    Returns:
+        A (columns, rows) tuple.
+
+    Raises:
+        ValueError: If the layout is malformed or too small for num_cameras.
+    """
+    num_cameras = max(num_cameras, 1)
+    layout = (layout or LAYOUT_HORIZONTAL).strip().lower()
+
+    if layout == LAYOUT_HORIZONTAL:
+        return num_cameras, 1
+    if layout == LAYOUT_AUTO:
+        columns = math.ceil(math.sqrt(num_cameras))
+        return columns, math.ceil(num_cameras / columns)
+
+    try:
+        columns, rows = (int(part) for part in layout.split('x'))
+    except ValueError:
+        raise ValueError(
+            f"Invalid mosaic layout '{layout}'. Expected 'horizontal', 'auto' or '<columns>x<rows>'.")
+    if columns <= 0 or rows <= 0:
+        raise ValueError(f"Invalid mosaic layout '{layout}'.")
+    if columns * rows < num_cameras:
+        raise ValueError(
+            f"Mosaic layout {columns}x{rows} has room for {columns * rows} cameras, need {num_cameras}.")
+    return columns, rows
+
+
+class MosaicCompositor:
+    """Owns one preallocated mosaic canvas and draws each camera straight into its tile.
+
+    Frames are resized with cv2.resize(..., dst=tile) so no intermediate arrays are
+    allocated. Callers only pass new frames, so tiles of cameras that have not produced
+    a frame since the last mosaic keep their pixels and cost nothing.
+    """
+
+    def __init__(self, num_cameras, tile_size, layout=LAYOUT_HORIZONTAL):
+        self.num_cameras = num_cameras
+        self.tile_width, self.tile_height = tile_size
+        self.columns, self.rows = parse_layout(layout, num_cameras)
+        self.canvas = np.zeros((self.rows * self.tile_height,
+                                self.columns * self.tile_width, 3), dtype=np.uint8)
+        self._tiles = []
+        for index in range(num_cameras):
+            row, column = divmod(index, self.columns)
+            y = row * self.tile_height
+            x = column * self.tile_width
+            self._tiles.append(
+                self.canvas[y:y + self.tile_height, x:x + self.tile_width])
+
+    def update(self, index, frame):
+        """Draws a camera's frame into its tile. Returns False if there was no new frame."""
+        if frame is None:
+            return False
+        tile = self._tiles[index]
+        if frame.shape == tile.shape:
+            np.copyto(tile, frame)
+        else:
+            cv2.resize(frame, (self.tile_width, self.tile_height), dst=tile)
+        return True
+
+    def layout_info(self):
+        """Describes the grid so a receiver can cut the mosaic back into cameras."""
+        return {
+            'columns': self.columns,
+            'rows': self.rows,
+            'tile_width': self.tile_width,
+            'tile_height': self.tile_height,
+            'num_cameras': self.num_cameras,
+        }
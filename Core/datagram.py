@@ -0,0 +1,252 @@
+import struct
+import time
+from collections import OrderedDict
+import numpy as np
+from Core.protocol import BASE_HEADER_STRUCT, PAYLOAD_TIER_JPEG
+
+# UDP transport (transport = udp). Every protocol message (header and payload, as
+# it would go over TCP, see Core/protocol.py) is cut into fragments that each fit
+# one datagram:
+#
+#   magic(2) version(1) flags(1) fec_group(1) payload_type(1) tier(1) camera_id(2)
+#   index(2) count(2) message_id(4) length(4)
+#
+# message_id numbers the messages of one sender (wrapping at 2**32), index is the
+# fragment's position among the count data fragments and length the size of the
+# whole message. Every data fragment but the last carries the same number of bytes.
+#
+# With fec_group k > 0, each run of k data fragments is followed by a parity
+# fragment (FLAG_PARITY, index = number of the run): the XOR of the run's
+# fragments, zero-padded to the longest of them. It restores any single fragment
+# lost from its run, at a cost of 1/k extra bytes.
+#
+# camera_id, payload_type and tier (the simulcast tier of a PAYLOAD_TIER_JPEG,
+# else 0) repeat the message's, so the receiver knows before a message is complete
+# which stream it belongs to: an incomplete message is given up as soon as a newer
+# message of the same stream is complete (latest frame wins), or after
+# FRAGMENT_TIMEOUT seconds. A camera's frames, keepalives and tiers are separate
+# streams and never supersede each other.
+DATAGRAM_MAGIC = b'CU'
+DATAGRAM_VERSION = 1
+FRAGMENT_STRUCT = struct.Struct('>2sBBBBBHHHII')
+FLAG_PARITY = 0x01
+
+IP_UDP_OVERHEAD = 28       # IPv4 and UDP headers in front of every fragment
+DEFAULT_MTU = 1400         # Below the path MTU of most cellular links and VPN tunnels
+DEFAULT_FEC_GROUP = 4      # Data fragments per parity fragment; 0 sends no parity
+MAX_FEC_GROUP = 255
+MAX_DATAGRAM_SIZE = 65507  # Largest UDP payload over IPv4
+MESSAGE_ID_MODULO = 1 << 32
+FRAGMENT_TIMEOUT = 1.0     # Seconds an incomplete message waits for its missing fragments
+MAX_PARTIAL_MESSAGES = 256
+# A message id this close behind a stream's newest complete message is a late or
+# repeated fragment; further behind, the sender has restarted its numbering
+REORDER_WINDOW = 1024
+
+
+def fragment_size(mtu):
+    """Message bytes carried by each full fragment for a given path MTU."""
+    size = mtu - IP_UDP_OVERHEAD - FRAGMENT_STRUCT.size
+    if size <= 0:
+        raise ValueError(f"MTU {mtu} leaves no room for fragment data")
+    return size
+
+
+def _parity(view, size, count, fec_group):
+    """XOR of every fec_group fragments of view, as a (runs, size) uint8 array."""
+    runs = -(-count // fec_group)
+    padded = np.zeros(runs * fec_group * size, dtype=np.uint8)
+    padded[:view.nbytes] = np.frombuffer(view, dtype=np.uint8)
+    return np.bitwise_xor.reduce(padded.reshape(runs, fec_group, size), axis=1)
+
+
+def _stream_of(view):
+    """(payload_type, tier) of a protocol message, from its header."""
+    _, _, payload_type, _, flags, _, _ = BASE_HEADER_STRUCT.unpack_from(view)
+    return payload_type, flags if payload_type == PAYLOAD_TIER_JPEG else 0
+
+
+def iter_fragments(message, message_id, camera_id, mtu=DEFAULT_MTU, fec_group=0):
+    """Cuts one message (a contiguous buffer of header and payload) into fragments.
+
+    Yields:
+        (fragment header, data) pairs, one per datagram, data being a memoryview into
+        message. Each run's parity fragment follows the run.
+
+    Raises:
+        ValueError: If the message needs more than 65535 fragments.
+    """
+    view = memoryview(message).cast('B')
+    size = fragment_size(mtu)
+    count = max(-(-view.nbytes // size), 1)
+    if count > 0xFFFF:
+        raise ValueError(f"Message of {view.nbytes} bytes needs {count} fragments")
+    payload_type, tier = _stream_of(view)
+    parity = _parity(view, size, count, fec_group) if fec_group else None
+    for index in range(count):
+        yield (FRAGMENT_STRUCT.pack(DATAGRAM_MAGIC, DATAGRAM_VERSION, 0, fec_group, payload_type, tier,
+                                    camera_id, index, count, message_id, view.nbytes),
+               view[index * size:(index + 1) * size])
+        if parity is not None and (index % fec_group == fec_group - 1 or index == count - 1):
+            run = index // fec_group
+            yield (FRAGMENT_STRUCT.pack(DATAGRAM_MAGIC, DATAGRAM_VERSION, FLAG_PARITY, fec_group,
+                                        payload_type, tier, camera_id, run, count, message_id, view.nbytes),
+                   memoryview(parity[run])[:min(size, view.nbytes - run * fec_group * size)])
+
+
+class _PartialMessage:
+    """A message some of whose fragments have arrived."""
+
+    __slots__ = ('stream', 'count', 'length', 'fec_group', 'size', 'buffer', 'received',
+                 'parity', 'repaired', 'started')
+
+    def __init__(self, stream, count, length, fec_group, size, started):
+        self.stream = stream  # (camera_id, payload_type, tier)
+        self.count = count
+        self.length = length
+        self.fec_group = fec_group
+        self.size = size
+        self.buffer = bytearray(length)
+        self.received = set()  # Indexes of the data fragments in buffer
+        self.parity = {}       # Run number -> parity fragment
+        self.repaired = False
+        self.started = started
+
+    def fragment_length(self, index):
+        return self.size if index < self.count - 1 else self.length - (self.count - 1) * self.size
+
+    def parity_length(self, run):
+        return min(self.size, self.length - run * self.fec_group * self.size)
+
+    def add(self, index, data):
+        if index in self.received:
+            return
+        offset = index * self.size
+        self.buffer[offset:offset + data.nbytes] = data
+        self.received.add(index)
+
+    def repair(self, run):
+        """Restores the run's only missing fragment from its parity, if that is possible."""
+        parity = self.parity.get(run)
+        if parity is None:
+            return
+        indexes = range(run * self.fec_group, min((run + 1) * self.fec_group, self.count))
+        missing = [index for index in indexes if index not in self.received]
+        if len(missing) != 1:
+            return
+        restored = np.frombuffer(parity, dtype=np.uint8).copy()
+        data = np.frombuffer(self.buffer, dtype=np.uint8)
+        for index in indexes:
+            if index != missing[0]:
+                length = self.fragment_length(index)
+                restored[:length] ^= data[index * self.size:index * self.size + length]
+        self.add(missing[0], memoryview(restored)[:self.fragment_length(missing[0])])
+        self.repaired = True
+
+    @property
+    def complete(self):
+        return len(self.received) == self.count
+
+
+class FrameAssembler:
+    """Puts the messages of one sender back together from their fragments.
+
+    Fragments may arrive in any order; a message is returned as soon as all of its
+    data fragments are in, whether received or restored from parity. Incomplete
+    messages are given up once a newer message of the same stream (camera, payload
+    type and tier) is complete, so a lost fragment never holds back the frames
+    behind it.
+    """
+
+    def __init__(self, timeout=FRAGMENT_TIMEOUT, max_partial=MAX_PARTIAL_MESSAGES):
+        self.timeout = timeout
+        self.max_partial = max_partial
+        self._partial = OrderedDict()  # message id -> _PartialMessage, oldest first
+        self._newest = {}              # (camera id, payload type, tier) -> id of its newest complete message
+        self.messages_completed = 0
+        self.messages_repaired = 0     # Completed with the help of parity
+        self.messages_dropped = 0      # Given up incomplete
+        self.datagrams_invalid = 0
+        self.last_received = 0.0       # time.monotonic() of the last datagram
+
+    def _is_stale(self, stream, message_id):
+        newest = self._newest.get(stream)
+        return newest is not None and (newest - message_id) % MESSAGE_ID_MODULO < REORDER_WINDOW
+
+    def _drop(self, message_id):
+        del self._partial[message_id]
+        self.messages_dropped += 1
+
+    def _expire(self, now):
+        while self._partial:
+            message_id, partial = next(iter(self._partial.items()))
+            if now - partial.started < self.timeout and len(self._partial) <= self.max_partial:
+                break
+            self._drop(message_id)
+
+    def add(self, datagram):
+        """Takes one datagram (any buffer, only read during the call).
+
+        Returns:
+            (message, repaired) once a message is complete, message being a bytearray
+            of its header and payload and repaired True if parity restored part of it;
+            otherwise None.
+        """
+        now = time.monotonic()
+        self.last_received = now
+        view = memoryview(datagram).cast('B')
+        try:
+            magic, version, flags, fec_group, payload_type, tier, camera_id, index, count, message_id, length = \
+                FRAGMENT_STRUCT.unpack_from(view)
+        except struct.error:
+            self.datagrams_invalid += 1
+            return None
+        data = view[FRAGMENT_STRUCT.size:]
+        parity = bool(flags & FLAG_PARITY)
+        if (magic != DATAGRAM_MAGIC or version != DATAGRAM_VERSION or not count or not data.nbytes
+                or (parity and (not fec_group or index * fec_group >= count))
+                or (not parity and index >= count)):
+            self.datagrams_invalid += 1
+            return None
+        self._expire(now)
+        stream = (camera_id, payload_type, tier)
+        if self._is_stale(stream, message_id):
+            return None  # Late fragment of a message that is complete or superseded
+
+        partial = self._partial.get(message_id)
+        if partial is None:
+            # Every fragment has the full size, except the last data fragment and a
+            # parity fragment whose run is only that fragment
+            last = (index * fec_group if parity else index) == count - 1
+            size = (length - data.nbytes) // (count - 1) if last and count > 1 else data.nbytes
+            if size <= 0 or -(-length // size) != count:
+                self.datagrams_invalid += 1
+                return None
+            partial = self._partial[message_id] = _PartialMessage(
+                stream, count, length, fec_group, size, now)
+        if parity:
+            if data.nbytes != partial.parity_length(index):
+                self.datagrams_invalid += 1
+                return None
+            partial.parity[index] = bytes(data)
+            run = index
+        else:
+            if data.nbytes != partial.fragment_length(index):
+                self.datagrams_invalid += 1
+                return None
+            partial.add(index, data)
+            run = index // fec_group if fec_group else None
+        if run is not None and not partial.complete:
+            partial.repair(run)
+        if not partial.complete:
+            return None
+
+        del self._partial[message_id]
+        self._newest[stream] = message_id
+        for older_id in [older_id for older_id, older in self._partial.items()
+                         if older.stream == stream and self._is_stale(stream, older_id)]:
+            self._drop(older_id)
+        self.messages_completed += 1
+        if partial.repaired:
+            self.messages_repaired += 1
+        return partial.buffer, partial.repaired
@@ -0,0 +1,123 @@
+import json
+import os
+import time
+import logging
+import threading
+
+logging.basicConfig(level=logging.INFO,
+                    format="%(asctime)s - %(levelname)s - %(message)s")
+
+CACHE_VERSION = 1
+DEFAULT_CACHE_TTL = 86400.0  # Seconds a camera stays cached without being seen by a scan
+
+
+class DiscoveryCache:
+    """Cameras found by earlier scans, kept in a small JSON file.
+
+    Lets the next start stream immediately from the known camera set while a rescan
+    verifies it in the background. Entries are keyed by MAC address when known (so a
+    camera that got a new DHCP address keeps its entry) and by IP otherwise. Each entry
+    holds mac, ip, vendor, last_seen (Unix time) and stream_profile; entries not seen
+    for ttl seconds are dropped.
+    """
+
+    def __init__(self, path, ttl=DEFAULT_CACHE_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._entries = {}
+
+    def load(self):
+        """Reads the cache file; a missing or unreadable file gives an empty cache."""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return self
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ignoring unreadable discovery cache '{self.path}': {e}")
+            return self
+        if data.get('version') != CACHE_VERSION:
+            logging.warning(f"Ignoring discovery cache '{self.path}' with unknown version.")
+            return self
+        with self._lock:
+            self._entries = dict(data.get('cameras', {}))
+        self.prune()
+        return self
+
+    def save(self):
+        """Writes the cache atomically (temporary file + rename)."""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = f"{self.path}.tmp"
+        with self._save_lock:  # The rescan thread and the main loop both save
+            with self._lock:
+                data = {'version': CACHE_VERSION,
+                        'cameras': {key: dict(entry) for key, entry in self._entries.items()}}
+            try:
+                with open(temp_path, 'w', encoding='utf-8') as f:
+                    json.dump(data, f, indent=2, sort_keys=True)
+                os.replace(temp_path, self.path)
+            except OSError as e:
+                logging.error(f"Could not write discovery cache '{self.path}': {e}")
+
+    def prune(self, now=None):
+        """Drops entries not seen within the TTL. Returns how many were dropped."""
+        now = time.time() if now is None else now
+        with self._lock:
+            stale = [key for key, entry in self._entries.items()
+                     if now - entry.get('last_seen', 0) > self.ttl]
+            for key in stale:
+                del self._entries[key]
+        if stale:
+            logging.info(f"Expired {len(stale)} cached camera(s).")
+        return len(stale)
+
+    def update(self, results, now=None):
+        """Records cameras seen by a scan (dicts as returned by Core.scan_cam.scan_network)."""
+        now = time.time() if now is None else now
+        with self._lock:
+            for result in results:
+                key = result.get('mac') or result['ip']
+                if result.get('mac'):
+                    # A camera first cached by IP (no MAC then) is now known by its MAC
+                    self._entries.pop(result['ip'], None)
+                # The same IP may have been cached under another MAC (address reused)
+                for other_key, entry in list(self._entries.items()):
+                    if other_key != key and entry['ip'] == result['ip']:
+                        del self._entries[other_key]
+                previous = self._entries.get(key, {})
+                self._entries[key] = {
+                    'mac': result.get('mac'),
+                    'ip': result['ip'],
+                    'vendor': result.get('vendor') or previous.get('vendor'),
+                    'last_seen': now,
+                    'stream_profile': previous.get('stream_profile'),
+                }
+
+    def set_stream_profile(self, ip, profile):
+        """Stores the stream profile negotiated with the camera at this IP."""
+        with self._lock:
+            for entry in self._entries.values():
+                if entry['ip'] == ip:
+                    entry['stream_profile'] = profile
+
+    def get_stream_profile(self, ip):
+        with self._lock:
+            for entry in self._entries.values():
+                if entry['ip'] == ip:
+                    return entry.get('stream_profile')
+        return None
+
+    def camera_ips(self):
+        """IPs of the cached cameras that have not expired, sorted."""
+        self.prune()
+        with self._lock:
+            ips = [entry['ip'] for entry in self._entries.values()]
+        return sorted(ips, key=lambda ip: tuple(int(part) for part in ip.split('.')))
+
+    def entries(self):
+        with self._lock:
+            return [dict(entry) for entry in self._entries.values()]
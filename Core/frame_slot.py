@@ -0,0 +1,104 @@
+import queue
+import threading
+import numpy as np
+from Core.protocol import capture_now
+
+
+class LatestFrameSlot:
+    """Single-frame "latest wins" hand-off between one capture thread and the merger.
+
+    Replaces a bounded Queue: put() overwrites any unread frame instead of blocking or
+    dropping the oldest, and get_nowait() only ever returns the newest frame. The capture
+    thread can write frames into a small pool of reusable buffers (acquire_buffer) instead
+    of allocating a new array per frame; a frame returned by get_nowait() stays valid
+    until the following get_nowait() call. ready_event (shared by all cameras, see
+    Core.pacing.FramePacer) is set whenever a frame is published.
+    """
+
+    def __init__(self, buffers=3, ready_event=None):
+        self._lock = threading.Lock()
+        self._ready_event = ready_event
+        self._num_buffers = buffers
+        self._buffers = []
+        self._frame = None  # Published frame
+        self._taken = None  # Frame last handed to the consumer
+        self._frame_captured = None  # CaptureTime of the published frame
+        self._captured = None        # CaptureTime of the frame last handed to the consumer
+        self._seq = 0       # Number of frames published so far
+        self._read_seq = 0  # Sequence number of the last frame handed to the consumer
+        self._dropped = 0   # Frames overwritten before the consumer took them
+        self._dropped_total = 0
+        self._read_failures = 0
+
+    def put(self, frame, timeout=None, captured=None):
+        """Publishes a frame, replacing any frame the consumer has not taken yet.
+        captured is the frame's CaptureTime (default now)."""
+        with self._lock:
+            if self._seq != self._read_seq:
+                self._dropped += 1
+                self._dropped_total += 1
+            self._frame = frame
+            self._frame_captured = captured or capture_now()
+            self._seq += 1
+        if self._ready_event is not None:
+            self._ready_event.set()
+
+    def get_nowait(self):
+        """Returns the newest frame if one was published since the last call.
+
+        Raises:
+            queue.Empty: If there is no new frame.
+        """
+        with self._lock:
+            if self._seq == self._read_seq:
+                raise queue.Empty
+            self._read_seq = self._seq
+            self._taken = self._frame
+            self._captured = self._frame_captured
+            return self._frame
+
+    @property
+    def captured(self):
+        """CaptureTime of the frame last returned by get_nowait(), or None."""
+        return self._captured
+
+    def acquire_buffer(self, shape):
+        """Returns a preallocated buffer the capture thread can write its next frame into.
+
+        The buffer is neither the published frame nor the one the consumer holds, so
+        writing into it never changes a frame someone else is looking at.
+        """
+        with self._lock:
+            if not self._buffers or self._buffers[0].shape != shape:
+                self._buffers = [np.empty(shape, dtype=np.uint8)
+                                 for _ in range(self._num_buffers)]
+            for buffer in self._buffers:
+                if buffer is not self._frame and buffer is not self._taken:
+                    return buffer
+
+    def drain_dropped(self):
+        """Returns the number of frames overwritten unread since the last call."""
+        with self._lock:
+            dropped, self._dropped = self._dropped, 0
+            return dropped
+
+    def record_read_failure(self):
+        """Counts a frame the capture side failed to read from the camera."""
+        self._read_failures += 1
+
+    @property
+    def frames_published(self):
+        return self._seq
+
+    @property
+    def frames_dropped(self):
+        """Total frames overwritten unread (unlike drain_dropped, never reset)."""
+        return self._dropped_total
+
+    @property
+    def read_failures(self):
+        return self._read_failures
+
+    def wants_frame(self):
+        """True once the consumer has taken the last published frame (or none was published yet)."""
+        return self._read_seq == self._seq
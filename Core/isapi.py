@@ -0,0 +1,287 @@
+import logging
+import threading
+import xml.etree.ElementTree as ET
+import requests
+from requests.adapters import HTTPAdapter
+from requests.auth import HTTPDigestAuth
+
+logging.basicConfig(level=logging.INFO,
+                    format="%(asctime)s - %(levelname)s - %(message)s")
+
+ISAPI_NAMESPACE = "http://www.hikvision.com/ver20/XMLSchema"
+DEFAULT_TIMEOUT = 5.0        # Seconds per ISAPI request
+DEFAULT_MAX_CONCURRENT = 2   # ISAPI requests in flight per camera; cameras handle few at once
+MAIN_STREAM_CHANNEL = 101
+PTZ_CHANNEL = 1
+
+ET.register_namespace('', ISAPI_NAMESPACE)
+
+
+class SharedDigestAuth(HTTPDigestAuth):
+    """HTTPDigestAuth whose nonce is shared by all threads using it.
+
+    requests keeps the digest challenge per thread, so every worker thread would
+    first get a 401 from the camera. Here the newest challenge and its nonce count
+    are shared: after the first request, every request carries a valid
+    Authorization header and the 401 round trip only happens when the camera
+    rotates its nonce.
+    """
+
+    def __init__(self, username, password):
+        super().__init__(username, password)
+        self._lock = threading.Lock()
+        self._shared = ({}, "", 0)  # (challenge, last nonce, nonce count)
+
+    def __call__(self, r):
+        self.init_per_thread_state()
+        with self._lock:
+            if self._shared[1]:
+                # Lets requests add the header up front instead of waiting for a 401
+                self._thread_local.last_nonce = self._shared[1]
+        return super().__call__(r)
+
+    def build_digest_header(self, method, url):
+        with self._lock:
+            state = self._thread_local
+            if not state.chal or state.chal is getattr(state, 'adopted_chal', None):
+                # No newer challenge in this thread: continue from the shared one
+                state.chal, state.last_nonce, state.nonce_count = self._shared
+            header = super().build_digest_header(method, url)
+            self._shared = (state.chal, state.last_nonce, state.nonce_count)
+            state.adopted_chal = state.chal
+            return header
+
+
+def _find(element, name):
+    """First descendant with this local name, with or without the ISAPI namespace."""
+    for child in element.iter():
+        if child.tag == name or child.tag.endswith('}' + name):
+            return child
+    return None
+
+
+def _local_name(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+class IsapiClient:
+    """ISAPI client for one Hikvision camera.
+
+    Requests go through one requests.Session: connections are kept alive and the
+    digest nonce is reused (see SharedDigestAuth), so a command costs one round
+    trip instead of a new TCP connection plus a 401 challenge. At most
+    max_concurrent requests to the camera run at once; callers beyond that wait.
+
+    Methods log failures and return False (or None for reads), like the rest of the
+    control path, so one unreachable camera does not fail a command for the others.
+
+    Args:
+        host: Camera address, 'ip' or 'ip:port'.
+    """
+
+    def __init__(self, host, username, password, max_concurrent=DEFAULT_MAX_CONCURRENT,
+                 timeout=DEFAULT_TIMEOUT, scheme='http'):
+        self.host = host
+        self.base_url = f"{scheme}://{host}"
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self.session = requests.Session()
+        self.session.auth = SharedDigestAuth(username, password)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrent)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def request(self, method, path, **kwargs):
+        """Sends one request; returns the response, or None on a connection error or timeout."""
+        kwargs.setdefault('timeout', self.timeout)
+        with self._slots:
+            try:
+                return self.session.request(method, self.base_url + path, **kwargs)
+            except requests.exceptions.RequestException as e:
+                logging.error(f"ISAPI request {method} {path} to {self.host} failed: {e}")
+                return None
+
+    def _put_xml(self, path, root, action):
+        data = ET.tostring(root, encoding='utf-8', xml_declaration=True)
+        response = self.request('PUT', path, data=data,
+                                headers={"Content-Type": "application/xml"})
+        if response is None:
+            return False
+        if response.status_code != 200:
+            logging.error(
+                f"Failed to {action} on {self.host}. Status Code: {response.status_code}, Response: {response.text}")
+            return False
+        logging.info(f"{action.capitalize()} on {self.host} succeeded.")
+        return True
+
+    def get_xml(self, path):
+        """GETs an ISAPI resource and returns its parsed XML root, or None."""
+        response = self.request('GET', path)
+        if response is None:
+            return None
+        if response.status_code != 200:
+            logging.error(f"ISAPI GET {path} on {self.host} returned {response.status_code}.")
+            return None
+        try:
+            return ET.fromstring(response.content)
+        except ET.ParseError as e:
+            logging.error(f"Invalid XML from {self.host} for {path}: {e}")
+            return None
+
+    def get_capabilities(self, channel):
+        """Options a streaming channel supports, from its ISAPI capabilities.
+
+        Returns a dict with 'resolutions' [(width, height)], 'frame_rates' [fps] and
+        'codecs' [name], each empty if the camera does not list it, or None on failure.
+        """
+        root = self.get_xml(f"/ISAPI/Streaming/channels/{channel}/capabilities")
+        if root is None:
+            return None
+
+        def options(name, convert):
+            element = _find(root, name)
+            values = []
+            for value in (element.get('opt', '') if element is not None else '').split(','):
+                value = value.strip()
+                if not value:
+                    continue
+                try:
+                    values.append(convert(value))
+                except ValueError:
+                    pass
+            return values
+
+        # Widths and heights are listed as two parallel option lists
+        resolutions = list(dict.fromkeys(zip(options('videoResolutionWidth', int),
+                                             options('videoResolutionHeight', int))))
+        frame_rates = [rate / 100 for rate in options('maxFrameRate', int) if rate > 0]
+        return {'resolutions': resolutions, 'frame_rates': frame_rates,
+                'codecs': options('videoCodecType', str)}
+
+    def get_video(self, channel=MAIN_STREAM_CHANNEL):
+        """Current video settings of a channel: dict of width, height, fps, codec; or None."""
+        root = self.get_xml(f"/ISAPI/Streaming/channels/{channel}")
+        video = _find(root, 'Video') if root is not None else None
+        if video is None:
+            return None
+        values = {_local_name(element.tag): element.text for element in video.iter()}
+        try:
+            return {'width': int(values['videoResolutionWidth']),
+                    'height': int(values['videoResolutionHeight']),
+                    'fps': int(values['maxFrameRate']) / 100,
+                    'codec': values.get('videoCodecType')}
+        except (KeyError, TypeError, ValueError):
+            logging.error(f"Channel {channel} of {self.host} has incomplete video settings.")
+            return None
+
+    def update_video(self, channel=MAIN_STREAM_CHANNEL, width=None, height=None,
+                     bitrate=None, fps=None, codec=None):
+        """Changes video settings of a streaming channel (read-modify-write of its config).
+        Nothing is written if the channel already has the requested settings.
+
+        Args:
+            bitrate: Bitrate cap in kbit/s (applies to both CBR and VBR).
+            fps: Frame rate in frames per second.
+            codec: ISAPI codec name, e.g. 'H.264'.
+        """
+        path = f"/ISAPI/Streaming/channels/{channel}"
+        root = self.get_xml(path)
+        if root is None:
+            return False
+        video = _find(root, 'Video')
+        if video is None:
+            logging.error(f"Channel {channel} of {self.host} has no video settings.")
+            return False
+        settings = []  # (description, [(element names, value)])
+        if width is not None and height is not None:
+            settings.append((f"resolution {width}x{height}",
+                             [(('videoResolutionWidth',), int(width)), (('videoResolutionHeight',), int(height))]))
+        if bitrate is not None:
+            settings.append((f"bitrate {bitrate} kbit/s", [(('constantBitRate', 'vbrUpperCap'), int(bitrate))]))
+        if fps is not None:
+            # ISAPI frame rates are in hundredths of a frame per second
+            settings.append((f"fps {fps}", [(('maxFrameRate',), int(round(float(fps) * 100)))]))
+        if codec is not None:
+            settings.append((f"codec {codec}", [(('videoCodecType',), codec)]))
+
+        changed = []
+        for description, fields in settings:
+            for names, value in fields:
+                elements = [element for element in (_find(video, name) for name in names)
+                            if element is not None]
+                if not elements:
+                    logging.error(f"Channel {channel} of {self.host} has no {' or '.join(names)} setting.")
+                    return False
+                for element in elements:
+                    if element.text != str(value):
+                        element.text = str(value)
+                        if description not in changed:
+                            changed.append(description)
+        if not changed:
+            return True
+        return self._put_xml(path, root, f"set {', '.join(changed)} of channel {channel}")
+
+    def set_resolution(self, width, height, channel=MAIN_STREAM_CHANNEL):
+        return self.update_video(channel, width=width, height=height)
+
+    def set_bitrate(self, bitrate, channel=MAIN_STREAM_CHANNEL):
+        return self.update_video(channel, bitrate=bitrate)
+
+    def set_fps(self, fps, channel=MAIN_STREAM_CHANNEL):
+        return self.update_video(channel, fps=fps)
+
+    def move(self, pan, tilt, zoom=0, channel=PTZ_CHANNEL):
+        """Starts a continuous PTZ move; speeds are -100..100 and all zeros stop it."""
+        root = ET.Element(f"{{{ISAPI_NAMESPACE}}}PTZData")
+        for name, value in (('pan', pan), ('tilt', tilt), ('zoom', zoom)):
+            ET.SubElement(root, f"{{{ISAPI_NAMESPACE}}}{name}").text = str(max(-100, min(100, int(value))))
+        return self._put_xml(f"/ISAPI/PTZCtrl/channels/{channel}/continuous", root,
+                             f"move pan={pan} tilt={tilt} zoom={zoom}")
+
+    def stop_move(self, channel=PTZ_CHANNEL):
+        return self.move(0, 0, 0, channel)
+
+    def snapshot(self, channel=MAIN_STREAM_CHANNEL):
+        """Returns a JPEG snapshot of the channel as bytes, or None."""
+        response = self.request('GET', f"/ISAPI/Streaming/channels/{channel}/picture")
+        if response is None:
+            return None
+        if response.status_code != 200 or not response.content:
+            logging.error(f"Snapshot of {self.host} failed. Status Code: {response.status_code}")
+            return None
+        return response.content
+
+    def close(self):
+        self.session.close()
+
+
+class IsapiClients:
+    """One IsapiClient per camera address, created on first use and shared by all callers."""
+
+    def __init__(self, username, password, **client_options):
+        self.username = username
+        self.password = password
+        self.client_options = client_options
+        self._lock = threading.Lock()
+        self._clients = {}
+
+    def get(self, host):
+        with self._lock:
+            client = self._clients.get(host)
+            if client is None:
+                client = IsapiClient(host, self.username, self.password, **self.client_options)
+                self._clients[host] = client
+            return client
+
+    def retain(self, hosts):
+        """Closes the clients of cameras not in hosts (e.g. after they left the camera set)."""
+        hosts = set(hosts)
+        with self._lock:
+            for host in [host for host in self._clients if host not in hosts]:
+                self._clients.pop(host).close()
+
+    def close(self):
+        with self._lock:
+            for client in self._clients.values():
+                client.close()
+            self._clients.clear()
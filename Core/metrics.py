@@ -0,0 +1,252 @@
+import threading
+import logging
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from Core.protocol import MOSAIC_CAMERA_ID
+
+logging.basicConfig(level=logging.INFO,
+                    format="%(asctime)s - %(levelname)s - %(message)s")
+
+# Default histogram buckets, in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class _Shards:
+    """Per-thread storage for metric values.
+
+    Each thread only ever writes to its own shard, so updates need no lock. Readers
+    sum all shards; a value read while a thread is updating may be one step behind,
+    which is fine for monitoring.
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._local = threading.local()
+        self._all = []
+
+    def mine(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._factory()
+            self._local.shard = shard
+            self._all.append(shard)  # list.append is atomic
+        return shard
+
+    def all(self):
+        return list(self._all)
+
+
+class Counter:
+    """Monotonic counter."""
+
+    def __init__(self):
+        self._shards = _Shards(lambda: [0])
+
+    def inc(self, amount=1):
+        self._shards.mine()[0] += amount
+
+    @property
+    def value(self):
+        return sum(shard[0] for shard in self._shards.all())
+
+
+class Gauge:
+    """Value that can go up and down. Either set() it or give it a callback."""
+
+    def __init__(self, callback=None):
+        self._value = 0
+        self._callback = callback
+
+    def set(self, value):
+        self._value = value
+
+    @property
+    def value(self):
+        return self._callback() if self._callback is not None else self._value
+
+
+class Histogram:
+    """Cumulative histogram with fixed bucket upper bounds."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        # Shard layout: [count per bucket..., count in +Inf, sum]
+        self._shards = _Shards(lambda: [0] * (len(self.buckets) + 1) + [0.0])
+
+    def observe(self, value):
+        shard = self._shards.mine()
+        shard[bisect_left(self.buckets, value)] += 1
+        shard[-1] += value
+
+    def snapshot(self):
+        """Returns (cumulative bucket counts incl. +Inf, total count, sum)."""
+        counts = [0] * (len(self.buckets) + 1)
+        total_sum = 0.0
+        for shard in self._shards.all():
+            for i in range(len(counts)):
+                counts[i] += shard[i]
+            total_sum += shard[-1]
+        cumulative = []
+        running = 0
+        for count in counts:
+            running += count
+            cumulative.append(running)
+        return cumulative, running, total_sum
+
+
+class MetricFamily:
+    """A named metric with optional labels, e.g. frames_total{camera="0"}."""
+
+    def __init__(self, name, help_text, kind, label_names=(), factory=None):
+        self.name = name
+        self.help_text = help_text
+        self.kind = kind
+        self.label_names = tuple(label_names)
+        self._factory = factory
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *label_values):
+        """Returns the child metric for these label values, creating it on first use."""
+        key = tuple(str(value) for value in label_values)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._factory())
+        return child
+
+    def remove(self, *label_values):
+        with self._lock:
+            self._children.pop(tuple(str(value) for value in label_values), None)
+
+    def children(self):
+        return list(self._children.items())
+
+    # Unlabelled shortcuts
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def set(self, value):
+        self.labels().set(value)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+
+class MetricsRegistry:
+    """Holds metric families and renders them in the Prometheus text format."""
+
+    def __init__(self, prefix='camjp_'):
+        self.prefix = prefix
+        self._families = {}
+        self._lock = threading.Lock()
+
+    def _family(self, name, help_text, kind, label_names, factory):
+        with self._lock:
+            family = self._families.get(name)
+            if family is None:
+                family = MetricFamily(self.prefix + name, help_text, kind,
+                                      label_names, factory)
+                self._families[name] = family
+            return family
+
+    def counter(self, name, help_text, label_names=()):
+        return self._family(name, help_text, 'counter', label_names, Counter)
+
+    def gauge(self, name, help_text, label_names=()):
+        return self._family(name, help_text, 'gauge', label_names, Gauge)
+
+    def histogram(self, name, help_text, label_names=(), buckets=LATENCY_BUCKETS):
+        return self._family(name, help_text, 'histogram', label_names,
+                            lambda: Histogram(buckets))
+
+    def register_callback(self, kind, name, help_text, callback, label_names=(), label_values=()):
+        """Registers a counter or gauge whose value is read from callback() at scrape time.
+
+        Used for values that already exist elsewhere, e.g. a frame ring's sequence
+        number, which a capture process updates in shared memory. Registering the same
+        labels again replaces the previous callback.
+        """
+        family = self._family(name, help_text, kind, label_names, Gauge)
+        key = tuple(str(value) for value in label_values)
+        with family._lock:
+            family._children[key] = Gauge(callback)
+        return family
+
+    def render(self):
+        """Renders every metric in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            families = list(self._families.values())
+        for family in families:
+            lines.append(f"# HELP {family.name} {family.help_text}")
+            lines.append(f"# TYPE {family.name} {family.kind}")
+            for label_values, child in sorted(family.children()):
+                labels = ','.join(f'{name}="{value}"' for name, value in
+                                  zip(family.label_names, label_values))
+                if family.kind == 'histogram':
+                    cumulative, count, total = child.snapshot()
+                    bounds = [str(bound) for bound in child.buckets] + ['+Inf']
+                    for bound, bucket_count in zip(bounds, cumulative):
+                        bucket_labels = ','.join(filter(None, [labels, f'le="{bound}"']))
+                        lines.append(f"{family.name}_bucket{{{bucket_labels}}} {bucket_count}")
+                    suffix = f"{{{labels}}}" if labels else ''
+                    lines.append(f"{family.name}_count{suffix} {count}")
+                    lines.append(f"{family.name}_sum{suffix} {total}")
+                else:
+                    suffix = f"{{{labels}}}" if labels else ''
+                    try:
+                        value = child.value
+                    except Exception as e:
+                        logging.debug(f"Metric callback for {family.name} failed: {e}")
+                        continue
+                    lines.append(f"{family.name}{suffix} {value}")
+        return '\n'.join(lines) + '\n'
+
+
+def camera_label(camera_id):
+    """Label value for a stream: the camera id, or 'mosaic' for the merged stream."""
+    return 'mosaic' if camera_id == MOSAIC_CAMERA_ID else str(camera_id)
+
+
+# Registry shared by the capture, streaming and control code of this process
+REGISTRY = MetricsRegistry()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug(f"Metrics request: {format % args}")
+
+
+def start_metrics_server(port, host='127.0.0.1', registry=REGISTRY):
+    """Serves /metrics in the Prometheus text format from a daemon thread.
+
+    Returns:
+        The running ThreadingHTTPServer, or None if it could not be started.
+    """
+    handler = type('MetricsHandler', (_MetricsHandler,), {'registry': registry})
+    try:
+        server = ThreadingHTTPServer((host, port), handler)
+    except OSError as e:
+        logging.error(f"Could not start metrics server on {host}:{port}: {e}")
+        return None
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever,
+                              name="MetricsServer", daemon=True)
+    thread.start()
+    logging.info(f"Serving metrics on http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,63 @@
+import time
+
+IDLE_WAKE_INTERVAL = 0.5  # Seconds between wakeups while no camera delivers frames
+POLL_INTERVAL = 0.001     # Fallback polling interval for slots that do not notify
+
+
+class FramePacer:
+    """Decides when stream_merged_frames collects the cameras' frames for its next output frame.
+
+    Capture workers set frames_ready (shared by every camera's slot, see
+    LatestFrameSlot and FrameRing) whenever they publish a frame, and the merger
+    sleeps on it instead of polling its queues, so it costs no CPU while the cameras
+    are down. After a wakeup the pacer holds the merger until the next output tick
+    (at most one output frame per interval) and for at least batch_window seconds,
+    so cameras whose frames arrive close together land in the same mosaic instead of
+    each triggering one of its own.
+
+    frames_ready is a threading.Event, or a multiprocessing.Event when capture runs
+    in processes. Without it, the pacer falls back to polling every POLL_INTERVAL.
+    """
+
+    def __init__(self, stop_event, frames_ready=None, target_fps=0.0, batch_window=0.0):
+        self.stop_event = stop_event
+        self.frames_ready = frames_ready
+        self._polling = frames_ready is None
+        self.target_interval = 1.0 / target_fps if target_fps and target_fps > 0 else 0.0
+        self.batch_window = batch_window
+        self._next_emit = 0.0  # time.monotonic() of the next output tick
+
+    def notify(self):
+        """Wakes the merger, e.g. once an encode finished and its stream takes frames again."""
+        if self.frames_ready is not None:
+            self.frames_ready.set()
+
+    def wait(self, interval=0.0):
+        """Blocks until the merger should collect frames.
+
+        interval is the minimum time between output frames requested by someone else
+        (e.g. the rate controller); the longer of it and the target interval applies.
+
+        Returns:
+            False if no frame was announced (or stop_event is set), in which case the
+            merger should only re-check its camera set and call wait() again.
+        """
+        if self._polling:
+            self.stop_event.wait(POLL_INTERVAL)
+        elif not self.frames_ready.wait(IDLE_WAKE_INTERVAL):
+            return False
+        interval = max(interval, self.target_interval)
+        delay = max(min(self._next_emit - time.monotonic(), interval), self.batch_window)
+        if delay > 0:
+            # Frames published meanwhile are collected together with the one that woke us
+            self.stop_event.wait(delay)
+        if not self._polling:
+            self.frames_ready.clear()  # Cleared before collecting, so no publish is missed
+        return not self.stop_event.is_set()
+
+    def emitted(self, interval=0.0):
+        """Schedules the next output tick after frames were collected."""
+        interval = max(interval, self.target_interval)
+        now = time.monotonic()
+        # Keep a steady cadence, but don't burst to catch up after a stall
+        self._next_emit = max(self._next_emit + interval, now) if interval > 0 else now
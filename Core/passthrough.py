@@ -0,0 +1,128 @@
+import base64
+import threading
+import cv2
+from Core.protocol import CODEC_UNKNOWN, CODEC_H264, CODEC_H265, CODEC_MJPEG, CODEC_MPEG4, CODEC_NAMES, capture_now, video_flags
+
+MAX_QUEUED_PACKETS = 300  # Packets a PacketQueue holds before dropping up to the next keyframe
+
+# FourCCs reported by the FFmpeg backend, lower-cased
+_FOURCC_CODECS = {'h264': CODEC_H264, 'avc1': CODEC_H264, 'x264': CODEC_H264,
+                  'hevc': CODEC_H265, 'h265': CODEC_H265, 'hev1': CODEC_H265, 'hvc1': CODEC_H265,
+                  'mjpg': CODEC_MJPEG, 'jpeg': CODEC_MJPEG,
+                  'fmp4': CODEC_MPEG4, 'mp4v': CODEC_MPEG4, 'xvid': CODEC_MPEG4, 'divx': CODEC_MPEG4}
+
+
+def open_packet_capture(source, capture_factory=None):
+    """Opens a stream with the FFmpeg backend in raw mode: read() then returns the
+    demuxed, still encoded packets (Annex B for H.264/H.265) instead of decoded frames."""
+    capture_factory = capture_factory or cv2.VideoCapture
+    cap = capture_factory(source, cv2.CAP_FFMPEG)
+    if cap.isOpened():
+        cap.set(cv2.CAP_PROP_FORMAT, -1)
+    return cap
+
+
+def packet_stream_info(cap):
+    """Codec parameters of an open raw-mode capture, as sent in PAYLOAD_VIDEO_CONFIG.
+
+    Returns a JSON-friendly dict with codec (see Core.protocol.CODEC_NAMES), fourcc,
+    width, height, fps and extradata (codec setup such as SPS/PPS, base64).
+    """
+    fourcc_code = int(cap.get(cv2.CAP_PROP_FOURCC))
+    fourcc = ''.join(chr((fourcc_code >> (8 * i)) & 0xFF) for i in range(4)).strip('\x00 ')
+    codec = _FOURCC_CODECS.get(fourcc.lower(), CODEC_UNKNOWN)
+    extradata = b''
+    extradata_index = int(cap.get(cv2.CAP_PROP_CODEC_EXTRADATA_INDEX))
+    if extradata_index > 0:
+        ret, data = cap.retrieve(flag=extradata_index)
+        if ret and data is not None:
+            extradata = data.tobytes()
+    return {'codec': CODEC_NAMES[codec], 'codec_id': codec, 'fourcc': fourcc,
+            'width': int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            'height': int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+            'fps': cap.get(cv2.CAP_PROP_FPS),
+            'extradata': base64.b64encode(extradata).decode('ascii')}
+
+
+class PacketQueue:
+    """Ordered hand-off of encoded packets from one relay thread to the passthrough streamer.
+
+    Unlike LatestFrameSlot nothing is replaced: every packet is needed to decode the
+    ones after it. If the streamer falls more than max_packets behind, the queued
+    packets are dropped and so are new ones until the next keyframe, where the
+    receiver can start decoding again. ready_event (shared by all cameras) is set on
+    every put so the streamer can wait instead of polling.
+
+    Exposes the same counters as the frame slots (frames_published, frames_dropped,
+    read_failures), counted in packets, so the capture metrics cover passthrough too.
+    """
+
+    def __init__(self, ready_event=None, max_packets=MAX_QUEUED_PACKETS):
+        self._lock = threading.Lock()
+        self._packets = []
+        self._max_packets = max_packets
+        self._ready_event = ready_event
+        self._awaiting_keyframe = False
+        self._stream_info = None
+        self._stream_info_version = 0
+        self._published = 0
+        self._dropped = 0
+        self._read_failures = 0
+
+    def put(self, packet, keyframe, captured=None):
+        """Queues one encoded packet (bytes or a uint8 array) of the current stream.
+        captured is the CaptureTime it was read at (default now)."""
+        with self._lock:
+            if self._awaiting_keyframe and not keyframe:
+                self._dropped += 1
+                return
+            self._awaiting_keyframe = False
+            if len(self._packets) >= self._max_packets:
+                self._dropped += len(self._packets) + (0 if keyframe else 1)
+                self._packets = []
+                if not keyframe:
+                    self._awaiting_keyframe = True
+                    return
+            codec = self._stream_info['codec_id'] if self._stream_info else CODEC_UNKNOWN
+            self._packets.append((packet, video_flags(codec, keyframe), captured or capture_now()))
+            self._published += 1
+        if self._ready_event is not None:
+            self._ready_event.set()
+
+    def get_all(self):
+        """Returns and removes every queued (packet, flags, captured) tuple, oldest first."""
+        with self._lock:
+            packets, self._packets = self._packets, []
+            return packets
+
+    def set_stream_info(self, info):
+        """Records the codec parameters of a newly opened stream (see packet_stream_info).
+        Packets queued from the previous stream are dropped; decoding restarts at a keyframe."""
+        with self._lock:
+            self._dropped += len(self._packets)
+            self._packets = []
+            self._awaiting_keyframe = True
+            self._stream_info = info
+            self._stream_info_version += 1
+        if self._ready_event is not None:
+            self._ready_event.set()
+
+    def stream_info(self):
+        """Returns (version, info) of the current stream; version changes on every set_stream_info."""
+        with self._lock:
+            return self._stream_info_version, self._stream_info
+
+    def record_read_failure(self):
+        self._read_failures += 1
+
+    @property
+    def frames_published(self):
+        return self._published
+
+    @property
+    def frames_dropped(self):
+        return self._dropped
+
+    @property
+    def read_failures(self):
+        return self._read_failures
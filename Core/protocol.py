@@ -0,0 +1,289 @@
+import struct
+import time
+from collections import namedtuple
+
+# Wire format shared by the edge streamer and the VPS receiver.
+# Every message is a fixed-size header followed by `length` payload bytes:
+#
+#   magic(2) version(1) payload_type(1) camera_id(2) flags(2) seq(4) length(4)
+#   capture_time_us(8) capture_monotonic_us(8) encode_delay_us(4) send_delay_us(4)
+#
+# All fields are big-endian. `seq` is a per-camera counter incremented for
+# every frame the edge produces for that camera, so a gap at the receiver means
+# frames were dropped on the way (a keepalive repeats the last seq).
+#
+# The timing block (version 2) traces a frame through the edge: when it was
+# captured, by the wall clock (comparable with the receiver's clock if both are
+# NTP-synced) and by the edge's monotonic clock, and how long after capture it
+# finished encoding and started going out on the uplink. Messages that are not
+# camera frames (layouts, camera sets, keepalives) have a capture time of 0.
+# Version 1 headers end before the timing block; receivers still accept them.
+#
+# Frames the edge could not send during an uplink outage are spooled to disk
+# (Core/spool.py) and sent later as PAYLOAD_SPOOLED messages: an 8-byte spool id
+# followed by the complete original message. The receiver confirms each one with
+# a PAYLOAD_SPOOL_ACK carrying the spool id, the only message type that travels
+# from the receiver to the edge.
+#
+# With simulcast (Core/simulcast.py), a camera's frames also go out as smaller
+# PAYLOAD_TIER_JPEG encodings, each tier with its own seq; the camera set message
+# lists the size and frame rate of every tier.
+#
+# The same messages can go over UDP instead (transport = udp), cut into datagrams
+# as described in Core/datagram.py.
+PROTOCOL_MAGIC = b'CJ'
+PROTOCOL_VERSION = 2
+BASE_HEADER_STRUCT = struct.Struct('>2sBBHHII')
+BASE_HEADER_SIZE = BASE_HEADER_STRUCT.size
+TIMING_STRUCT = struct.Struct('>qqII')
+HEADER_STRUCT = struct.Struct('>2sBBHHIIqqII')
+HEADER_SIZE = HEADER_STRUCT.size
+SUPPORTED_VERSIONS = (1, 2)
+_SEND_DELAY_OFFSET = HEADER_SIZE - 4
+_MAX_DELAY_US = (1 << 32) - 1
+
+# Payload types
+PAYLOAD_JPEG = 1         # One camera's JPEG frame
+PAYLOAD_MOSAIC_JPEG = 2  # Every camera merged into one JPEG grid
+PAYLOAD_LAYOUT = 3       # JSON description of the mosaic grid, sent before mosaic frames
+PAYLOAD_KEEPALIVE = 4    # Empty; camera is alive but its image has not changed
+PAYLOAD_TILES = 5        # Changed tiles of one camera frame (see Core/tiles.py)
+PAYLOAD_CAMERAS = 6      # JSON list of the cameras currently streamed, sent whenever it changes
+PAYLOAD_VIDEO_PACKET = 7  # One encoded packet of a camera's video, passed through unchanged
+PAYLOAD_VIDEO_CONFIG = 8  # JSON codec parameters of a camera's passthrough video, sent before its packets
+PAYLOAD_SPOOLED = 9      # A frame replayed from the edge's spool, wrapped with its spool id
+PAYLOAD_SPOOL_ACK = 10   # Receiver -> edge: the spooled frame with this id was received
+PAYLOAD_TIER_JPEG = 11   # A smaller simulcast encoding of one camera's frame; flags = tier number
+
+# flags of PAYLOAD_VIDEO_PACKET messages: a keyframe bit and the codec in bits 4-7
+FLAG_KEYFRAME = 0x0001
+CODEC_SHIFT = 4
+CODEC_MASK = 0x00F0
+CODEC_UNKNOWN = 0
+CODEC_H264 = 1
+CODEC_H265 = 2
+CODEC_MJPEG = 3
+CODEC_MPEG4 = 4
+CODEC_NAMES = {CODEC_UNKNOWN: 'unknown', CODEC_H264: 'h264', CODEC_H265: 'hevc',
+               CODEC_MJPEG: 'mjpeg', CODEC_MPEG4: 'mpeg4'}
+
+# camera_id used for messages that are not tied to a single camera
+MOSAIC_CAMERA_ID = 0xFFFF
+
+MAX_PAYLOAD_SIZE = 15 * 1024 * 1024
+SEQ_MODULO = 1 << 32
+SPOOL_ID_STRUCT = struct.Struct('>Q')  # Prefix of PAYLOAD_SPOOLED and payload of PAYLOAD_SPOOL_ACK
+
+FrameHeader = namedtuple(
+    'FrameHeader', ['payload_type', 'camera_id', 'flags', 'seq', 'length',
+                    'capture_time', 'capture_monotonic', 'encode_delay', 'send_delay'],
+    defaults=(None, None, None, None))
+FrameHeader.__doc__ = """A parsed header. The timing fields are in seconds, or None if the
+message carries no capture time (or came with a version 1 header)."""
+
+# When a frame was captured: wall clock (time.time()) and edge monotonic clock
+CaptureTime = namedtuple('CaptureTime', ['wall', 'monotonic'])
+
+
+def capture_now():
+    """CaptureTime of a frame read from a camera right now."""
+    return CaptureTime(time.time(), time.monotonic())
+
+
+def video_flags(codec, keyframe):
+    """flags for a PAYLOAD_VIDEO_PACKET message."""
+    return ((codec << CODEC_SHIFT) & CODEC_MASK) | (FLAG_KEYFRAME if keyframe else 0)
+
+
+def parse_video_flags(flags):
+    """Returns (codec, keyframe) from the flags of a PAYLOAD_VIDEO_PACKET message."""
+    return (flags & CODEC_MASK) >> CODEC_SHIFT, bool(flags & FLAG_KEYFRAME)
+
+
+class ProtocolError(Exception):
+    """Raised when a received header is malformed or unsupported."""
+
+
+def _delay_us(since, until):
+    return min(max(int((until - since) * 1e6), 0), _MAX_DELAY_US)
+
+
+def pack_header(payload_type, camera_id, seq, length, flags=0, captured=None, encoded_at=None):
+    """Builds the header for a message.
+
+    Args:
+        captured: CaptureTime of the frame the message carries, or None.
+        encoded_at: time.monotonic() when its encoding finished; defaults to now.
+
+    Returns:
+        A bytearray, so the sender can fill in the send delay (stamp_send_time).
+    """
+    capture_time_us = capture_monotonic_us = encode_delay_us = 0
+    if captured is not None:
+        capture_time_us = int(captured.wall * 1e6)
+        capture_monotonic_us = int(captured.monotonic * 1e6)
+        encode_delay_us = _delay_us(captured.monotonic,
+                                    time.monotonic() if encoded_at is None else encoded_at)
+    return bytearray(HEADER_STRUCT.pack(PROTOCOL_MAGIC, PROTOCOL_VERSION, payload_type,
+                                        camera_id, flags, seq % SEQ_MODULO, length,
+                                        capture_time_us, capture_monotonic_us, encode_delay_us, 0))
+
+
+def stamp_send_time(header, sent_at=None):
+    """Records in a packed header how long after capture the message started sending.
+
+    sent_at is a time.monotonic() value (default now). Returns that delay in seconds,
+    or None for a header without a capture time, which is left as it is.
+    """
+    capture_monotonic_us = TIMING_STRUCT.unpack_from(header, BASE_HEADER_SIZE)[1]
+    if not capture_monotonic_us:
+        return None
+    sent_at = time.monotonic() if sent_at is None else sent_at
+    send_delay_us = _delay_us(capture_monotonic_us / 1e6, sent_at)
+    struct.pack_into('>I', header, _SEND_DELAY_OFFSET, send_delay_us)
+    return send_delay_us / 1e6
+
+
+def header_size(base_header_bytes):
+    """Size of the whole header given its first BASE_HEADER_SIZE bytes (it depends on the version)."""
+    version = base_header_bytes[2]
+    if version not in SUPPORTED_VERSIONS:
+        raise ProtocolError(f"Unsupported protocol version {version}")
+    return BASE_HEADER_SIZE if version == 1 else HEADER_SIZE
+
+
+def unpack_header(header_bytes):
+    """Parses and validates a version 1 or 2 header, returning a FrameHeader."""
+    magic, version, payload_type, camera_id, flags, seq, length = BASE_HEADER_STRUCT.unpack_from(
+        header_bytes)
+    if magic != PROTOCOL_MAGIC:
+        raise ProtocolError(f"Bad magic {magic!r}")
+    if len(header_bytes) != header_size(header_bytes):
+        raise ProtocolError(f"Truncated version {version} header")
+    if length > MAX_PAYLOAD_SIZE:
+        raise ProtocolError(f"Payload length {length} exceeds {MAX_PAYLOAD_SIZE}")
+    if version == 1:
+        return FrameHeader(payload_type, camera_id, flags, seq, length)
+    capture_time_us, capture_monotonic_us, encode_delay_us, send_delay_us = TIMING_STRUCT.unpack_from(
+        header_bytes, BASE_HEADER_SIZE)
+    if not capture_time_us:
+        return FrameHeader(payload_type, camera_id, flags, seq, length)
+    return FrameHeader(payload_type, camera_id, flags, seq, length,
+                       capture_time_us / 1e6, capture_monotonic_us / 1e6,
+                       encode_delay_us / 1e6, send_delay_us / 1e6)
+
+
+def unpack_message(message):
+    """Parses one complete message (header and payload) held in a buffer.
+
+    Returns:
+        A (FrameHeader, memoryview payload) tuple; the payload is a view into message.
+
+    Raises:
+        ProtocolError: If the header is malformed or the payload is cut short.
+    """
+    view = memoryview(message).cast('B')
+    if view.nbytes < BASE_HEADER_SIZE:
+        raise ProtocolError("Truncated header")
+    size = header_size(view)
+    if view.nbytes < size:
+        raise ProtocolError("Truncated header")
+    header = unpack_header(view[:size])
+    payload = view[size:size + header.length]
+    if payload.nbytes != header.length:
+        raise ProtocolError("Truncated payload")
+    return header, payload
+
+
+def send_frame(sock, payload_type, camera_id, seq, payload, flags=0, captured=None):
+    """Sends one framed message. Raises socket.error on failure."""
+    header = pack_header(payload_type, camera_id, seq, len(payload), flags, captured)
+    stamp_send_time(header)
+    sock.sendall(header)
+    sock.sendall(payload)
+
+
+def recv_exact(sock, n):
+    """Receives exactly n bytes, or returns None if the peer closed the connection."""
+    data = bytearray(n)
+    view = memoryview(data)
+    received = 0
+    while received < n:
+        count = sock.recv_into(view[received:], n - received)
+        if count == 0:
+            return None
+        received += count
+    return bytes(data)
+
+
+class FrameReader:
+    """Reads framed messages from a socket with recv_into into buffers it reuses,
+    instead of allocating and copying new bytes for every message.
+
+    read() returns the payload as a memoryview into the reader's buffer, which is
+    only valid until the next read(); copy whatever must outlive it.
+    """
+
+    def __init__(self, sock, buffer_size=256 * 1024):
+        self.sock = sock
+        self._header = bytearray(HEADER_SIZE)
+        self._header_view = memoryview(self._header)
+        self._buffer = bytearray(buffer_size)
+        self._view = memoryview(self._buffer)
+
+    def _fill(self, view):
+        """Receives exactly len(view) bytes into view; False if the peer closed the connection."""
+        received = 0
+        while received < view.nbytes:
+            count = self.sock.recv_into(view[received:])
+            if count == 0:
+                return False
+            received += count
+        return True
+
+    def read(self):
+        """Receives one framed message.
+
+        Returns:
+            A (FrameHeader, memoryview payload) tuple, or None if the connection was closed.
+        """
+        if not self._fill(self._header_view[:BASE_HEADER_SIZE]):
+            return None
+        if self._header[:2] != PROTOCOL_MAGIC:
+            raise ProtocolError(f"Bad magic {bytes(self._header[:2])!r}")
+        size = header_size(self._header)
+        if size > BASE_HEADER_SIZE and not self._fill(self._header_view[BASE_HEADER_SIZE:size]):
+            return None
+        header = unpack_header(self._header_view[:size])
+        if header.length > len(self._buffer):
+            # Grows to the largest payload seen; earlier payload views stay on the old buffer
+            self._buffer = bytearray(max(header.length, 2 * len(self._buffer)))
+            self._view = memoryview(self._buffer)
+        payload = self._view[:header.length]
+        if not self._fill(payload):
+            return None
+        return header, payload
+
+
+def recv_frame(sock):
+    """Receives one framed message.
+
+    Returns:
+        A (FrameHeader, payload) tuple, or None if the connection was closed.
+    """
+    header_bytes = recv_exact(sock, BASE_HEADER_SIZE)
+    if header_bytes is None:
+        return None
+    if header_bytes[:2] != PROTOCOL_MAGIC:
+        raise ProtocolError(f"Bad magic {header_bytes[:2]!r}")
+    extra = header_size(header_bytes) - BASE_HEADER_SIZE
+    if extra:
+        timing_bytes = recv_exact(sock, extra)
+        if timing_bytes is None:
+            return None
+        header_bytes += timing_bytes
+    header = unpack_header(header_bytes)
+    payload = recv_exact(sock, header.length) if header.length else b''
+    if payload is None:
+        return None
+    return header, payload
@@ -0,0 +1,106 @@
+import time
+import logging
+import threading
+
+logging.basicConfig(level=logging.INFO,
+                    format="%(asctime)s - %(levelname)s - %(message)s")
+
+# Fraction of wall time spent blocked in send calls above which the uplink is
+# considered congested, and below which there is room to raise quality again.
+CONGESTED_BUSY_RATIO = 0.7
+IDLE_BUSY_RATIO = 0.3
+
+
+class AdaptiveController:
+    """Adjusts JPEG quality, output scale and target fps from uplink backpressure.
+
+    The sender reports every send (bytes and time spent writing it) and every encoded
+    frame that was replaced by a newer one before it could be sent. Frames the capture
+    side overwrote are not reported: they only mean a camera is faster than the target
+    fps. Once per adjust_interval the controller looks at how much of that interval
+    was spent blocked on the socket, per uplink channel (see Core.uplink), deciding on
+    the busiest channel:
+
+    - congested (busy ratio high, or frames dropped): lower quality first, then
+      resolution, then fps, each multiplicatively down to its configured minimum;
+    - idle (busy ratio low, no drops): raise them back in the reverse order, additively,
+      so the stream recovers gradually and does not oscillate.
+
+    Every channel's sender thread reports to the same controller, so it is thread-safe.
+    """
+
+    def __init__(self, min_quality=30, max_quality=70, min_scale=0.5, max_scale=1.0,
+                 min_fps=2.0, max_fps=25.0, adjust_interval=1.0):
+        self.min_quality, self.max_quality = min_quality, max_quality
+        self.min_scale, self.max_scale = min_scale, max_scale
+        self.min_fps, self.max_fps = min_fps, max_fps
+        self.adjust_interval = adjust_interval
+
+        self.quality = max_quality
+        self.scale = max_scale
+        self.fps = max_fps
+
+        self._lock = threading.Lock()
+        self._window_start = time.monotonic()
+        self._send_seconds = {}  # channel index -> seconds spent sending in this window
+        self._bytes_sent = 0
+        self._drops = 0
+        self.bytes_per_second = 0.0  # Throughput measured over the last window
+
+    @property
+    def frame_interval(self):
+        """Minimum time between two output frames at the current target fps."""
+        return 1.0 / self.fps if self.fps > 0 else 0.0
+
+    def record_send(self, num_bytes, send_seconds, channel=0):
+        """Reports one completed send on an uplink channel."""
+        with self._lock:
+            self._bytes_sent += num_bytes
+            self._send_seconds[channel] = self._send_seconds.get(channel, 0.0) + send_seconds
+            self._maybe_adjust()
+
+    def record_drop(self, count=1):
+        """Reports encoded frames that were replaced before they could be sent."""
+        with self._lock:
+            self._drops += count
+            self._maybe_adjust()
+
+    def _maybe_adjust(self):
+        """Closes the window once adjust_interval has passed. Called with the lock held."""
+        now = time.monotonic()
+        elapsed = now - self._window_start
+        if elapsed < self.adjust_interval:
+            return
+
+        # Channels send in parallel, so their send times are not added up
+        busy_ratio = min(max(self._send_seconds.values(), default=0.0) / elapsed, 1.0)
+        self.bytes_per_second = self._bytes_sent / elapsed
+        if busy_ratio > CONGESTED_BUSY_RATIO or self._drops:
+            self._decrease()
+        elif busy_ratio < IDLE_BUSY_RATIO:
+            self._increase()
+
+        logging.debug(
+            f"Uplink busy {busy_ratio:.0%}, {self.bytes_per_second / 1024:.0f} KiB/s, "
+            f"{self._drops} drops -> quality {self.quality}, scale {self.scale:.2f}, fps {self.fps:.1f}")
+
+        self._window_start = now
+        self._send_seconds = {}
+        self._bytes_sent = 0
+        self._drops = 0
+
+    def _decrease(self):
+        if self.quality > self.min_quality:
+            self.quality = max(self.min_quality, int(self.quality * 0.8))
+        elif self.scale > self.min_scale:
+            self.scale = max(self.min_scale, round(self.scale * 0.8, 2))
+        elif self.fps > self.min_fps:
+            self.fps = max(self.min_fps, self.fps * 0.7)
+
+    def _increase(self):
+        if self.fps < self.max_fps:
+            self.fps = min(self.max_fps, self.fps + 1.0)
+        elif self.scale < self.max_scale:
+            self.scale = min(self.max_scale, round(self.scale + 0.05, 2))
+        elif self.quality < self.max_quality:
+            self.quality = min(self.max_quality, self.quality + 2)
@@ -1,109 +1,196 @@
-import socket
+import asyncio
 import logging
-import cv2
-import requests
-from requests.auth import HTTPDigestAuth
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from Core.isapi import IsapiClients
+from Core.metrics import REGISTRY
 
 logging.basicConfig(level=logging.INFO,
                     format="%(asctime)s - %(levelname)s - %(message)s")
 
+MAX_COMMAND_LENGTH = 4096  # Longest accepted command line, in bytes
+ISAPI_WORKERS = 16         # Camera requests run in parallel when a command targets many cameras
+TARGET_ALL = "ALL"
+KNOWN_COMMANDS = ("RESOLUTION", "BITRATE", "FPS", "MOVE", "STATS", "CAMERAS")
 
-def handle_control_commands(control_socket, cap, cam_user, cam_password, camera_ip):
-    """Handles control commands received via the socket."""
-    try:
-        while True:
-            command = control_socket.recv(1024).decode().strip()
-            if not command:
-                continue
-            logging.info(f"Received control command: {command}")
+COMMANDS = REGISTRY.counter('control_commands_total', "Control commands received", ('command',))
 
-            if command.startswith("RESOLUTION"):
+
+def parse_command(line):
+    """Splits a command line into (target, command, args).
+
+    A command is '[<target>] <COMMAND> [args...]', where target is a camera id or ALL.
+    Without a target, camera commands apply to all cameras (target None).
+    """
+    tokens = line.split()
+    if not tokens:
+        return None, None, []
+    target = None
+    if tokens[0].isdigit():
+        target = int(tokens[0])
+        tokens = tokens[1:]
+    elif tokens[0].upper() == TARGET_ALL:
+        tokens = tokens[1:]
+    if not tokens:
+        return target, None, []
+    return target, tokens[0].upper(), tokens[1:]
+
+
+class ControlServer:
+    """Asyncio control server of the streaming process.
+
+    Any number of clients may connect at once. Each sends newline-terminated
+    commands and gets one reply line per command ('OK ...' or 'ERR ...'), except
+    STATS, which replies with the metrics text followed by an empty line:
+
+        RESOLUTION 1280 720       -> every camera
+        3 RESOLUTION 1280 720     -> camera 3 only
+        ALL BITRATE 2048          -> kbit/s
+        FPS 15
+        2 MOVE <pan> <tilt> [<zoom>]  -> PTZ speeds -100..100; 'MOVE STOP' stops
+        CAMERAS                   -> 'OK 0=192.168.1.10 1=192.168.1.11'
+        STATS
+
+    A command for several cameras sends its ISAPI requests in parallel and replies
+    once all have finished, e.g. 'ERR 0=ok 1=failed'.
+
+    Args:
+        camera_set: The CameraSet being streamed; commands resolve camera ids against it.
+    """
+
+    def __init__(self, port, cam_user, cam_password, camera_set, host='0.0.0.0'):
+        self.port = port
+        self.host = host
+        self.camera_set = camera_set
+        self.clients = IsapiClients(cam_user, cam_password)
+        self._executor = ThreadPoolExecutor(max_workers=ISAPI_WORKERS,
+                                            thread_name_prefix="ISAPI")
+
+    async def serve(self):
+        server = await asyncio.start_server(self._handle_client, self.host, self.port,
+                                            limit=MAX_COMMAND_LENGTH)
+        logging.info(f"Listening for control commands on port {self.port}...")
+        async with server:
+            await server.serve_forever()
+
+    async def _handle_client(self, reader, writer):
+        client_address = writer.get_extra_info('peername')
+        logging.info(f"Accepted control connection from {client_address}")
+        try:
+            while True:
                 try:
-                    _, width, height = command.split()
-                    width, height = int(width), int(height)
-                    logging.info(f"Changing resolution to {width}x{height}")
-                    set_hikvision_resolution(
-                        camera_ip, cam_user, cam_password, width, height)
-                except ValueError:
-                    logging.error(
-                        "Invalid RESOLUTION command format.  Expected 'RESOLUTION <width> <height>'")
-
-            elif command.startswith("MOVE"):
-                logging.info(f"Camera movement command received: {command}")
-                # Implement PTZ control logic here - Example placeholder:
-                # move_camera(camera_ip, cam_user, cam_password, command)
-                pass
-
-            else:
-                logging.warning(f"Unknown command received: {command}")
-
-    except ConnectionResetError:
-        logging.warning("Client disconnected.")
-    except Exception as e:
-        logging.error(f"Error handling control command: {e}")
-    finally:
-        logging.info("Closing control connection.")
+                    line = await reader.readline()
+                except (asyncio.LimitOverrunError, ValueError):
+                    writer.write(b"ERR command too long\n")
+                    break
+                if not line:
+                    break  # Client closed the connection
+                command = line.decode('utf-8', errors='replace').strip()
+                if not command:
+                    continue
+                logging.info(f"Received control command from {client_address}: {command}")
+                writer.write(await self.execute(command))
+                await writer.drain()
+        except ConnectionError:
+            logging.warning(f"Control client {client_address} disconnected.")
+        except Exception as e:
+            logging.error(f"Error handling control command: {e}")
+        finally:
+            logging.info(f"Closing control connection from {client_address}.")
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass  # Already reset by the client
+
+    async def execute(self, command):
+        """Runs one command line and returns the reply bytes."""
+        target, name, args = parse_command(command)
+        if name is None:
+            return b"ERR missing command\n"
+        COMMANDS.labels(name if name in KNOWN_COMMANDS else 'unknown').inc()
+
+        if name == "STATS":
+            # Pipeline metrics in the Prometheus text format, ended by an empty line
+            return REGISTRY.render().encode('utf-8') + b'\n'
+
+        cameras = self._cameras(target)
+        if cameras is None:
+            return f"ERR unknown camera {target}\n".encode('utf-8')
+
+        if name == "CAMERAS":
+            return ("OK " + " ".join(f"{camera_id}={ip}" for camera_id, ip in cameras) + "\n").encode('utf-8')
+
+        action = self._camera_action(name, args)
+        if action is None:
+            logging.warning(f"Unknown command received: {command}")
+            return f"ERR unknown command {name}\n".encode('utf-8')
+        if isinstance(action, str):
+            return f"ERR {action}\n".encode('utf-8')
+        logging.info(f"Running {command!r} on {len(cameras)} camera(s)")
+        return await self._fan_out(cameras, action)
+
+    @staticmethod
+    def _camera_action(name, args):
+        """The IsapiClient call for a camera command, an error message for bad
+        arguments, or None for an unknown command."""
         try:
-            control_socket.close()
+            if name == "RESOLUTION":
+                width, height = (int(value) for value in args)
+                return lambda client: client.set_resolution(width, height)
+            if name == "BITRATE":
+                bitrate, = (int(value) for value in args)
+                return lambda client: client.set_bitrate(bitrate)
+            if name == "FPS":
+                fps, = (float(value) for value in args)
+                return lambda client: client.set_fps(fps)
+            if name == "MOVE":
+                if [arg.upper() for arg in args] == ["STOP"]:
+                    return lambda client: client.stop_move()
+                if len(args) not in (2, 3):
+                    raise ValueError
+                pan, tilt, zoom = (int(value) for value in args + ['0'] * (3 - len(args)))
+                return lambda client: client.move(pan, tilt, zoom)
+        except ValueError:
+            usage = {"RESOLUTION": "RESOLUTION <width> <height>", "BITRATE": "BITRATE <kbit/s>",
+                     "FPS": "FPS <fps>", "MOVE": "MOVE <pan> <tilt> [<zoom>] | MOVE STOP"}
+            return f"expected '{usage[name]}'"
+        return None
+
+    def _cameras(self, target):
+        """(camera id, ip) pairs addressed by target, or None for an unknown camera id."""
+        _, cameras = self.camera_set.snapshot()
+        cameras = [(camera_id, ip) for camera_id, ip, _ in cameras]
+        self.clients.retain(ip for _, ip in cameras)
+        if target is None:
+            return cameras
+        cameras = [camera for camera in cameras if camera[0] == target]
+        return cameras or None
+
+    async def _fan_out(self, cameras, action):
+        """Calls action(IsapiClient) for every camera in parallel."""
+        if not cameras:
+            return b"ERR no cameras\n"
+        loop = asyncio.get_running_loop()
+        results = await asyncio.gather(*(
+            loop.run_in_executor(self._executor, action, self.clients.get(ip))
+            for _, ip in cameras))
+        status = "OK" if all(results) else "ERR"
+        details = " ".join(f"{camera_id}={'ok' if result else 'failed'}"
+                           for (camera_id, _), result in zip(cameras, results))
+        return f"{status} {details}\n".encode('utf-8')
+
+
+def start_control_server(port, cam_user, cam_password, camera_set, host='0.0.0.0'):
+    """Runs a ControlServer on its own event loop in a daemon thread and returns the thread."""
+    server = ControlServer(port, cam_user, cam_password, camera_set, host)
+
+    def run():
+        try:
+            asyncio.run(server.serve())
         except OSError as e:
-            logging.error(f"Error closing control socket: {e}")
-
-
-def set_hikvision_resolution(camera_ip, username, password, width, height):
-    """Sets the Hikvision camera resolution using the ISAPI."""
-    url = f"http://{camera_ip}/ISAPI/Streaming/channels/101/pictureSize"
-    headers = {"Content-Type": "application/xml"}
-    xml_data = f"""
-    <PictureSize version="2.0" xmlns="http://www.hikvision.com/ver20/XMLSchema">
-        <videoResolutionWidth>{width}</videoResolutionWidth>
-        <videoResolutionHeight>{height}</videoResolutionHeight>
-    </PictureSize>
-    """
+            logging.error(f"Could not start control server on port {port}: {e}")
 
-    try:
-        response = requests.put(url, data=xml_data.encode(
-            'utf-8'), headers=headers, auth=HTTPDigestAuth(username, password), timeout=10)
-
-        if response.status_code == 200:
-            logging.info(f"Resolution set to {width}x{height} successfully!")
-        else:
-            logging.error(
-                f"Failed to set resolution. Status Code: {response.status_code}, Response: {response.text}")
-
-    except requests.exceptions.RequestException as e:
-        logging.error(f"Request error: {e}")
-
-
-# Add cam_user, cam_password, camera_ip
-def listen_for_commands(port, cam_user, cam_password, camera_ip):
-    """Listens for incoming control commands on the specified port."""
-    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server_address = ('0.0.0.0', port) 
-    try:
-        server_socket.bind(server_address)
-        server_socket.listen(1) 
-        logging.info(f"Listening for control commands on port {port}...")
-
-        while True:
-            control_socket, client_address = server_socket.accept()
-            logging.info(f"Accepted control connection from {client_address}")
-            # Pass camera credentials and IP to the handler
-            handle_control_commands(
-                control_socket, None, cam_user, cam_password, camera_ip)
-
-    except OSError as e:
-        logging.error(f"Socket error: {e}")
-    except KeyboardInterrupt:
-        logging.info("Shutting down command listener.")
-    finally:
-        server_socket.close()
-
-
-# Example usage (moved out of the main function):
-if __name__ == '__main__':
-    # Replace with actual values for testing
-    camera_ip = "192.168.1.100"
-    cam_user = "admin"
-    cam_password = "password"
-    control_port = 8034
-    listen_for_commands(control_port, cam_user, cam_password, camera_ip)
+    thread = threading.Thread(target=run, name="ControlServer", daemon=True)
+    thread.start()
+    return thread
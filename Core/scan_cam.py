@@ -1,8 +1,47 @@
 import socket
 import subprocess
 import logging
-import shutil
-import os
+import asyncio
+import ipaddress
+import re
+import uuid
+
+logging.basicConfig(level=logging.INFO,
+                    format="%(asctime)s - %(levelname)s - %(message)s")
+
+RTSP_PORT = 554
+HTTP_PORT = 80
+DEFAULT_PROBE_TIMEOUT = 1.0  # Seconds per TCP connect / response read
+DEFAULT_CONCURRENCY = 256    # Hosts probed at the same time
+MAX_SCAN_HOSTS = 65536       # Refuse to scan anything larger than a /16
+WS_DISCOVERY_ADDRESS = ('239.255.255.250', 3702)
+
+# MAC prefixes (OUIs) of camera vendors, used to match vendor names in filter_devices
+# (e.g. 'Hikvision') without nmap's OUI database. Extend as new hardware shows up.
+VENDOR_OUIS = {
+    'Hikvision': ('28:57:BE', '44:19:B6', '4C:BD:8F', '54:C4:15', '58:03:FB',
+                  '80:BE:AF', '8C:E7:48', 'A4:14:37', 'BC:AD:28', 'C0:56:E3',
+                  'C4:2F:90', 'E8:A0:ED', '18:68:CB', '24:28:FD', '64:DB:8B', '98:DF:82'),
+}
+
+_MAC_PREFIX_RE = re.compile(r'^[0-9A-Fa-f]{1,2}([:-][0-9A-Fa-f]{1,2}){1,5}$')
+_ARP_LINE_RE = re.compile(
+    r'(\d{1,3}(?:\.\d{1,3}){3}).*?([0-9A-Fa-f]{1,2}(?:[:-][0-9A-Fa-f]{1,2}){5})')
+
+WS_DISCOVERY_PROBE = """<?xml version="1.0" encoding="UTF-8"?>
+<e:Envelope xmlns:e="http://www.w3.org/2003/05/soap-envelope"
+            xmlns:w="http://schemas.xmlsoap.org/ws/2004/08/addressing"
+            xmlns:d="http://schemas.xmlsoap.org/ws/2005/04/discovery"
+            xmlns:dn="http://www.onvif.org/ver10/network/wsdl">
+  <e:Header>
+    <w:MessageID>uuid:{message_id}</w:MessageID>
+    <w:To e:mustUnderstand="true">urn:schemas-xmlsoap-org:ws:2005:04:discovery</w:To>
+    <w:Action e:mustUnderstand="true">http://schemas.xmlsoap.org/ws/2005/04/discovery/Probe</w:Action>
+  </e:Header>
+  <e:Body>
+    <d:Probe><d:Types>dn:NetworkVideoTransmitter</d:Types></d:Probe>
+  </e:Body>
+</e:Envelope>"""
 
 
 def get_host_IP():
@@ -28,68 +67,293 @@ def convert_to_CIDR(host_ip):
     return cidr
 
 
-def get_list_camera_IP(network_range, filter_devices, nmap_retries=3):
+def normalize_mac(mac):
+    """Returns a MAC address (or prefix) as upper-case, zero-padded, ':'-separated octets."""
+    return ':'.join(part.zfill(2) for part in re.split('[:-]', mac.strip())).upper()
+
+
+def vendor_for_mac(mac):
+    """Looks up the vendor of a MAC address in VENDOR_OUIS, or returns None."""
+    prefix = normalize_mac(mac)[:8]
+    for vendor, ouis in VENDOR_OUIS.items():
+        if prefix in ouis:
+            return vendor
+    return None
+
+
+def read_neighbour_table():
+    """Returns {ip: mac} from the kernel ARP/neighbour table.
+
+    Reads /proc/net/arp on Linux and falls back to parsing `arp -a` elsewhere.
+    Incomplete entries are skipped.
+    """
+    entries = {}
+    try:
+        with open('/proc/net/arp') as f:
+            lines = f.read().splitlines()[1:]
+    except OSError:
+        try:
+            lines = subprocess.run(['arp', '-a'], capture_output=True, text=True,
+                                   timeout=5).stdout.splitlines()
+        except (OSError, subprocess.SubprocessError) as e:
+            logging.warning(f"Could not read the ARP table: {e}")
+            return entries
+
+    for line in lines:
+        match = _ARP_LINE_RE.search(line)
+        if not match:
+            continue
+        mac = normalize_mac(match.group(2))
+        if mac in ('00:00:00:00:00:00', 'FF:FF:FF:FF:FF:FF'):
+            continue
+        entries[match.group(1)] = mac
+    return entries
+
+
+def expand_networks(networks):
+    """Returns the host addresses (as strings) of one or more CIDRs or single IPs."""
+    if isinstance(networks, str):
+        networks = [networks]
+    hosts = []
+    for network in networks:
+        net = ipaddress.ip_network(network.strip(), strict=False)
+        if net.num_addresses > MAX_SCAN_HOSTS:
+            raise ValueError(f"Network {net} is too large to scan (more than {MAX_SCAN_HOSTS} hosts).")
+        # /31 and /32 have no network/broadcast address to skip
+        hosts.extend(str(ip) for ip in (net.hosts() if net.num_addresses > 2 else net))
+    return list(dict.fromkeys(hosts))
+
+
+def matches_filter(result, filter_devices):
+    """True if a scan result matches any entry of filter_devices.
+
+    Entries that look like MAC prefixes (e.g. 'E8:A0:ED') are compared with the host's
+    MAC; anything else (e.g. 'Hikvision') is searched case-insensitively in the vendor,
+    the HTTP server/realm and the ONVIF scopes.
     """
-    Scans the network for camera IPs using nmap, with retries.
+    if not filter_devices:
+        return result['rtsp']
+    text = ' '.join(filter(None, (result['vendor'], result['http_server'],
+                                  result['http_realm'], result['onvif_scopes']))).lower()
+    for device in filter_devices:
+        if _MAC_PREFIX_RE.match(device):
+            if result['mac'] and result['mac'].startswith(normalize_mac(device)):
+                return True
+        elif device.lower() in text:
+            return True
+    return False
+
+
+async def _open(ip, port, timeout):
+    return await asyncio.wait_for(asyncio.open_connection(ip, port), timeout)
+
+
+async def _close(writer):
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except OSError:
+        pass
+
+
+async def probe_rtsp(ip, port=RTSP_PORT, timeout=DEFAULT_PROBE_TIMEOUT):
+    """Returns (open, server) for the RTSP port; server is the Server header if the port answered OPTIONS."""
+    try:
+        reader, writer = await _open(ip, port, timeout)
+    except (OSError, asyncio.TimeoutError):
+        return False, None
+    server = None
+    try:
+        writer.write(f"OPTIONS rtsp://{ip}:{port}/ RTSP/1.0\r\nCSeq: 1\r\n\r\n".encode())
+        await writer.drain()
+        response = await asyncio.wait_for(reader.read(2048), timeout)
+        server = _header(response, 'Server')
+    except (OSError, asyncio.TimeoutError):
+        pass
+    finally:
+        await _close(writer)
+    return True, server
+
+
+async def probe_http(ip, port=HTTP_PORT, timeout=DEFAULT_PROBE_TIMEOUT):
+    """Probes the Hikvision ISAPI device-info URL.
+
+    Returns:
+        (open, status, server, realm, isapi). isapi is True when the URL exists (200, or
+        401 asking for credentials), which is how ISAPI devices answer.
+    """
+    try:
+        reader, writer = await _open(ip, port, timeout)
+    except (OSError, asyncio.TimeoutError):
+        return False, None, None, None, False
+    status = server = realm = None
+    try:
+        writer.write(f"GET /ISAPI/System/deviceInfo HTTP/1.0\r\nHost: {ip}\r\n\r\n".encode())
+        await writer.drain()
+        response = await asyncio.wait_for(reader.read(4096), timeout)
+        status_line = response.split(b'\r\n', 1)[0].split()
+        if len(status_line) >= 2 and status_line[1].isdigit():
+            status = int(status_line[1])
+        server = _header(response, 'Server')
+        authenticate = _header(response, 'WWW-Authenticate')
+        if authenticate:
+            match = re.search(r'realm="([^"]*)"', authenticate)
+            realm = match.group(1) if match else None
+    except (OSError, asyncio.TimeoutError):
+        pass
+    finally:
+        await _close(writer)
+    return True, status, server, realm, status in (200, 401)
+
+
+def _header(response, name):
+    """Value of a header in a raw HTTP/RTSP response, or None."""
+    for line in response.split(b'\r\n')[1:]:
+        if not line:
+            break
+        key, _, value = line.partition(b':')
+        if key.strip().lower() == name.lower().encode():
+            return value.strip().decode('latin-1')
+    return None
+
+
+class _WSDiscoveryProtocol(asyncio.DatagramProtocol):
+    def __init__(self):
+        self.responses = {}  # ip -> (scopes, xaddrs)
+
+    def datagram_received(self, data, addr):
+        text = data.decode('utf-8', errors='replace')
+        scopes = re.search(r'<[^>]*Scopes[^>]*>([^<]*)<', text)
+        xaddrs = re.search(r'<[^>]*XAddrs[^>]*>([^<]*)<', text)
+        self.responses[addr[0]] = (scopes.group(1).strip() if scopes else '',
+                                   xaddrs.group(1).strip() if xaddrs else '')
+
+
+async def ws_discovery(timeout=2.0, address=WS_DISCOVERY_ADDRESS):
+    """Sends an ONVIF WS-Discovery probe and collects answers for timeout seconds.
+
+    Returns:
+        {ip: (scopes, xaddrs)} of every device that answered.
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        transport, protocol = await loop.create_datagram_endpoint(
+            _WSDiscoveryProtocol, local_addr=('0.0.0.0', 0), family=socket.AF_INET)
+    except OSError as e:
+        logging.warning(f"ONVIF WS-Discovery unavailable: {e}")
+        return {}
+    try:
+        probe = WS_DISCOVERY_PROBE.format(message_id=uuid.uuid4()).encode('utf-8')
+        for _ in range(2):  # UDP: send twice in case one is lost
+            transport.sendto(probe, address)
+            await asyncio.sleep(timeout / 2)
+    except OSError as e:
+        logging.warning(f"ONVIF WS-Discovery probe failed: {e}")
+    finally:
+        transport.close()
+    return protocol.responses
+
+
+async def scan_network(networks, filter_devices=(), timeout=DEFAULT_PROBE_TIMEOUT, concurrency=DEFAULT_CONCURRENCY,
+                       onvif=False, rtsp_port=RTSP_PORT, http_port=HTTP_PORT, ws_discovery_address=WS_DISCOVERY_ADDRESS):
+    """Scans one or more networks for cameras.
+
+    Every host is probed on the RTSP and HTTP/ISAPI ports, at most `concurrency` hosts
+    at a time, while ONVIF WS-Discovery (if enabled) runs alongside. The ARP table is
+    read afterwards, when the probes have filled it with the MACs of every host that
+    answered on the local segment.
 
     Args:
-        network_range: The CIDR network range to scan.
-        filter_devices: A list of device identifiers (e.g., MAC address prefixes) to filter for.
-        nmap_retries:   Number of times to retry the nmap scan.
+        networks: A CIDR string, single IP, or a list of them.
+        filter_devices: MAC prefixes and/or vendor names a camera must match (see matches_filter).
 
     Returns:
-        A list of camera IPs, or an empty list if no cameras are found or nmap fails.
+        One dict per host that showed any sign of life, sorted by IP, with keys
+        ip, mac, vendor, rtsp, rtsp_server, http, http_status, http_server, http_realm,
+        isapi, onvif, onvif_scopes, onvif_xaddrs and matched.
     """
-    if not shutil.which("nmap"):
-        logging.error("nmap is not installed or not in PATH.")
-        return []
+    hosts = expand_networks(networks)
+    in_scope = set(hosts)
+    semaphore = asyncio.Semaphore(concurrency)
 
-    nmap_command = f"nmap -sn {network_range}"
-    if os.name == 'posix':
-        nmap_command = "sudo " + nmap_command
+    async def probe(ip):
+        async with semaphore:
+            (rtsp, rtsp_server), (http, status, server, realm, isapi) = await asyncio.gather(
+                probe_rtsp(ip, rtsp_port, timeout), probe_http(ip, http_port, timeout))
+        return {'ip': ip, 'rtsp': rtsp, 'rtsp_server': rtsp_server, 'http': http,
+                'http_status': status, 'http_server': server, 'http_realm': realm, 'isapi': isapi}
 
-    for attempt in range(nmap_retries):
-        print(
-            f"Scanning network: {network_range} (Attempt {attempt+1}/{nmap_retries})")
+    probes = asyncio.gather(*(probe(ip) for ip in hosts))
+    if onvif:
+        probe_results, onvif_responses = await asyncio.gather(
+            probes, ws_discovery(max(timeout, 1.0) * 2, ws_discovery_address))
+    else:
+        probe_results, onvif_responses = await probes, {}
+    neighbours = await asyncio.to_thread(read_neighbour_table)
+
+    results = []
+    for entry in probe_results:
+        ip = entry['ip']
+        mac = neighbours.get(ip)
+        scopes, xaddrs = onvif_responses.get(ip, (None, None))
+        if not (entry['rtsp'] or entry['http'] or mac or ip in onvif_responses):
+            continue
+        entry.update({'mac': mac, 'vendor': vendor_for_mac(mac) if mac else None,
+                      'onvif': ip in onvif_responses, 'onvif_scopes': scopes, 'onvif_xaddrs': xaddrs})
+        entry['matched'] = matches_filter(entry, filter_devices)
+        results.append(entry)
+    skipped = set(onvif_responses) - in_scope
+    if skipped:
+        logging.info(f"Ignoring ONVIF devices outside the scanned networks: {sorted(skipped)}")
+
+    return sorted(results, key=lambda result: ipaddress.ip_address(result['ip']))
+
+
+def discover_cameras(networks, filter_devices=(), **kwargs):
+    """Synchronous wrapper around scan_network()."""
+    return asyncio.run(scan_network(networks, filter_devices, **kwargs))
 
-        try:
-            result = subprocess.run(nmap_command, shell=True,
-                                    capture_output=True, text=True, check=True)
-            print(f"Scan results:\n{result.stdout}")
 
-            filtered_ips = []
-            lines = result.stdout.splitlines()
+def find_cameras(network_range, filter_devices, **kwargs):
+    """Scans the network and returns the scan results (dicts) of the matching cameras.
 
-            for i in range(2, len(lines)):
-                line = lines[i]
-                if any(device in line for device in filter_devices):
-                    ip_address = lines[i-2].split()[-1]
-                    filtered_ips.append(ip_address)
+    Returns an empty list if the scan fails.
+    """
+    logging.info(f"Scanning network: {network_range}")
+    try:
+        results = discover_cameras(network_range, filter_devices, **kwargs)
+    except ValueError as e:
+        logging.error(f"Invalid network range {network_range}: {e}")
+        return []
+    except Exception as e:
+        logging.error(f"An unexpected error occurred while scanning: {e}")
+        return []
 
-            ip_addresses = [ip.strip('()') for ip in filtered_ips]
+    for result in results:
+        logging.debug(f"Scan result: {result}")
+    return [result for result in results if result['matched']]
 
-            print(f"Filtered IPs: {ip_addresses}")
-            return ip_addresses
 
-        except subprocess.CalledProcessError as e:
-            logging.error(
-                f"Error running nmap (attempt {attempt+1}/{nmap_retries}): {e}")
-            if attempt < nmap_retries - 1:
-                print("Retrying nmap scan...")
-            else:
-                logging.error(
-                    "Max nmap retries reached.  Returning empty list.")
-                return []
+def get_list_camera_IP(network_range, filter_devices, nmap_retries=3, **kwargs):
+    """
+    Scans the network for camera IPs.
 
-        except Exception as e:
-            logging.error(f"An unexpected error occurred: {e}")
-            return []
+    Args:
+        network_range: The CIDR network range to scan (or a list of ranges).
+        filter_devices: A list of device identifiers (e.g., MAC address prefixes or vendor names) to filter for.
+        nmap_retries:   Unused; kept for compatibility with the old nmap-based scanner.
+        kwargs:         Passed to scan_network (timeout, concurrency, onvif, ...).
 
-    return []
+    Returns:
+        A list of camera IPs, or an empty list if no cameras are found or the scan fails.
+    """
+    ip_addresses = [result['ip'] for result in find_cameras(network_range, filter_devices, **kwargs)]
+    print(f"Filtered IPs: {ip_addresses}")
+    return ip_addresses
 
 
 if __name__ == "__main__":
     host_ip = get_host_IP()
     network_range = convert_to_CIDR(host_ip)
-    camera_ips = get_list_camera_IP(network_range)
+    camera_ips = get_list_camera_IP(network_range, ['Hikvision'])
     print(f"List of Camera IPs: {camera_ips}")
@@ -0,0 +1,617 @@
+import socket
+import selectors
+import threading
+import time
+import logging
+import random
+from collections import deque
+from Core.protocol import (pack_header, stamp_send_time, header_size, unpack_header, ProtocolError,
+                           BASE_HEADER_SIZE, PAYLOAD_JPEG, PAYLOAD_MOSAIC_JPEG, PAYLOAD_SPOOLED,
+                           PAYLOAD_SPOOL_ACK, SPOOL_ID_STRUCT)
+from Core.datagram import iter_fragments, DEFAULT_MTU, DEFAULT_FEC_GROUP, MESSAGE_ID_MODULO
+from Core.metrics import REGISTRY, camera_label
+
+logging.basicConfig(level=logging.INFO,
+                    format="%(asctime)s - %(levelname)s - %(message)s")
+
+SELECT_TIMEOUT = 0.5  # Seconds between stop checks while waiting on the socket
+# Unsent packets of a passthrough stream before its backlog is dropped up to the next
+# keyframe; a keyframe arriving behind more than PACKET_BACKLOG_FLUSH packets skips them
+MAX_PACKET_BACKLOG = 250
+PACKET_BACKLOG_FLUSH = 25
+# Self-contained frames, which the spool keeps while the uplink is down
+SPOOLED_PAYLOADS = (PAYLOAD_JPEG, PAYLOAD_MOSAIC_JPEG)
+RECEIVE_SIZE = 64 * 1024
+
+TRANSPORT_TCP = 'tcp'
+TRANSPORT_UDP = 'udp'
+DATAGRAM_SEND_BUFFER = 4 * 1024 * 1024  # Room for the datagrams of a few large frames
+STICKY_RESEND_INTERVAL = 2.0   # Seconds between re-sends of sticky messages over UDP
+# Seconds a TCP connection may go without sending before its sticky messages are
+# re-sent, so the receiver (which drops connections silent for 10 s) keeps a channel
+# that has no cameras
+IDLE_RESEND_INTERVAL = 3.0
+UNREACHABLE_LOG_INTERVAL = 30.0
+
+SEND_SECONDS = REGISTRY.histogram(
+    'send_seconds', 'Time to write one message to the uplink socket')
+EDGE_LATENCY = REGISTRY.histogram(
+    'edge_latency_seconds', 'Time from frame capture until it starts going out on the uplink', ('camera',))
+MESSAGES_SENT = REGISTRY.counter(
+    'messages_sent_total', 'Messages written to the uplink', ('camera',))
+BYTES_SENT = REGISTRY.counter(
+    'sent_bytes_total', 'Bytes (headers included) written to the uplink', ('camera',))
+FRAMES_REPLACED = REGISTRY.counter(
+    'sender_frames_replaced_total', 'Encoded frames replaced by a newer one before sending', ('camera',))
+PACKETS_DROPPED = REGISTRY.counter(
+    'sender_packets_dropped_total', 'Passthrough packets dropped to catch up at a keyframe', ('camera',))
+CONNECTIONS = REGISTRY.counter(
+    'uplink_connections_total', 'Successful (re)connections to the VPS', ('channel',))
+CONNECTED = REGISTRY.gauge(
+    'uplink_connected', '1 while the uplink socket is connected', ('channel',))
+
+
+def create_socket(ip, port, retries=0, delay=5):
+    """Attempt to create a socket connection with retries. If retries=0, loop indefinitely."""
+    attempt = 0
+    while True:
+        attempt += 1
+        logging.info(f"Attempting socket connection to {ip}:{port} (Attempt {attempt})...")
+        client_socket = None  # Ensure socket is None at the start of each attempt
+        try:
+            client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            client_socket.settimeout(10) # Maybe slightly shorter timeout for connect?
+            client_socket.connect((ip, port))
+            # Frames are sent whole; don't let Nagle hold back the tail of a frame
+            client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            logging.info(f"Socket connected successfully to {ip}:{port}")
+            return client_socket  # Return the connected socket
+
+        except socket.error as e:
+            logging.error(f"Socket connection attempt {attempt} failed: {e}")
+            if client_socket:
+                client_socket.close() # Close the failed socket object
+
+            # Check retry condition
+            # Using '!=' covers both infinite (0) and finite retries
+            if retries != 0 and attempt >= retries:
+                logging.error(f"Max retries ({retries}) reached. Failed to connect to {ip}:{port}.")
+                break # Exit loop after max retries
+
+            # If retries == 0 or attempt < retries, wait and retry
+            logging.info(f"Retrying connection in {delay} seconds...")
+            time.sleep(delay)
+        # No finally block needed here for managing the socket object itself
+    return None # Return None if all retries failed
+
+
+def create_datagram_socket(ip, port):
+    """Creates a UDP socket whose datagrams go to ip:port, or returns None on failure."""
+    client_socket = None
+    try:
+        client_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        client_socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, DATAGRAM_SEND_BUFFER)
+        client_socket.connect((ip, port))  # Only fixes the destination; nothing is sent
+    except socket.error as e:
+        logging.error(f"Cannot open a UDP socket to {ip}:{port}: {e}")
+        if client_socket:
+            client_socket.close()
+        return None
+    logging.info(f"Sending datagrams to {ip}:{port}")
+    return client_socket
+
+
+class FrameSender:
+    """Sends framed messages to the VPS from its own thread.
+
+    Every stream (camera id) holds at most one pending message. A newer frame replaces
+    an older one that has not started sending yet, so a slow or broken uplink never
+    builds a backlog and the frame on the wire is at most one frame old. Messages are
+    written with a single sendmsg() call for header and payload on a non-blocking
+    socket, and reconnects happen here, without stalling capture or encoding.
+
+    Sticky messages (e.g. the mosaic layout) are re-sent first on every new connection,
+    and whenever the connection has been idle for IDLE_RESEND_INTERVAL, which keeps it
+    from timing out at the receiver while there is nothing else to send.
+
+    Frames submitted with their capture time carry it in the header, along with how
+    long after capture they were encoded and, stamped just before writing, sent.
+
+    Passthrough video packets (submit_packet) cannot replace each other, since each
+    depends on the ones before it. They are queued in order per camera, and a camera
+    that falls behind skips ahead to a keyframe instead. After a reconnect every
+    camera restarts at its next keyframe.
+
+    With a spool (Core.spool.FrameSpool), JPEG and mosaic frames submitted while the
+    uplink is down are written to disk instead of being lost. Once connected, the
+    backlog is replayed as PAYLOAD_SPOOLED messages whenever no live message is
+    waiting, limited to replay_rate bytes per second, and the receiver's acks
+    (read from the same socket) trim the spool.
+    """
+
+    def __init__(self, ip, port, stop_event, sock=None, max_reconnect_attempts=0, reconnect_delay=5, rate_controller=None, spool=None, replay_rate=0, channel=0):
+        """
+        Args:
+            sock: An already connected socket to start with, or None to connect here.
+            max_reconnect_attempts: Consecutive failed connection attempts before giving
+                                    up and setting stop_event. 0 retries forever.
+            rate_controller: Optional AdaptiveController fed with send times and drops.
+            spool: Optional FrameSpool keeping frames through uplink outages.
+            replay_rate: Bytes per second the spool is replayed at; 0 is unlimited.
+            channel: Index of this sender's uplink channel (see Core.uplink), for
+                     metrics and logs.
+        """
+        self.ip = ip
+        self.port = port
+        self.stop_event = stop_event
+        self.max_reconnect_attempts = max_reconnect_attempts
+        self.reconnect_delay = reconnect_delay
+        self.rate_controller = rate_controller
+        self.spool = spool
+        self.replay_rate = replay_rate
+        self.channel = channel
+
+        self._sock = sock
+        self._selector = selectors.DefaultSelector()
+        self._cond = threading.Condition()
+        # Messages are (header, payload, camera_id) tuples
+        self._pending = {}        # stream key -> message, latest wins
+        self._control = deque()   # Messages that must not be replaced, sent first
+        self._sticky = {}         # name -> message, re-sent on every connection
+        self._streams = {}        # camera id -> deque of passthrough packet messages, in order
+        self._ready_streams = deque()  # Camera ids with queued packets, served round-robin
+        self._awaiting_keyframe = set()  # Camera ids dropping packets until the next keyframe
+        self._closing = False
+        self._inbox = bytearray()  # Bytes received from the receiver, i.e. spool acks
+        self._replay_allowance = 0.0  # Bytes the replay may send now; refilled at replay_rate
+        self._replay_refilled = time.monotonic()
+        self._last_sent = 0.0  # time.monotonic() of the last message sent (or connection)
+        self._thread = threading.Thread(
+            target=self._run, name=f"FrameSender-{channel}", daemon=True)
+
+        self.connections = 0  # Incremented on every (re)connect
+        self.messages_sent = 0
+        self.bytes_sent = 0
+        self.frames_replaced = 0
+
+    def start(self):
+        if self._sock is not None:
+            self._on_connected()
+        self._thread.start()
+
+    def stop(self, timeout=2.0):
+        """Stops the sender thread and closes the socket."""
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+        self._thread.join(timeout=timeout)
+
+    @property
+    def connected(self):
+        return self._sock is not None
+
+    @property
+    def spooling(self):
+        """True while frames are being spooled instead of sent."""
+        return self.spool is not None and self._sock is None
+
+    def submit(self, payload_type, camera_id, seq, payload, flags=0, key=None, captured=None, encoded_at=None):
+        """Queues a frame for sending, replacing any unsent frame of the same stream.
+
+        Args:
+            payload: bytes or any contiguous buffer (e.g. the array from cv2.imencode).
+            key: Stream the frame belongs to; defaults to camera_id.
+            captured: Core.protocol.CaptureTime of the frame, or None.
+            encoded_at: time.monotonic() when encoding finished; defaults to now.
+
+        Returns:
+            True if an unsent frame of the same stream was replaced (i.e. dropped).
+        """
+        payload = memoryview(payload).cast('B')
+        header = pack_header(payload_type, camera_id, seq, payload.nbytes, flags, captured, encoded_at)
+        if self.spooling and payload_type in SPOOLED_PAYLOADS:
+            self.spool.append(camera_id, header, payload)
+            return False
+        key = camera_id if key is None else key
+        with self._cond:
+            replaced = key in self._pending
+            if replaced:
+                self.frames_replaced += 1
+                FRAMES_REPLACED.labels(camera_label(camera_id)).inc()
+                if self.rate_controller is not None:
+                    self.rate_controller.record_drop()
+            self._pending[key] = (header, payload, camera_id)
+            self._cond.notify()
+        return replaced
+
+    def submit_packet(self, payload_type, camera_id, seq, payload, flags, keyframe, captured=None):
+        """Queues an encoded video packet behind the camera's earlier packets.
+
+        Returns:
+            The number of packets dropped to catch up (including this one, if it was).
+        """
+        payload = memoryview(payload).cast('B')
+        message = (pack_header(payload_type, camera_id, seq, payload.nbytes, flags, captured),
+                   payload, camera_id)
+        with self._cond:
+            stream = self._streams.setdefault(camera_id, deque())
+            dropped = 0
+            if camera_id in self._awaiting_keyframe and not keyframe:
+                dropped = 1
+            else:
+                self._awaiting_keyframe.discard(camera_id)
+                if keyframe and len(stream) > PACKET_BACKLOG_FLUSH:
+                    # The receiver can restart here, skip the backlog
+                    dropped = len(stream)
+                    stream.clear()
+                elif len(stream) >= MAX_PACKET_BACKLOG:
+                    dropped = len(stream) + 1
+                    stream.clear()
+                    self._awaiting_keyframe.add(camera_id)
+                if camera_id not in self._awaiting_keyframe:
+                    if not stream:
+                        self._ready_streams.append(camera_id)
+                    stream.append(message)
+                    self._cond.notify()
+        if dropped:
+            PACKETS_DROPPED.labels(camera_label(camera_id)).inc(dropped)
+        return dropped
+
+    def forget_stream(self, camera_id, await_keyframe=False):
+        """Drops the queued packets of a camera that left the camera set (or this channel).
+        With await_keyframe, the camera's next packets are dropped up to a keyframe."""
+        with self._cond:
+            self._streams.pop(camera_id, None)
+            if await_keyframe:
+                self._awaiting_keyframe.add(camera_id)
+            else:
+                self._awaiting_keyframe.discard(camera_id)
+
+    def send_control(self, payload_type, camera_id, payload, seq=0, flags=0):
+        """Queues a message that is never replaced or dropped while connected."""
+        payload = memoryview(payload).cast('B')
+        with self._cond:
+            self._control.append(
+                (pack_header(payload_type, camera_id, seq, payload.nbytes, flags), payload, camera_id))
+            self._cond.notify()
+
+    def set_sticky(self, name, payload_type, camera_id, payload, seq=0, flags=0):
+        """Registers a message that is sent now and again first on every reconnect."""
+        payload = memoryview(payload).cast('B')
+        message = (pack_header(payload_type, camera_id, seq, payload.nbytes, flags), payload, camera_id)
+        with self._cond:
+            self._sticky[name] = message
+            if self._sock is not None:
+                self._control.append(message)
+                self._cond.notify()
+
+    def remove_sticky(self, name):
+        with self._cond:
+            self._sticky.pop(name, None)
+
+    # --- Sender thread ---
+
+    def _on_connected(self):
+        self.connections += 1
+        CONNECTIONS.labels(self.channel).inc()
+        CONNECTED.labels(self.channel).set(1)
+        self._sock.setblocking(False)
+        self._selector.register(self._sock, selectors.EVENT_READ | selectors.EVENT_WRITE)
+        self._inbox.clear()
+        self._last_sent = time.monotonic()
+        if self.spool is not None:
+            # Whatever was in flight on the old connection may not have arrived
+            self.spool.rewind()
+            if self.spool.pending:
+                logging.info(f"Replaying {self.spool.pending} spooled frames.")
+        with self._cond:
+            # Anything queued for the old connection is stale; start with the sticky state
+            self._control = deque(self._sticky.values())
+            # Packets of the old connection are useless to a receiver that starts over
+            self._awaiting_keyframe.update(self._streams)
+            for stream in self._streams.values():
+                stream.clear()
+            self._ready_streams.clear()
+
+    def _next_message(self):
+        """Waits for and returns the next message to send, or None to re-check state."""
+        if self._sock is not None and time.monotonic() - self._last_sent >= IDLE_RESEND_INTERVAL:
+            self._last_sent = time.monotonic()
+            with self._cond:
+                self._control.extend(self._sticky.values())
+        with self._cond:
+            if not self._control and not self._pending and not self._ready_streams and not self._closing:
+                self._cond.wait(timeout=self._replay_wait())
+            if self._control:
+                return self._control.popleft()
+            if self._pending:
+                # Oldest stream first, so a busy camera cannot starve the others
+                key = next(iter(self._pending))
+                return self._pending.pop(key)
+            while self._ready_streams:
+                camera_id = self._ready_streams.popleft()
+                stream = self._streams.get(camera_id)
+                if stream:
+                    message = stream.popleft()
+                    if stream:
+                        self._ready_streams.append(camera_id)
+                    return message
+        return self._next_replay()
+
+    def _replay_wait(self):
+        """Seconds until the spool may replay its next frame (at most SELECT_TIMEOUT)."""
+        if self.spool is None or self._sock is None or not self.spool.has_replay():
+            return SELECT_TIMEOUT
+        if not self.replay_rate:
+            return 0
+        self._refill_replay()
+        return min(max(-self._replay_allowance / self.replay_rate, 0), SELECT_TIMEOUT)
+
+    def _refill_replay(self):
+        now = time.monotonic()
+        # At most one second's worth is saved up while there is nothing to replay
+        self._replay_allowance = min(self._replay_allowance + (now - self._replay_refilled) * self.replay_rate,
+                                     self.replay_rate)
+        self._replay_refilled = now
+
+    def _next_replay(self):
+        """The next spooled frame as a PAYLOAD_SPOOLED message, if the replay rate allows one now."""
+        if self.spool is None or self._sock is None:
+            return None
+        if self.replay_rate:
+            self._refill_replay()
+            if self._replay_allowance < 0:
+                return None
+        record = self.spool.next_replay()
+        if record is None:
+            return None
+        spool_id, camera_id, message = record
+        # The spool id goes into the header buffer, so the message is sent as it was spooled
+        header = pack_header(PAYLOAD_SPOOLED, camera_id, spool_id, SPOOL_ID_STRUCT.size + len(message))
+        header += SPOOL_ID_STRUCT.pack(spool_id)
+        if self.replay_rate:
+            self._replay_allowance -= len(header) + len(message)
+        return header, memoryview(message), camera_id
+
+    def _receive(self):
+        """Reads what the receiver sent (spool acks). Raises OSError if it closed the connection."""
+        try:
+            data = self._sock.recv(RECEIVE_SIZE)
+        except (BlockingIOError, InterruptedError):
+            return
+        if not data:
+            raise ConnectionResetError("Connection closed by the receiver")
+        self._inbox += data
+        while len(self._inbox) >= BASE_HEADER_SIZE:
+            try:
+                size = header_size(self._inbox)
+                if len(self._inbox) < size:
+                    return
+                header = unpack_header(bytes(self._inbox[:size]))
+            except ProtocolError as e:
+                raise ConnectionResetError(f"Bad message from the receiver: {e}")
+            if len(self._inbox) < size + header.length:
+                return
+            payload = bytes(self._inbox[size:size + header.length])
+            del self._inbox[:size + header.length]
+            if header.payload_type == PAYLOAD_SPOOL_ACK and self.spool is not None:
+                self.spool.ack(SPOOL_ID_STRUCT.unpack(payload)[0])
+
+    def _open_socket(self):
+        return create_socket(self.ip, self.port, retries=1)
+
+    def _connect(self):
+        attempts = 0
+        while not self._closing and not self.stop_event.is_set():
+            attempts += 1
+            sock = self._open_socket()
+            if sock is not None:
+                self._sock = sock
+                self._on_connected()
+                return True
+            if self.max_reconnect_attempts and attempts >= self.max_reconnect_attempts:
+                logging.error(
+                    "Max socket reconnect attempts reached. Exiting streaming.")
+                self.stop_event.set()
+                return False
+            logging.info(
+                f"Retrying connection in {self.reconnect_delay} seconds...")
+            self.stop_event.wait(self.reconnect_delay)
+        return False
+
+    def _disconnect(self):
+        if self._sock is not None:
+            try:
+                self._selector.unregister(self._sock)
+            except (KeyError, ValueError):
+                pass
+            try:
+                self._sock.shutdown(socket.SHUT_RDWR)
+            except OSError as e:
+                logging.error(f"Error during socket shutdown: {e}")
+            finally:
+                self._sock.close()
+        self._sock = None
+        CONNECTED.labels(self.channel).set(0)
+
+    def _send_message(self, header, payload, camera_id):
+        """Writes one message completely. Raises OSError if the connection fails."""
+        start = time.monotonic()
+        edge_latency = stamp_send_time(header, start)
+        buffers = [view for view in (memoryview(header), payload) if view.nbytes]
+        total = len(header) + payload.nbytes
+        while buffers:
+            if self._closing:
+                raise ConnectionAbortedError("Sender stopped mid-message")
+            events = self._selector.select(timeout=SELECT_TIMEOUT)
+            if not events:
+                continue
+            if events[0][1] & selectors.EVENT_READ:
+                self._receive()
+            if not events[0][1] & selectors.EVENT_WRITE:
+                continue
+            try:
+                if hasattr(self._sock, 'sendmsg'):
+                    sent = self._sock.sendmsg(buffers)
+                else:
+                    sent = self._sock.send(buffers[0])
+            except (BlockingIOError, InterruptedError):
+                continue
+            # Drop fully written buffers and trim the partially written one
+            while sent and buffers:
+                if sent >= buffers[0].nbytes:
+                    sent -= buffers[0].nbytes
+                    buffers.pop(0)
+                else:
+                    buffers[0] = buffers[0][sent:]
+                    sent = 0
+
+        self._record_sent(camera_id, total, start, edge_latency)
+
+    def _record_sent(self, camera_id, total, start, edge_latency):
+        """Counts one message of total bytes that started sending at start (time.monotonic())."""
+        self._last_sent = time.monotonic()
+        send_seconds = self._last_sent - start
+        self.messages_sent += 1
+        self.bytes_sent += total
+        label = camera_label(camera_id)
+        MESSAGES_SENT.labels(label).inc()
+        BYTES_SENT.labels(label).inc(total)
+        SEND_SECONDS.observe(send_seconds)
+        if edge_latency is not None:
+            EDGE_LATENCY.labels(label).observe(edge_latency)
+        if self.rate_controller is not None:
+            self.rate_controller.record_send(total, send_seconds, self.channel)
+
+    def _run(self):
+        try:
+            while not self._closing and not self.stop_event.is_set():
+                if self._sock is None and not self._connect():
+                    break
+
+                message = self._next_message()
+                try:
+                    if message is None:
+                        if self._sock is not None:
+                            self._receive()
+                        continue
+                    self._send_message(*message)
+                except ConnectionAbortedError:
+                    break
+                except OSError as e:
+                    logging.error(f"Connection lost while sending data: {e}")
+                    self._disconnect()
+        except Exception as e:
+            logging.error(f"Unexpected error in frame sender: {e}")
+        finally:
+            self._disconnect()
+            self._selector.close()
+            logging.info("Frame sender stopped.")
+
+
+
+class DatagramSender(FrameSender):
+    """FrameSender over UDP (transport = udp), for lossy links where a lost TCP
+    segment holds back every frame behind it until it is retransmitted.
+
+    Messages are queued as in FrameSender, the newest frame of a stream replacing
+    an unsent one. Each is cut into datagrams (Core.datagram.iter_fragments) with a
+    parity fragment after every fec_group of them, and nothing is retransmitted:
+    the receiver shows the newest frame that arrived complete and gives up older
+    incomplete ones. A lost passthrough packet makes the receiver wait for the
+    camera's next keyframe, and a lost tile update shows until the next keyframe.
+
+    With no connection to re-establish, sticky messages are re-sent every
+    STICKY_RESEND_INTERVAL instead, so a receiver that (re)starts learns the camera
+    set, layout and codec parameters. Nothing comes back, so there is no spool
+    replay, and send times only cover the local socket (a rate controller sees no
+    congestion). simulated_loss drops that fraction of the datagrams on purpose, to
+    try the transport over loopback.
+    """
+
+    def __init__(self, ip, port, stop_event, mtu=DEFAULT_MTU, fec_group=DEFAULT_FEC_GROUP, simulated_loss=0.0, **options):
+        """
+        Args:
+            mtu: Largest IP packet to send; messages are cut into datagrams that fit it.
+            fec_group: Datagrams per parity datagram; 0 sends no parity.
+            simulated_loss: Fraction of datagrams to drop before sending (testing only).
+            options: FrameSender arguments, except spool and replay_rate.
+        """
+        super().__init__(ip, port, stop_event, **options)
+        self.mtu = mtu
+        self.fec_group = fec_group
+        self.simulated_loss = simulated_loss
+        self._message_id = 0
+        self._sticky_due = 0.0     # time.monotonic() of the next sticky re-send
+        self._refused_logged = None
+        self.datagrams_sent = 0
+
+    def _open_socket(self):
+        return create_datagram_socket(self.ip, self.port)
+
+    def _on_connected(self):
+        super()._on_connected()
+        self._sticky_due = time.monotonic() + STICKY_RESEND_INTERVAL
+
+    def _next_message(self):
+        now = time.monotonic()
+        if self._sock is not None and now >= self._sticky_due:
+            self._sticky_due = now + STICKY_RESEND_INTERVAL
+            with self._cond:
+                self._control.extend(self._sticky.values())
+        return super()._next_message()
+
+    def _refused(self):
+        """Notes an ICMP port unreachable: nothing listens at the receiver's address yet."""
+        now = time.monotonic()
+        if self._refused_logged is None or now - self._refused_logged >= UNREACHABLE_LOG_INTERVAL:
+            self._refused_logged = now
+            logging.warning(f"Nothing receives datagrams at {self.ip}:{self.port}; frames are lost until it does.")
+
+    def _receive(self):
+        """Drains the socket. Nothing is sent back over UDP, but refused datagrams are reported here."""
+        while True:
+            try:
+                self._sock.recv(RECEIVE_SIZE)
+            except (BlockingIOError, InterruptedError):
+                return
+            except ConnectionRefusedError:
+                self._refused()
+
+    def _send_datagram(self, buffers):
+        while True:
+            if self._closing:
+                raise ConnectionAbortedError("Sender stopped mid-message")
+            try:
+                if hasattr(self._sock, 'sendmsg'):
+                    self._sock.sendmsg(buffers)
+                else:
+                    self._sock.send(b''.join(buffers))
+                self.datagrams_sent += 1
+                return
+            except (BlockingIOError, InterruptedError):
+                # Send buffer full: wait for the kernel to pass datagrams on
+                for _, events in self._selector.select(timeout=SELECT_TIMEOUT):
+                    if events & selectors.EVENT_READ:
+                        self._receive()
+            except ConnectionRefusedError:
+                self._refused()
+                return
+
+    def _send_message(self, header, payload, camera_id):
+        """Sends one message as datagrams. Raises OSError if the socket fails."""
+        start = time.monotonic()
+        edge_latency = stamp_send_time(header, start)
+        # One contiguous copy, which the fragments and their parity are cut from
+        message = bytearray(len(header) + payload.nbytes)
+        message[:len(header)] = header
+        message[len(header):] = payload
+        message_id = self._message_id
+        self._message_id = (message_id + 1) % MESSAGE_ID_MODULO
+        total = 0
+        for fragment_header, data in iter_fragments(message, message_id, camera_id, self.mtu, self.fec_group):
+            total += len(fragment_header) + data.nbytes
+            if self.simulated_loss and random.random() < self.simulated_loss:
+                continue
+            self._send_datagram([fragment_header, data])
+        self._record_sent(camera_id, total, start, edge_latency)
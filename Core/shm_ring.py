@@ -0,0 +1,194 @@
+import queue
+import numpy as np
+from multiprocessing import shared_memory
+from Core.protocol import CaptureTime, capture_now
+
+# Layout of the shared memory block:
+#
+#   [write_seq int64][read_seq int64][read_failures int64][slot_seqs int64 * slots]
+#   [slot_times float64 * 2 * slots][frame bytes * slots]
+#
+# write_seq is the sequence number of the newest complete frame (0 = none yet) and
+# read_seq the newest one the reader has taken, which lets the writer skip decoding
+# frames nobody will read (see wants_frame). read_failures counts failed camera
+# reads, so the streaming process can report them for every capture process.
+# slot_seqs[i] holds the sequence number of the frame stored in slot i, or -1
+# while the writer is filling it, so a reader can tell whether the slot it is
+# looking at is still the frame it asked for. slot_times[i] is the capture time
+# (wall clock, monotonic clock) of the frame in slot i.
+_SEQ_DTYPE = np.int64
+_SEQ_SIZE = np.dtype(_SEQ_DTYPE).itemsize
+_WRITING = -1
+
+
+class FrameRing:
+    """Fixed-size ring of frames in shared memory, written by one capture process
+    and read by the merger without pickling or copying.
+
+    The writer side exposes put() and the reader side get_nowait(), so a ring can be
+    used anywhere capture_camera/stream_merged_frames expect a frame queue. The
+    writer sets ready_event (a multiprocessing.Event shared with the merger, see
+    Core.pacing.FramePacer) whenever it publishes a frame.
+    """
+
+    def __init__(self, frame_shape, slots=4, name=None, create=True, ready_event=None):
+        self.frame_shape = tuple(frame_shape)
+        self.ready_event = ready_event
+        self.slots = slots
+        self.frame_size = int(np.prod(self.frame_shape))
+        header_size = _SEQ_SIZE * (3 + slots) + np.dtype(np.float64).itemsize * 2 * slots
+        total_size = header_size + self.frame_size * slots
+
+        if create:
+            self._shm = shared_memory.SharedMemory(
+                name=name, create=True, size=total_size)
+        else:
+            self._shm = shared_memory.SharedMemory(name=name)
+        self._owner = create
+
+        seqs = np.ndarray((3 + slots,), dtype=_SEQ_DTYPE, buffer=self._shm.buf)
+        self._write_seq = seqs[0:1]
+        self._read_seq = seqs[1:2]
+        self._read_failures = seqs[2:3]
+        self._slot_seqs = seqs[3:]
+        self._slot_times = np.ndarray((slots, 2), dtype=np.float64, buffer=self._shm.buf,
+                                      offset=seqs.nbytes)
+        self._frames = np.ndarray((slots,) + self.frame_shape, dtype=np.uint8,
+                                  buffer=self._shm.buf, offset=header_size)
+        if create:
+            self._write_seq[0] = 0
+            self._read_seq[0] = 0
+            self._read_failures[0] = 0
+            self._slot_seqs[:] = 0
+            self._slot_times[:] = 0
+
+        self._last_read_seq = 0
+        self._captured = None  # CaptureTime of the frame last returned by get_nowait()
+        self._dropped = 0
+        self._dropped_total = 0
+        self._acquired = None  # Slot view handed out by acquire_buffer()
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    @property
+    def write_seq(self):
+        """Sequence number of the newest complete frame (0 if none written yet)."""
+        return int(self._write_seq[0])
+
+    # --- Writer side ---
+
+    def acquire_buffer(self, shape):
+        """Returns the next slot so the writer can resize a frame straight into shared memory.
+        Pass the returned array to put() to publish it without a copy.
+        """
+        if tuple(shape) != self.frame_shape:
+            raise ValueError(
+                f"Buffer shape {tuple(shape)} does not match ring shape {self.frame_shape}")
+        index = (int(self._write_seq[0]) + 1) % self.slots
+        self._slot_seqs[index] = _WRITING
+        self._acquired = self._frames[index]
+        return self._acquired
+
+    def put(self, frame, timeout=None, captured=None):
+        """Publishes a frame into the next slot. Never blocks; the oldest slot is overwritten.
+        captured is the frame's CaptureTime (default now)."""
+        seq = int(self._write_seq[0]) + 1
+        index = seq % self.slots
+        if frame is not self._acquired:
+            if frame.shape != self.frame_shape:
+                raise ValueError(
+                    f"Frame shape {frame.shape} does not match ring shape {self.frame_shape}")
+            self._slot_seqs[index] = _WRITING
+            np.copyto(self._frames[index], frame)
+        self._acquired = None
+        self._slot_times[index] = captured or capture_now()
+        self._slot_seqs[index] = seq
+        self._write_seq[0] = seq
+        if self.ready_event is not None:
+            self.ready_event.set()
+
+    def record_read_failure(self):
+        """Counts a frame the capture process failed to read from the camera."""
+        self._read_failures[0] += 1
+
+    def wants_frame(self):
+        """True once the reader has taken the newest frame (or none was written yet)."""
+        return int(self._read_seq[0]) == int(self._write_seq[0])
+
+    # --- Reader side ---
+
+    def get_nowait(self):
+        """Returns a view of the newest frame if one arrived since the last call.
+
+        The returned array points straight into shared memory. It stays valid until the
+        writer wraps around the ring, which is slots - 1 frames later; use is_current()
+        to check after using it if that matters.
+
+        Raises:
+            queue.Empty: If no new frame has been written since the last call.
+        """
+        seq = int(self._write_seq[0])
+        if seq == 0 or seq == self._last_read_seq:
+            raise queue.Empty
+        index = seq % self.slots
+        if int(self._slot_seqs[index]) != seq:
+            # Writer already moved on and is refilling this slot
+            raise queue.Empty
+        if self._last_read_seq:
+            skipped = seq - self._last_read_seq - 1
+            self._dropped += skipped
+            self._dropped_total += skipped
+        self._last_read_seq = seq
+        self._read_seq[0] = seq
+        self._captured = CaptureTime(*self._slot_times[index].tolist())
+        return self._frames[index]
+
+    @property
+    def captured(self):
+        """CaptureTime of the frame last returned by get_nowait(), or None."""
+        return self._captured
+
+    def is_current(self, seq):
+        """True if the frame with this sequence number has not been overwritten yet."""
+        return int(self._slot_seqs[seq % self.slots]) == seq
+
+    @property
+    def last_read_seq(self):
+        return self._last_read_seq
+
+    @property
+    def frames_published(self):
+        return self.write_seq
+
+    @property
+    def frames_dropped(self):
+        """Total frames the reader skipped (unlike drain_dropped, never reset)."""
+        return self._dropped_total
+
+    @property
+    def read_failures(self):
+        """Failed camera reads recorded by the writer."""
+        return int(self._read_failures[0])
+
+    def drain_dropped(self):
+        """Returns the number of frames the reader skipped since the last call."""
+        dropped, self._dropped = self._dropped, 0
+        return dropped
+
+    def close(self):
+        """Detaches from the shared memory; the creator also unlinks it."""
+        # Drop numpy views first, otherwise SharedMemory.close() fails on exported buffers
+        self._write_seq = self._read_seq = self._read_failures = None
+        self._slot_seqs = self._slot_times = self._frames = self._acquired = None
+        try:
+            self._shm.close()
+        except BufferError:
+            # A caller still holds a frame view; the mapping goes away with the process
+            pass
+        if self._owner:
+            try:
+                self._shm.unlink()
+            except FileNotFoundError:
+                pass
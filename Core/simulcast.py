@@ -0,0 +1,92 @@
+import time
+from collections import namedtuple
+
+# A smaller encoding of every camera frame: the box it is fitted into, frame rate
+# (0 = every frame) and JPEG quality
+SimulcastTier = namedtuple('SimulcastTier', ['width', 'height', 'fps', 'quality'])
+
+
+def parse_tiers(value, default_quality):
+    """Parses a tiers setting: comma-separated '<width>x<height>@<fps>[:<quality>]'
+    items, e.g. '320x180@5:50, 640x360@10'. quality defaults to default_quality.
+
+    Raises:
+        ValueError: If an item is malformed or out of range.
+    """
+    tiers = []
+    for item in value.split(','):
+        item = item.strip().lower()
+        if not item:
+            continue
+        try:
+            size, _, rate = item.partition('@')
+            fps, _, quality = rate.partition(':')
+            width, height = (int(part) for part in size.split('x'))
+            tier = SimulcastTier(width, height, float(fps) if fps else 0.0,
+                                 int(quality) if quality else default_quality)
+        except ValueError:
+            raise ValueError(f"Invalid simulcast tier '{item}'. Expected '<width>x<height>@<fps>[:<quality>]'.")
+        if tier.width <= 0 or tier.height <= 0 or tier.fps < 0 or not 1 <= tier.quality <= 100:
+            raise ValueError(f"Invalid simulcast tier '{item}'.")
+        tiers.append(tier)
+    return tiers
+
+
+def fit_size(tier, width, height):
+    """Size a width x height frame is encoded at for a tier: fitted inside the tier's
+    box with its aspect ratio kept, and never scaled up."""
+    scale = min(tier.width / width, tier.height / height, 1.0)
+    return max(round(width * scale), 1), max(round(height * scale), 1)
+
+
+class SimulcastScheduler:
+    """Decides which simulcast tiers each camera frame is encoded for (stream_mode = split).
+
+    Tier 0 is the main stream: every frame at the output size and quality. Tiers 1..n
+    are the configured ones, each at most at its fps, on a steady cadence per camera.
+    Every (camera, tier) has its own seq, so a tier skipping frames is not loss.
+    """
+
+    def __init__(self, tiers):
+        self.tiers = list(tiers)
+        self._next_due = {}  # (camera id, tier number) -> time.monotonic() of its next frame
+        self._seqs = {}      # (camera id, tier number) -> seq of its next frame
+
+    def due(self, camera_id, now=None):
+        """Tiers the camera's current frame is to be encoded for.
+
+        Returns:
+            A list of (tier number, SimulcastTier, seq) tuples, largest tier first, so
+            each tier can be scaled down from the one before it.
+        """
+        now = time.monotonic() if now is None else now
+        due = []
+        for number, tier in enumerate(self.tiers, start=1):
+            key = (camera_id, number)
+            next_due = self._next_due.get(key)
+            if next_due is not None and now < next_due:
+                continue
+            interval = 1.0 / tier.fps if tier.fps > 0 else 0.0
+            # Keep a steady cadence, but don't burst to catch up after a stall
+            next_due = next_due + interval if next_due is not None else now + interval
+            self._next_due[key] = next_due if next_due > now else now + interval
+            seq = self._seqs.get(key, 0)
+            self._seqs[key] = seq + 1
+            due.append((number, tier, seq))
+        due.sort(key=lambda item: item[1].width * item[1].height, reverse=True)
+        return due
+
+    def forget(self, camera_id):
+        """Drops the state of a camera that left the camera set."""
+        for key in [key for key in self._next_due if key[0] == camera_id]:
+            del self._next_due[key]
+            self._seqs.pop(key, None)
+
+    def describe(self, width, height, fps):
+        """Every tier, the main stream (width x height at fps) first, as JSON-friendly dicts
+        for the camera set message. Sizes are those encoded from width x height frames."""
+        tiers = [{'tier': 0, 'width': width, 'height': height, 'fps': fps}]
+        for number, tier in enumerate(self.tiers, start=1):
+            tier_width, tier_height = fit_size(tier, width, height)
+            tiers.append({'tier': number, 'width': tier_width, 'height': tier_height, 'fps': tier.fps})
+        return tiers
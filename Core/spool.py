@@ -0,0 +1,248 @@
+import bisect
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import Counter, deque
+from Core.metrics import REGISTRY, camera_label
+
+logging.basicConfig(level=logging.INFO,
+                    format="%(asctime)s - %(levelname)s - %(message)s")
+
+# A spool directory holds segment files named after the spool id of their first
+# record. Each segment is preallocated to its full size and filled with records:
+#
+#   length(4) spool_id(8) camera_id(2) message(length)
+#
+# where message is the complete protocol message (header and payload) as it would
+# have been sent live. Spool ids increase across segments and restarts. The file is
+# zero-filled, so a zero length marks the end of the records; a record's header is
+# written after its message, so a record cut short by a crash reads as that end.
+RECORD_STRUCT = struct.Struct('>IQH')
+SEGMENT_SUFFIX = '.seg'
+DEFAULT_SEGMENT_SIZE = 16 * 1024 * 1024
+
+SPOOLED = REGISTRY.counter(
+    'spool_frames_total', 'Frames written to the spool while the uplink was down', ('camera',))
+SPOOL_EVICTED = REGISTRY.counter(
+    'spool_frames_evicted_total', 'Spooled frames deleted unsent to stay under the size cap')
+SPOOL_REPLAYED = REGISTRY.counter(
+    'spool_frames_replayed_total', 'Spooled frames sent after the uplink came back')
+
+
+class _Segment:
+    """One memory-mapped segment file and the index of the records in it."""
+
+    def __init__(self, path, size=None):
+        self.path = path
+        self._file = open(path, 'w+b' if size else 'r+b')
+        if size:
+            self._file.truncate(size)
+        self.size = os.fstat(self._file.fileno()).st_size
+        self.map = mmap.mmap(self._file.fileno(), self.size)
+        self.ids = []      # Spool ids of the records, ascending
+        self.records = []  # (camera_id, offset, length) of the message of each record
+        self.end = 0       # Offset the next record is written at
+
+    def scan(self):
+        """Indexes the records already in the file."""
+        while self.end + RECORD_STRUCT.size <= self.size:
+            length, spool_id, camera_id = RECORD_STRUCT.unpack_from(self.map, self.end)
+            offset = self.end + RECORD_STRUCT.size
+            if length == 0 or offset + length > self.size:
+                break
+            self.ids.append(spool_id)
+            self.records.append((camera_id, offset, length))
+            self.end = offset + length
+
+    def fits(self, length):
+        return self.end + RECORD_STRUCT.size + length <= self.size
+
+    def append(self, spool_id, camera_id, header, payload):
+        offset = self.end + RECORD_STRUCT.size
+        length = len(header) + payload.nbytes
+        self.map[offset:offset + len(header)] = header
+        self.map[offset + len(header):offset + length] = payload
+        RECORD_STRUCT.pack_into(self.map, self.end, length, spool_id, camera_id)
+        self.ids.append(spool_id)
+        self.records.append((camera_id, offset, length))
+        self.end = offset + length
+
+    def close(self, delete=False):
+        self.map.close()
+        self._file.close()
+        if delete:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+
+class FrameSpool:
+    """Disk-backed backlog of frames the uplink could not send, for FrameSender.
+
+    While the uplink is down the sender appends encoded frames here instead of
+    dropping them (at most max_fps per camera, 0 = all). The records go into
+    memory-mapped segment files of segment_size bytes, so an append is a copy into
+    the page cache and not a write() per frame, and the spool survives a restart of
+    the edge. Once max_bytes is reached, the oldest segment is deleted.
+
+    After a reconnect the sender replays the records oldest first (next_replay)
+    next to the live frames, and the receiver acknowledges each one. Since replay
+    is in spool id order over a single connection, an ack covers every record up
+    to its id; segments whose records are all acknowledged are deleted. Records
+    sent but not acknowledged when a connection fails are replayed again on the
+    next one (rewind).
+    """
+
+    def __init__(self, directory, max_bytes, segment_size=DEFAULT_SEGMENT_SIZE, max_fps=0.0):
+        self.directory = directory
+        self.segment_size = min(segment_size, max_bytes)
+        self.max_segments = max(max_bytes // self.segment_size, 1)
+        self.min_interval = 1.0 / max_fps if max_fps and max_fps > 0 else 0.0
+        self._lock = threading.Lock()
+        self._segments = deque()
+        self._backlog = Counter()  # camera id -> records not acknowledged yet
+        self._last_spooled = {}    # camera id -> time.monotonic() of its last record
+        self._next_id = 1
+        self._acked = 0    # Every record up to this id was acknowledged
+        self._cursor = 0   # Id of the last record handed out by next_replay()
+        self.frames_evicted = 0
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        names = sorted(name for name in os.listdir(self.directory) if name.endswith(SEGMENT_SUFFIX))
+        for name in names:
+            path = os.path.join(self.directory, name)
+            try:
+                segment = _Segment(path)
+            except (OSError, ValueError) as e:
+                logging.warning(f"Cannot open spool segment {path}: {e}")
+                continue
+            segment.scan()
+            if not segment.ids:
+                segment.close(delete=True)
+                continue
+            self._segments.append(segment)
+            for camera_id, _, _ in segment.records:
+                self._backlog[camera_id] += 1
+            self._next_id = segment.ids[-1] + 1
+        if self._segments:
+            # Ids before the first record were acknowledged before the restart
+            self._acked = self._cursor = self._segments[0].ids[0] - 1
+            logging.info(f"Spool {self.directory}: {self.pending} frames from an earlier run to replay.")
+
+    @property
+    def pending(self):
+        """Records not acknowledged yet."""
+        return sum(self._backlog.values())
+
+    @property
+    def size_bytes(self):
+        return sum(segment.size for segment in self._segments)
+
+    def backlog(self):
+        """camera id -> records not acknowledged yet."""
+        with self._lock:
+            return {camera_id: count for camera_id, count in self._backlog.items() if count}
+
+    def append(self, camera_id, header, payload):
+        """Spools one message (header and payload, any buffers).
+
+        Returns:
+            False if it was skipped to keep the camera at max_fps or does not fit a segment.
+        """
+        payload = memoryview(payload).cast('B')
+        length = len(header) + payload.nbytes
+        if RECORD_STRUCT.size + length > self.segment_size:
+            logging.warning(f"Frame of camera {camera_id} ({length} bytes) exceeds the spool segment size.")
+            return False
+        now = time.monotonic()
+        with self._lock:
+            last = self._last_spooled.get(camera_id)
+            if last is not None and now - last < self.min_interval:
+                return False
+            self._last_spooled[camera_id] = now
+            segment = self._segments[-1] if self._segments else None
+            if segment is None or not segment.fits(length):
+                if segment is not None:
+                    segment.map.flush()  # Sealed; its pages can go to disk now
+                while len(self._segments) >= self.max_segments:
+                    self._evict()
+                segment = _Segment(os.path.join(self.directory, f"{self._next_id:020d}{SEGMENT_SUFFIX}"),
+                                   self.segment_size)
+                self._segments.append(segment)
+            segment.append(self._next_id, camera_id, header, payload)
+            self._next_id += 1
+            self._backlog[camera_id] += 1
+        SPOOLED.labels(camera_label(camera_id)).inc()
+        return True
+
+    def _evict(self):
+        """Deletes the oldest segment, acknowledged or not. Called with the lock held."""
+        segment = self._segments.popleft()
+        evicted = 0
+        for spool_id, (camera_id, _, _) in zip(segment.ids, segment.records):
+            if spool_id > self._acked:
+                self._backlog[camera_id] -= 1
+                evicted += 1
+        segment.close(delete=True)
+        if evicted:
+            self.frames_evicted += evicted
+            SPOOL_EVICTED.inc(evicted)
+            logging.warning(f"Spool full: deleted {evicted} unsent frames.")
+
+    def next_replay(self):
+        """Returns the next record to replay as (spool id, camera id, message bytes), or None."""
+        with self._lock:
+            for segment in self._segments:
+                if not segment.ids or segment.ids[-1] <= self._cursor:
+                    continue
+                index = bisect.bisect_right(segment.ids, self._cursor)
+                camera_id, offset, length = segment.records[index]
+                self._cursor = spool_id = segment.ids[index]
+                # A copy, so the segment can be deleted while the message is in flight
+                message = bytes(segment.map[offset:offset + length])
+                break
+            else:
+                return None
+        SPOOL_REPLAYED.inc()
+        return spool_id, camera_id, message
+
+    def has_replay(self):
+        """True if next_replay() has a record to return."""
+        with self._lock:
+            return bool(self._segments) and self._segments[-1].ids[-1] > self._cursor
+
+    def rewind(self):
+        """Replays from the oldest unacknowledged record again, e.g. on a new connection."""
+        with self._lock:
+            self._cursor = self._acked
+
+    def ack(self, spool_id):
+        """Marks every record up to spool_id as received and deletes fully acknowledged segments."""
+        with self._lock:
+            if spool_id <= self._acked:
+                return
+            for segment in self._segments:
+                if segment.ids and segment.ids[0] > spool_id:
+                    break
+                start = bisect.bisect_right(segment.ids, self._acked)
+                end = bisect.bisect_right(segment.ids, spool_id)
+                for camera_id, _, _ in segment.records[start:end]:
+                    self._backlog[camera_id] -= 1
+            self._acked = spool_id
+            self._cursor = max(self._cursor, spool_id)
+            while self._segments and self._segments[0].ids[-1] <= spool_id:
+                self._segments.popleft().close(delete=True)
+
+    def close(self):
+        """Writes the segments out and closes them; unacknowledged records stay on disk."""
+        with self._lock:
+            for segment in self._segments:
+                segment.map.flush()
+                segment.close()
+            self._segments.clear()
@@ -1,11 +1,32 @@
-import socket
 import cv2
 import numpy as np
-from queue import Queue, Empty
-from threading import Thread, Event
+from queue import Empty
+from threading import Thread, Event, Lock
+from concurrent.futures import ThreadPoolExecutor
 import time
 import logging
-import queue  #
+import json
+import multiprocessing
+import os
+from functools import partial
+from Core.protocol import PAYLOAD_JPEG, PAYLOAD_MOSAIC_JPEG, PAYLOAD_LAYOUT, PAYLOAD_KEEPALIVE, PAYLOAD_TILES, PAYLOAD_CAMERAS, PAYLOAD_VIDEO_PACKET, PAYLOAD_VIDEO_CONFIG, PAYLOAD_TIER_JPEG, MOSAIC_CAMERA_ID, capture_now, parse_video_flags
+from Core.shm_ring import FrameRing
+from Core.frame_slot import LatestFrameSlot
+from Core.passthrough import PacketQueue, open_packet_capture, packet_stream_info
+from Core.compositor import MosaicCompositor, LAYOUT_HORIZONTAL, LAYOUT_AUTO
+from Core.camera_set import CameraSet
+from Core.rate_control import AdaptiveController
+from Core.sender import FrameSender, DatagramSender, TRANSPORT_TCP, TRANSPORT_UDP
+from Core.datagram import DEFAULT_MTU, DEFAULT_FEC_GROUP
+from Core.change_detect import ChangeDetector
+from Core.pacing import FramePacer
+from Core.spool import FrameSpool
+from Core.uplink import UplinkChannels, REBALANCE_TOLERANCE
+from Core.tiles import TileDeltaEncoder, parse_tile_grid
+from Core.simulcast import SimulcastScheduler, parse_tiers, fit_size
+from Core.metrics import REGISTRY, camera_label, start_metrics_server
+from Core.receive_command import start_control_server
+from Core.substream import negotiate_substream, DEFAULT_SUBSTREAM_CODEC
 
 logging.basicConfig(level=logging.INFO,
                     format="%(asctime)s - %(levelname)s - %(message)s")
@@ -16,46 +37,56 @@ WINDOW_NAME = "Combined Stream"  # Name of the OpenCV display window
 WINDOW_WIDTH_PER_CAMERA = 720
 WINDOW_HEIGHT = 480  # Adjust this to control the height of the display window
 
+# How frames are put on the wire (see Core/protocol.py)
+STREAM_MODE_SPLIT = "split"    # One JPEG per camera, tagged with its camera id
+STREAM_MODE_MOSAIC = "mosaic"  # All cameras merged side by side into one JPEG
+STREAM_MODE_PASSTHROUGH = "passthrough"  # Each camera's encoded packets, forwarded without decoding
+DEFAULT_JPEG_QUALITY = 70
+DEFAULT_ENCODE_WORKERS = 2  # cv2.imencode releases the GIL, so encodes run in parallel
+DEFAULT_TARGET_FPS = 25.0
+DEFAULT_BATCH_WINDOW = 0.005  # Seconds the mosaic waits for other cameras after a frame arrives
 
+# Where camera capture runs
+CAPTURE_MODE_THREAD = "thread"    # One capture thread per camera in the streaming process
+CAPTURE_MODE_PROCESS = "process"  # One capture process per camera, frames shared via FrameRing
+DEFAULT_RING_SLOTS = 4
+INITIAL_RESTART_BACKOFF = 1.0  # Seconds before restarting a dead capture process
+MAX_RESTART_BACKOFF = 30.0
 
-def create_socket(ip, port, retries=0, delay=5):
-    """Attempt to create a socket connection with retries. If retries=0, loop indefinitely."""
-    attempt = 0
-    while True:
-        attempt += 1
-        logging.info(f"Attempting socket connection to {ip}:{port} (Attempt {attempt})...")
-        client_socket = None  # Ensure socket is None at the start of each attempt
-        try:
-            client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            client_socket.settimeout(10) # Maybe slightly shorter timeout for connect?
-            client_socket.connect((ip, port))
-            logging.info(f"Socket connected successfully to {ip}:{port}")
-            return client_socket  # Return the connected socket
-
-        except socket.error as e:
-            logging.error(f"Socket connection attempt {attempt} failed: {e}")
-            if client_socket:
-                client_socket.close() # Close the failed socket object
-
-            # Check retry condition
-            # Using '!=' covers both infinite (0) and finite retries
-            if retries != 0 and attempt >= retries:
-                logging.error(f"Max retries ({retries}) reached. Failed to connect to {ip}:{port}.")
-                break # Exit loop after max retries
-
-            # If retries == 0 or attempt < retries, wait and retry
-            logging.info(f"Retrying connection in {delay} seconds...")
-            time.sleep(delay)
-        # No finally block needed here for managing the socket object itself
-    return None # Return None if all retries failed
-
-
-def capture_camera(ip_address, cam_user, cam_password, resize_frame, frame_queue, stop_event):
-    """Captures video frames from an RTSP camera and puts them into a queue.
-       If frame capture fails, puts a blank (black) frame into the queue instead.
+# Pipeline metrics (see Core/metrics.py); capture counters are read from the frame slots
+COMPOSE_SECONDS = REGISTRY.histogram(
+    'compose_seconds', 'Time of one merger pass: collect, gate, compose and queue encodes')
+ENCODE_SECONDS = REGISTRY.histogram(
+    'encode_seconds', 'Time to scale and encode one frame', ('camera',))
+FRAMES_ENCODED = REGISTRY.counter(
+    'frames_encoded_total', 'Frames encoded and handed to the sender', ('camera', 'type'))
+KEEPALIVES = REGISTRY.counter(
+    'keepalives_total', 'Keepalives queued for cameras whose frames were suppressed', ('camera',))
+_PAYLOAD_LABELS = {PAYLOAD_JPEG: 'jpeg', PAYLOAD_TILES: 'tiles', PAYLOAD_MOSAIC_JPEG: 'mosaic',
+                   PAYLOAD_TIER_JPEG: 'tier'}
+
+
+def capture_camera(ip_address, cam_user, cam_password, resize_frame, frame_slot, stop_event, decode_on_demand=True, source=None, capture_factory=None, negotiate=None):
+    """Captures video frames from an RTSP camera and publishes the newest one to a frame slot
+       (LatestFrameSlot or FrameRing). If frame capture fails, publishes a blank (black) frame instead.
+
+       With decode_on_demand the stream is drained with grab() and a frame is only
+       retrieve()d and resized once the consumer has taken the previous one, so frames
+       that would never be sent are not converted or resized.
+
+       source overrides the camera's RTSP URL (e.g. a local video file), and
+       capture_factory replaces cv2.VideoCapture; the benchmark uses both to feed
+       synthetic cameras through this same code path.
+
+       negotiate is called once before connecting, e.g. to have the camera send its
+       substream at resize_frame (see Core/substream.py). Frames that already have
+       the resize_frame size are published without resizing.
     """
-    RTSP_ADDRESS = f"rtsp://{cam_user}:{cam_password}@{ip_address}:554/Streaming/Channels/102"
-    cap = cv2.VideoCapture(RTSP_ADDRESS)
+    if negotiate is not None:
+        negotiate()
+    RTSP_ADDRESS = source or f"rtsp://{cam_user}:{cam_password}@{ip_address}:554/Streaming/Channels/102"
+    capture_factory = capture_factory or cv2.VideoCapture
+    cap = capture_factory(RTSP_ADDRESS)
 
     cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
 
@@ -64,40 +95,48 @@ def capture_camera(ip_address, cam_user, cam_password, resize_frame, frame_queue
         # Even if camera connection fails initially, we will still send blank frames
         # so that the merged stream is consistent in frame count.
 
+    # Create a blank (black) frame of the desired size once
+    # Height, Width, Channels
+    blank_frame = np.zeros(
+        (resize_frame[1], resize_frame[0], 3), dtype=np.uint8)
+
     try:
         while not stop_event.is_set():
-            ret, frame = cap.read()
+            if decode_on_demand:
+                ret = cap.grab()
+                captured = capture_now()
+                if ret and not frame_slot.wants_frame():
+                    continue  # Consumer still has an unread frame, keep draining the stream
+                if ret:
+                    ret, frame = cap.retrieve()
+            else:
+                ret, frame = cap.read()
+                captured = capture_now()
+
             if not ret:
                 logging.warning(
                     f"Error reading frame from {ip_address}, using blank frame.")
-                # Create a blank (black) frame of the desired size
-                # Height, Width, Channels
-                blank_frame = np.zeros(
-                    (resize_frame[1], resize_frame[0], 3), dtype=np.uint8)
-                frame_to_queue = blank_frame  # Use blank frame
+                frame_slot.record_read_failure()
+                frame_to_publish = blank_frame  # Use blank frame
 
                 # Optionally attempt reconnect (you can keep or remove this part)
                 cap.release()
                 time.sleep(0.1)
-                cap = cv2.VideoCapture(RTSP_ADDRESS)
+                cap = capture_factory(RTSP_ADDRESS)
                 cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
 
             else:  # Frame read successfully
-                if resize_frame[0] > 0 and resize_frame[1] > 0:
-                    frame_to_queue = cv2.resize(frame, resize_frame)
+                if resize_frame[0] > 0 and resize_frame[1] > 0 and \
+                        (frame.shape[1], frame.shape[0]) != tuple(resize_frame):
+                    # Resize straight into a reusable buffer (or shared-memory slot)
+                    frame_to_publish = frame_slot.acquire_buffer(
+                        (resize_frame[1], resize_frame[0], 3))
+                    cv2.resize(frame, resize_frame, dst=frame_to_publish)
                 else:
-                    frame_to_queue = frame  # Use original frame if no resizing
-            try:
-                # Put either captured frame or blank frame
-                frame_queue.put(frame_to_queue, timeout=0.01)
-            except queue.Full:
-                logging.warning(
-                    f"Frame queue full for {ip_address}, dropping frame.")
-                try:
-                    frame_queue.get_nowait()  # Discard oldest frame
-                except queue.Empty:
-                    pass
-                continue
+                    frame_to_publish = frame  # Already the right size, or no resizing wanted
+
+            # Publish either captured frame or blank frame; an unread older frame is replaced
+            frame_slot.put(frame_to_publish, captured=captured)
 
     except Exception as e:
         logging.error(f"Capture error for {ip_address}: {e}")
@@ -106,147 +145,839 @@ def capture_camera(ip_address, cam_user, cam_password, resize_frame, frame_queue
         logging.info(f"Capture stopped for {ip_address}.")
 
 
-def stream_merged_frames(queues, video_socket, vps_ip, video_port, stop_event, num_cameras, resize_frame=(0, 0), max_reconnect_attempts=5, reconnect_delay=5):
-    """Merges frames, using last good frame if queue is empty, ensures consistent merged frame size,
-       and streams the combined frame over TCP. Avoids black frames for temporary camera drops.
+def relay_camera(ip_address, cam_user, cam_password, packet_queue, stop_event, source=None, capture_factory=None, negotiate=None):
+    """Passthrough capture: reads a camera's encoded packets without decoding them and
+       queues them, in order and with their keyframe flag, on a PacketQueue.
+
+       The stream is reopened after read errors; every (re)opened stream records its
+       codec parameters first, so the receiver gets them before the first keyframe.
+       source, capture_factory and negotiate work as for capture_camera.
+    """
+    if negotiate is not None:
+        negotiate()
+    RTSP_ADDRESS = source or f"rtsp://{cam_user}:{cam_password}@{ip_address}:554/Streaming/Channels/102"
+    cap = None
+    try:
+        while not stop_event.is_set():
+            if cap is None:
+                cap = open_packet_capture(RTSP_ADDRESS, capture_factory)
+                if not cap.isOpened():
+                    logging.error(f"Failed to connect to camera at {ip_address}.")
+                    packet_queue.record_read_failure()
+                    cap.release()
+                    cap = None
+                    stop_event.wait(1.0)
+                    continue
+                packet_queue.set_stream_info(packet_stream_info(cap))
+
+            ret, packet = cap.read()
+            if not ret or packet is None or packet.size == 0:
+                logging.warning(f"Error reading packet from {ip_address}, reconnecting.")
+                packet_queue.record_read_failure()
+                cap.release()
+                cap = None
+                stop_event.wait(0.1)
+                continue
+            packet_queue.put(packet, bool(cap.get(cv2.CAP_PROP_LRF_HAS_KEY_FRAME)))
+
+    except Exception as e:
+        logging.error(f"Relay error for {ip_address}: {e}")
+    finally:
+        if cap is not None:
+            cap.release()
+        logging.info(f"Relay stopped for {ip_address}.")
+
+
+def encode_frame(sender, payload_type, camera_id, seq, image, quality, scale=1.0, tile_encoder=None, captured=None):
+    """Encode stage: JPEG-encodes one image on a worker thread and hands it to the sender.
+       With a tile_encoder, camera frames are sent as keyframes or changed tiles only.
+       captured (a Core.protocol.CaptureTime) goes into the message header.
+    """
+    start = time.perf_counter()
+    label = camera_label(camera_id)
+    if scale < 1.0:
+        image = cv2.resize(image, None, fx=scale, fy=scale,
+                           interpolation=cv2.INTER_AREA)
+
+    # While the uplink is down frames go to the spool, which needs them whole
+    if tile_encoder is not None and payload_type == PAYLOAD_JPEG and not sender.spooling:
+        encoded = tile_encoder.encode(camera_id, image, quality)
+        ENCODE_SECONDS.labels(label).observe(time.perf_counter() - start)
+        if encoded is None:
+            # Nothing changed (or encoding failed and a keyframe is requested). The
+            # keepalive uses up seq, so the receiver does not count the frame as lost.
+            sender.submit(PAYLOAD_KEEPALIVE, camera_id, seq, b'', key=(PAYLOAD_KEEPALIVE, camera_id))
+            return
+        payload_type, payload = encoded
+        FRAMES_ENCODED.labels(label, _PAYLOAD_LABELS[payload_type]).inc()
+        if sender.submit(payload_type, camera_id, seq, payload, captured=captured):
+            # An unsent delta or keyframe was dropped; the receiver's canvas is now behind
+            tile_encoder.request_keyframe(camera_id)
+        return
+
+    ok, jpeg = cv2.imencode('.jpg', image, [int(cv2.IMWRITE_JPEG_QUALITY), quality])
+    ENCODE_SECONDS.labels(label).observe(time.perf_counter() - start)
+    if not ok:
+        logging.error(f"Failed to encode frame to JPEG (camera {camera_id}).")
+        return
+    FRAMES_ENCODED.labels(label, _PAYLOAD_LABELS[payload_type]).inc()
+    sender.submit(payload_type, camera_id, seq, jpeg, captured=captured)
+
+
+def encode_tiers(sender, camera_id, image, tiers, captured=None):
+    """Encode stage of simulcast: encodes one camera frame once per due tier
+    (SimulcastScheduler.due(), largest first) and sends each as PAYLOAD_TIER_JPEG.
+
+    Every tier keeps the frame's aspect ratio (see Core.simulcast.fit_size) and is
+    scaled down from the decoded frame, or from the previous tier where that is at
+    least as large, and never scaled up.
+    """
+    label = camera_label(camera_id)
+    source = image
+    for number, tier, seq in tiers:
+        start = time.perf_counter()
+        size = fit_size(tier, image.shape[1], image.shape[0])
+        if source.shape[1] < size[0] or source.shape[0] < size[1]:
+            source = image
+        scaled = source
+        if (source.shape[1], source.shape[0]) != size:
+            scaled = cv2.resize(source, size, interpolation=cv2.INTER_AREA)
+        ok, jpeg = cv2.imencode('.jpg', scaled, [int(cv2.IMWRITE_JPEG_QUALITY), tier.quality])
+        ENCODE_SECONDS.labels(label).observe(time.perf_counter() - start)
+        if not ok:
+            logging.error(f"Failed to encode tier {number} of camera {camera_id}.")
+            continue
+        source = scaled
+        FRAMES_ENCODED.labels(label, _PAYLOAD_LABELS[PAYLOAD_TIER_JPEG]).inc()
+        sender.submit(PAYLOAD_TIER_JPEG, camera_id, seq, jpeg, flags=number,
+                      key=(PAYLOAD_TIER_JPEG, camera_id, number), captured=captured)
+
+
+def encode_simulcast(sender, camera_id, seq, image, quality, scale, tile_encoder, captured, tiers):
+    """Encode stage of a split-mode camera frame with simulcast tiers due: the frame
+    itself (encode_frame), then its tiers (encode_tiers), all from the same image."""
+    encode_frame(sender, PAYLOAD_JPEG, camera_id, seq, image, quality, scale, tile_encoder, captured)
+    encode_tiers(sender, camera_id, image, tiers, captured)
+
+
+def register_camera_metrics(camera_id, queue):
+    """Exposes a camera's capture counters as scrape-time metrics.
+
+    The counters live in the frame slot (in shared memory for capture processes), so
+    they are read on scrape instead of being copied on every frame.
+    """
+    REGISTRY.register_callback(
+        'counter', 'capture_frames_total', 'Frames published by the capture side',
+        lambda: queue.frames_published, ('camera',), (camera_id,))
+    REGISTRY.register_callback(
+        'counter', 'capture_read_failures_total', 'Failed camera reads (replaced by a blank frame)',
+        lambda: queue.read_failures, ('camera',), (camera_id,))
+    REGISTRY.register_callback(
+        'counter', 'capture_frames_dropped_total', 'Captured frames replaced before the merger took them',
+        lambda: queue.frames_dropped, ('camera',), (camera_id,))
+
+
+def unregister_camera_metrics(camera_id):
+    for name in ('capture_frames_total', 'capture_read_failures_total', 'capture_frames_dropped_total'):
+        REGISTRY.counter(name, '', ('camera',)).remove(camera_id)
+
+
+def register_pipeline_metrics(rate_controller=None, change_detector=None, spools=None):
+    """Exposes the adaptive controller's state, the change detector's counters and the spool's backlog."""
+    if rate_controller is not None:
+        REGISTRY.register_callback('gauge', 'adaptive_quality', 'Current JPEG quality',
+                                   lambda: rate_controller.quality)
+        REGISTRY.register_callback('gauge', 'adaptive_scale', 'Current output scale',
+                                   lambda: rate_controller.scale)
+        REGISTRY.register_callback('gauge', 'adaptive_fps', 'Current target frame rate',
+                                   lambda: rate_controller.fps)
+    if change_detector is not None:
+        REGISTRY.register_callback('counter', 'frames_suppressed_total',
+                                   'Frames not sent because the camera image did not change',
+                                   lambda: change_detector.frames_suppressed)
+    if spools:
+        REGISTRY.register_callback('gauge', 'spool_backlog_frames', 'Spooled frames not acknowledged yet',
+                                   lambda: sum(spool.pending for spool in spools))
+        REGISTRY.register_callback('gauge', 'spool_bytes', 'Disk space taken by spool segments',
+                                   lambda: sum(spool.size_bytes for spool in spools))
+
+
+def create_compositor(num_cameras, tile_size, mosaic_layout):
+    """Builds the mosaic compositor, falling back to an auto grid if the configured one is too small."""
+    try:
+        return MosaicCompositor(num_cameras, tile_size, mosaic_layout)
+    except ValueError as e:
+        logging.warning(f"{e} Using an auto layout instead.")
+        return MosaicCompositor(num_cameras, tile_size, LAYOUT_AUTO)
+
+
+def create_uplink(vps_ip, video_port, stop_event, video_socket, channels=1, spools=None, transport=TRANSPORT_TCP, datagram_options=None, **sender_options):
+    """Builds UplinkChannels of `channels` FrameSenders. The first one starts on
+    video_socket (if given), and each gets its own spool from spools (if given).
+
+    With transport = udp they are DatagramSenders, built with datagram_options (mtu,
+    fec_group, simulated_loss); video_socket and spools do not apply."""
+    if transport == TRANSPORT_UDP:
+        return UplinkChannels([
+            DatagramSender(vps_ip, video_port, stop_event, channel=index,
+                           **(datagram_options or {}), **sender_options)
+            for index in range(max(channels, 1))])
+    return UplinkChannels([
+        FrameSender(vps_ip, video_port, stop_event, sock=video_socket if index == 0 else None,
+                    spool=spools[index] if spools else None, channel=index, **sender_options)
+        for index in range(max(channels, 1))])
+
+
+def stream_merged_frames(queues, video_socket, vps_ip, video_port, stop_event, num_cameras, resize_frame=(0, 0), max_reconnect_attempts=0, reconnect_delay=5, stream_mode=STREAM_MODE_SPLIT, jpeg_quality=DEFAULT_JPEG_QUALITY, mosaic_layout=LAYOUT_HORIZONTAL, rate_controller=None, encode_workers=DEFAULT_ENCODE_WORKERS, change_detector=None, tile_encoder=None, frames_ready=None, target_fps=0.0, batch_window=DEFAULT_BATCH_WINDOW, spools=None, replay_rate=0, uplink_channels=1, transport=TRANSPORT_TCP, datagram_options=None, simulcast=None):
+    """Streams camera frames over TCP (or UDP) using the framed protocol in Core.protocol.
+
+       In 'split' mode every camera's newest frame is encoded and sent on its own, tagged
+       with its camera id, so the VPS can serve it without decoding. In 'mosaic' mode the
+       frames are drawn into one preallocated grid (keeping the last good frame of a camera
+       whose queue is empty) and sent as a single JPEG, preceded by a layout message.
+
+       queues is either a list of frame slots (camera ids 0..num_cameras-1) or a
+       Core.camera_set.CameraSet whose cameras may change while streaming. On every
+       change the mosaic grid is rebuilt and the receiver is sent the new camera set
+       (PAYLOAD_CAMERAS) and layout.
+
+       The work is pipelined: this thread composes, a pool of encode_workers threads
+       encodes, and a FrameSender thread owns the socket, keeps only the latest encoded
+       frame per stream and reconnects without stalling the other stages.
+
+       In split mode the cameras can be spread over uplink_channels connections
+       (Core.uplink.UplinkChannels), each with its own FrameSender and encoder pool
+       (encode_workers are divided among them), balanced by resolution x fps and
+       rebalanced whenever the camera set changes and every REBALANCE_INTERVAL. A camera
+       that moves restarts its tile deltas with a keyframe.
+
+       If a rate_controller (Core.rate_control.AdaptiveController) is given, JPEG quality,
+       output scale and frame rate follow it, and the senders feed it send times and the
+       frames they replaced unsent.
+
+       If a change_detector (Core.change_detect.ChangeDetector) is given, frames of cameras
+       whose image has not materially changed are neither encoded nor sent; those cameras
+       get a small keepalive message instead, plus a periodic refresh frame.
+
+       If a tile_encoder (Core.tiles.TileDeltaEncoder) is given, split-mode frames are
+       sent as periodic keyframes plus only the tiles that changed in between.
+
+       frames_ready is the event the slots set when they receive a frame (see
+       CaptureManager); the thread sleeps on it instead of polling the slots, and a
+       Core.pacing.FramePacer emits at most target_fps output frames per second
+       (0 = as fast as frames arrive). In mosaic mode, frames arriving within
+       batch_window seconds of each other go into the same mosaic.
+
+       If spools (one Core.spool.FrameSpool per uplink channel) are given, frames are
+       kept on disk while the uplink is down and replayed at replay_rate bytes per
+       second after reconnecting (see FrameSender); tile deltas are not used
+       meanwhile, so every spooled frame is a whole JPEG.
+
+       With transport = udp, frames go out as datagrams (Core.sender.DatagramSender,
+       configured by datagram_options) instead of over TCP connections.
+
+       If a simulcast scheduler (Core.simulcast.SimulcastScheduler) is given, split-mode
+       frames are also encoded at its smaller tiers, by the same encode task and from
+       the same decoded frame, and sent as PAYLOAD_TIER_JPEG at each tier's frame rate.
+       The tiers are listed in the camera set message.
     """
-    reconnect_attempts = 0
+    single_frame_height = resize_frame[1] if resize_frame[1] > 0 else WINDOW_HEIGHT
+    single_frame_width = resize_frame[0] if resize_frame[0] > 0 else WINDOW_WIDTH_PER_CAMERA
+    camera_set = queues if isinstance(queues, CameraSet) else CameraSet.from_slots(queues[:num_cameras])
+
+    if stream_mode == STREAM_MODE_MOSAIC:
+        uplink_channels = 1  # The mosaic is a single stream
+    channels = create_uplink(vps_ip, video_port, stop_event, video_socket, uplink_channels, spools,
+                             transport, datagram_options, max_reconnect_attempts=max_reconnect_attempts,
+                             reconnect_delay=reconnect_delay, rate_controller=rate_controller,
+                             replay_rate=replay_rate)
+    channels.start()
+    register_pipeline_metrics(rate_controller, change_detector, spools)
+    pacer = FramePacer(stop_event, frames_ready, target_fps,
+                       batch_window if stream_mode == STREAM_MODE_MOSAIC else 0.0)
 
     # Create a named window with a fixed size for local display
     if SHOW_FRAME:
         cv2.namedWindow(WINDOW_NAME, cv2.WINDOW_NORMAL)
-        window_width = WINDOW_WIDTH_PER_CAMERA * num_cameras
-        cv2.resizeWindow(WINDOW_NAME, window_width, WINDOW_HEIGHT)
 
-    single_frame_height = resize_frame[1] if resize_frame[1] > 0 else WINDOW_HEIGHT
-    single_frame_width = resize_frame[0] if resize_frame[0] > 0 else WINDOW_WIDTH_PER_CAMERA
+    encoders = [ThreadPoolExecutor(max_workers=max(encode_workers // len(channels), 1),
+                                   thread_name_prefix=f'Encoder-{index}')
+                for index in range(len(channels))]
+    # Streams with an encode in flight. A camera's next frame is only taken once its
+    # previous one is encoded, which keeps frames in order and their buffers valid.
+    encoding = set()
+    encoding_lock = Lock()
 
-    # Initialize list to store last good frames for each camera
-    last_good_frames = [None] * num_cameras
+    def submit_encode(key, encode, *args):
+        with encoding_lock:
+            encoding.add(key)
+        index = channels.channel(key)
+        future = encoders[index].submit(encode, channels.senders[index], *args)
 
-    while not stop_event.is_set():
-        if video_socket is None:
-            logging.error("Video socket is None, attempting to reconnect...")
-            video_socket = create_socket(vps_ip, video_port)
-            if video_socket is None:
-                reconnect_attempts += 1
-                if reconnect_attempts > max_reconnect_attempts:
-                    logging.error(
-                        "Max socket reconnect attempts reached. Exiting streaming.")
-                    break
-                time.sleep(reconnect_delay)
-                continue
-            reconnect_attempts = 0
+        def done(_):
+            with encoding_lock:
+                encoding.discard(key)
+            pacer.notify()  # Frames that arrived while the stream was busy can go now
+        future.add_done_callback(done)
 
-        try:
-            start_time = time.time()
+    cameras = []          # (camera_id, ip, slot) of the current camera set
+    cameras_version = None
+    compositor = None
+    # Per-camera message sequence numbers, plus one for the mosaic stream
+    camera_seqs = {}
+    mosaic_seq = 0
+    connections_seen = [0] * len(channels)
 
-            frames_to_merge = []
-            all_queues_empty = True  # Flag to check if all queues are empty in this iteration
+    try:
+        while not stop_event.is_set():
+            try:
+                frame_interval = rate_controller.frame_interval if rate_controller is not None else 0.0
+                ready = pacer.wait(frame_interval)
+                start_time = time.time()
 
-            for i, queue in enumerate(queues):
-                try:
-                    frame = queue.get_nowait()  # Try to get the newest frame without waiting
-                    # Update last good frame for this camera
-                    last_good_frames[i] = frame
-                    frames_to_merge.append(frame)
-                    all_queues_empty = False  # At least one queue had a frame
-                except Empty:
-                    if last_good_frames[i] is not None:
-                        logging.debug(
-                            f"Queue {i} is empty, using last good frame.")
-                        # Use last good frame
-                        frames_to_merge.append(last_good_frames[i])
+                moved = {}
+                if camera_set.version != cameras_version:
+                    cameras_version, current = camera_set.snapshot()
+                    current_ids = {camera_id for camera_id, _, _ in current}
+                    for camera_id, _, _ in cameras:
+                        if camera_id not in current_ids:
+                            camera_seqs.pop(camera_id, None)
+                            unregister_camera_metrics(camera_id)
+                            if change_detector is not None:
+                                change_detector.forget(camera_id)
+                            if tile_encoder is not None:
+                                tile_encoder.forget(camera_id)
+                            if simulcast is not None:
+                                simulcast.forget(camera_id)
+                    for camera_id, _, slot in current:
+                        camera_seqs.setdefault(camera_id, 0)
+                        register_camera_metrics(camera_id, slot)
+                    cameras = current
+                    logging.info(f"Streaming cameras: {[(camera_id, ip) for camera_id, ip, _ in cameras]}")
+                    moved = channels.rebalance(channels.measure(cameras, single_frame_width * single_frame_height))
+
+                    # Tell the receiver which cameras (and simulcast tiers) exist, now and on every reconnect
+                    camera_info = {'cameras': [{'id': camera_id, 'ip': ip} for camera_id, ip, _ in cameras]}
+                    if simulcast is not None and stream_mode == STREAM_MODE_SPLIT:
+                        camera_info['tiers'] = simulcast.describe(single_frame_width, single_frame_height, target_fps)
+                    channels.set_sticky('cameras', PAYLOAD_CAMERAS, MOSAIC_CAMERA_ID,
+                                        json.dumps(camera_info).encode('utf-8'))
+                    if stream_mode == STREAM_MODE_MOSAIC or SHOW_FRAME:
+                        # A new canvas; an encode still in flight keeps the old one alive
+                        compositor = create_compositor(
+                            len(cameras), (single_frame_width, single_frame_height), mosaic_layout)
+                        if SHOW_FRAME:
+                            window_scale = WINDOW_WIDTH_PER_CAMERA / single_frame_width
+                            cv2.resizeWindow(WINDOW_NAME, int(compositor.canvas.shape[1] * window_scale),
+                                             int(compositor.canvas.shape[0] * window_scale))
+                    if stream_mode == STREAM_MODE_MOSAIC:
+                        # Tell the receiver how to cut the mosaic back into cameras
+                        layout = compositor.layout_info()
+                        layout['camera_ids'] = [camera_id for camera_id, _, _ in cameras]
+                        channels.set_sticky('layout', PAYLOAD_LAYOUT, MOSAIC_CAMERA_ID,
+                                            json.dumps(layout).encode('utf-8'))
+                elif channels.rebalance_due():
+                    # Frame rates are only known once the cameras have been measured
+                    moved = channels.rebalance(channels.measure(cameras, single_frame_width * single_frame_height),
+                                               REBALANCE_TOLERANCE)
+                if tile_encoder is not None:
+                    for camera_id in moved:
+                        # Its last delta may still be queued on the old channel
+                        tile_encoder.request_keyframe(camera_id)
+
+                if not ready:
+                    continue  # No frames; cameras may be down
+
+                with encoding_lock:
+                    busy = set(encoding)
+                if MOSAIC_CAMERA_ID in busy:
+                    # The canvas is still being encoded; don't draw over it yet. The
+                    # encode's done callback wakes the pacer again.
+                    continue
+
+                new_frames = {}
+                captures = {}  # camera id -> CaptureTime of its new frame
+                all_queues_empty = True  # Flag to check if all queues are empty in this iteration
+
+                for camera_id, _, queue in cameras:
+                    if camera_id in busy:
+                        continue
+                    try:
+                        frame = queue.get_nowait()  # Try to get the newest frame without waiting
+                        new_frames[camera_id] = frame
+                        captures[camera_id] = queue.captured
+                        all_queues_empty = False  # At least one queue had a frame
+                    except Empty:
+                        logging.debug(f"Queue {camera_id} is empty.")
+
+                if all_queues_empty:  # If all queues were empty, no new frames received in this iteration
+                    continue  # Wait for the next frame-ready notification
+                pacer.emitted(frame_interval)
+
+                quality = jpeg_quality
+                scale = 1.0
+                if rate_controller is not None:
+                    # Frames overwritten in the capture slots are not counted: a camera
+                    # faster than the target fps overwrites frames on any link. Only
+                    # frames the sender replaced unsent (see FrameSender.submit) are.
+                    quality = rate_controller.quality
+                    scale = rate_controller.scale
+
+                connections = channels.connections
+                if connections != connections_seen:
+                    # The receiver may have lost its state; send the reconnected channels' cameras in full
+                    reconnected = {index for index, count in enumerate(connections) if count != connections_seen[index]}
+                    connections_seen = connections
+                    for camera_id, _, _ in cameras:
+                        if channels.channel(camera_id) in reconnected:
+                            if change_detector is not None:
+                                change_detector.forget(camera_id)
+                            if tile_encoder is not None:
+                                tile_encoder.request_keyframe(camera_id)
+
+                if change_detector is not None:
+                    now = time.monotonic()
+                    if stream_mode == STREAM_MODE_MOSAIC:
+                        # The mosaic is only sent when one of its cameras changed
+                        changed = [change_detector.should_send(camera_id, frame, now)
+                                   for camera_id, frame in new_frames.items()]
+                        mosaic_changed = any(changed)
                     else:
-                        logging.debug(
-                            f"Queue {i} is empty, no last good frame available, using blank frame.")
-                        blank_frame = np.zeros(
-                            (single_frame_height, single_frame_width, 3), dtype=np.uint8)
-                        # Use blank frame if no last good frame yet
-                        frames_to_merge.append(blank_frame)
-
-            if all_queues_empty:  # If all queues were empty, no new frames received in this iteration
-                # Wait a bit before retrying to reduce CPU usage if all streams are down
-                time.sleep(0.001)
-                continue  # Skip to the next iteration
-
-            combined_frame = np.hstack(frames_to_merge)
-
-            # Display the combined frame locally if SHOW_FRAME is True
-            if SHOW_FRAME:
-                cv2.imshow(WINDOW_NAME, combined_frame)
-                if cv2.waitKey(1) & 0xFF == ord('q'):
-                    cv2.destroyAllWindows()
-                    stop_event.set()
-                    break
+                        for camera_id, frame in list(new_frames.items()):
+                            if not change_detector.should_send(camera_id, frame, now):
+                                del new_frames[camera_id]
+                    for camera_id, _, _ in cameras:
+                        if camera_id not in new_frames and change_detector.keepalive_due(camera_id, now):
+                            channels.sender(camera_id).submit(
+                                PAYLOAD_KEEPALIVE, camera_id, max(camera_seqs[camera_id] - 1, 0), b'',
+                                key=(PAYLOAD_KEEPALIVE, camera_id))
+                            KEEPALIVES.labels(camera_id).inc()
+
+                combined_frame = None
+                if compositor is not None:
+                    # Only tiles with a new frame are redrawn; the rest keep their last good frame
+                    for index, (camera_id, _, _) in enumerate(cameras):
+                        compositor.update(index, new_frames.get(camera_id))
+                    combined_frame = compositor.canvas
+
+                # Display the combined frame locally if SHOW_FRAME is True
+                if SHOW_FRAME:
+                    cv2.imshow(WINDOW_NAME, combined_frame)
+                    if cv2.waitKey(1) & 0xFF == ord('q'):
+                        cv2.destroyAllWindows()
+                        stop_event.set()
+                        break
+
+                if stream_mode == STREAM_MODE_MOSAIC:
+                    if change_detector is None or mosaic_changed:
+                        # The mosaic is as old as the oldest camera frame drawn into it
+                        captured = min((captures[camera_id] for camera_id in new_frames if captures[camera_id]),
+                                       key=lambda capture: capture.monotonic, default=None)
+                        submit_encode(MOSAIC_CAMERA_ID, encode_frame, PAYLOAD_MOSAIC_JPEG, MOSAIC_CAMERA_ID,
+                                      mosaic_seq, combined_frame, quality, scale, None, captured)
+                        mosaic_seq += 1
+                else:
+                    for camera_id, frame in new_frames.items():
+                        tiers = simulcast.due(camera_id) if simulcast is not None else None
+                        if tiers:
+                            submit_encode(camera_id, encode_simulcast, camera_id,
+                                          camera_seqs[camera_id], frame, quality, scale, tile_encoder,
+                                          captures[camera_id], tiers)
+                        else:
+                            submit_encode(camera_id, encode_frame, PAYLOAD_JPEG, camera_id,
+                                          camera_seqs[camera_id], frame, quality, scale, tile_encoder,
+                                          captures[camera_id])
+                        camera_seqs[camera_id] += 1
+
+                end_time = time.time()
+                processing_time = end_time - start_time
+                COMPOSE_SECONDS.observe(processing_time)
+
+            except Exception as e:
+                logging.error(f"Unexpected error in stream_merged_frames: {e}")
+    finally:
+        for encoder in encoders:
+            encoder.shutdown(wait=True)
+        channels.stop()
+        for spool in spools or []:
+            spool.close()
+        logging.info("Streaming thread stopped.")
 
-            _, jpeg = cv2.imencode('.jpg', combined_frame, [int(
-                cv2.IMWRITE_JPEG_QUALITY), 70])
-            if not _:
-                logging.error("Failed to encode frame to JPEG.")
-                continue
-            frame_bytes = jpeg.tobytes()
 
-            length_bytes = len(frame_bytes).to_bytes(4, byteorder='big')
+def stream_weights(cameras):
+    """Uplink weights (pixels per second) of passthrough cameras, from their stream info.
+    A camera whose stream is not open yet gets the mean weight of the others."""
+    weights = {}
+    for camera_id, _, packet_queue in cameras:
+        _, info = packet_queue.stream_info()
+        if info and info.get('width') and info.get('height') and info.get('fps'):
+            weights[camera_id] = info['width'] * info['height'] * info['fps']
+    default = sum(weights.values()) / len(weights) if weights else 1.0
+    return {camera_id: weights.get(camera_id, default) for camera_id, _, _ in cameras}
+
+
+def stream_passthrough(camera_set, video_socket, vps_ip, video_port, stop_event, packets_ready, max_reconnect_attempts=0, reconnect_delay=5, uplink_channels=1, transport=TRANSPORT_TCP, datagram_options=None):
+    """Streams the cameras' encoded packets (stream_mode = passthrough) unchanged.
+
+       Nothing is decoded or encoded on the edge. Every camera's codec parameters are
+       sent as a sticky PAYLOAD_VIDEO_CONFIG message, followed by its packets as
+       PAYLOAD_VIDEO_PACKET messages flagged with codec and keyframe (see
+       Core.protocol.video_flags). The receiver decodes them or hands them on as they are.
+
+       camera_set is a Core.camera_set.CameraSet whose slots are PacketQueues sharing
+       the packets_ready event, which wakes this thread when packets arrive.
+
+       The cameras are spread over uplink_channels connections (Core.uplink), weighted
+       by the resolution and frame rate of their streams and rebalanced as in
+       stream_merged_frames. A camera that moves to
+       another channel restarts there at its next keyframe. transport and
+       datagram_options are as in stream_merged_frames.
+    """
+    channels = create_uplink(vps_ip, video_port, stop_event, video_socket, uplink_channels,
+                             transport=transport, datagram_options=datagram_options,
+                             max_reconnect_attempts=max_reconnect_attempts,
+                             reconnect_delay=reconnect_delay)
+    channels.start()
+
+    cameras = []
+    cameras_version = None
+    camera_seqs = {}
+    config_versions = {}  # camera id -> stream info version last sent
+
+    try:
+        while not stop_event.is_set():
             try:
-                video_socket.sendall(length_bytes)
-                video_socket.sendall(frame_bytes)
-            except (BrokenPipeError, ConnectionResetError, socket.error) as e:
-                logging.error(f"Connection lost while sending data: {e}")
-                if video_socket:
-                    try:
-                        video_socket.shutdown(socket.SHUT_RDWR)
-                    except OSError as e:
-                        logging.error(f"Error during socket shutdown: {e}")
-                    finally:
-                        video_socket.close()
-                video_socket = None
-                time.sleep(reconnect_delay)
+                packets_ready.wait(timeout=0.5)
+                packets_ready.clear()
+
+                moved = {}
+                if camera_set.version != cameras_version:
+                    cameras_version, current = camera_set.snapshot()
+                    current_ids = {camera_id for camera_id, _, _ in current}
+                    for camera_id, _, _ in cameras:
+                        if camera_id not in current_ids:
+                            camera_seqs.pop(camera_id, None)
+                            config_versions.pop(camera_id, None)
+                            unregister_camera_metrics(camera_id)
+                            sender = channels.sender(camera_id)
+                            sender.forget_stream(camera_id)
+                            sender.remove_sticky(f'video-{camera_id}')
+                    for camera_id, _, packet_queue in current:
+                        camera_seqs.setdefault(camera_id, 0)
+                        register_camera_metrics(camera_id, packet_queue)
+                    cameras = current
+                    logging.info(f"Relaying cameras: {[(camera_id, ip) for camera_id, ip, _ in cameras]}")
+                    moved = channels.rebalance(stream_weights(cameras))
+                    channels.set_sticky('cameras', PAYLOAD_CAMERAS, MOSAIC_CAMERA_ID, json.dumps(
+                        {'cameras': [{'id': camera_id, 'ip': ip} for camera_id, ip, _ in cameras]}).encode('utf-8'))
+                elif channels.rebalance_due():
+                    # Cameras whose stream was not open yet at the last rebalance have a weight now
+                    moved = channels.rebalance(stream_weights(cameras), REBALANCE_TOLERANCE)
+                for camera_id, previous in moved.items():
+                    old_sender = channels.senders[previous]
+                    old_sender.forget_stream(camera_id)
+                    old_sender.remove_sticky(f'video-{camera_id}')
+                    channels.sender(camera_id).forget_stream(camera_id, await_keyframe=True)
+                    config_versions.pop(camera_id, None)  # Re-sent on the new channel
+
+                for camera_id, _, packet_queue in cameras:
+                    sender = channels.sender(camera_id)
+                    version, info = packet_queue.stream_info()
+                    if info is not None and config_versions.get(camera_id) != version:
+                        # A (re)opened camera stream: its codec setup goes ahead of its packets
+                        config_versions[camera_id] = version
+                        sender.set_sticky(f'video-{camera_id}', PAYLOAD_VIDEO_CONFIG, camera_id,
+                                          json.dumps(info).encode('utf-8'))
+                    for packet, flags, captured in packet_queue.get_all():
+                        _, keyframe = parse_video_flags(flags)
+                        sender.submit_packet(PAYLOAD_VIDEO_PACKET, camera_id, camera_seqs[camera_id],
+                                             packet, flags, keyframe, captured)
+                        camera_seqs[camera_id] += 1
+
+            except Exception as e:
+                logging.error(f"Unexpected error in stream_passthrough: {e}")
+    finally:
+        channels.stop()
+        logging.info("Passthrough streaming thread stopped.")
+
+
+def capture_camera_process(ip_address, cam_user, cam_password, resize_frame, ring_name, frame_shape, ring_slots, stop_event, decode_on_demand=True, negotiate=None, frames_ready=None):
+    """Entry point of a per-camera capture process (capture_mode = process).
+       Attaches to the camera's shared-memory ring and runs capture_camera into it,
+       setting frames_ready (a multiprocessing.Event) for every frame it publishes.
+    """
+    ring = FrameRing(frame_shape, slots=ring_slots, name=ring_name, create=False,
+                     ready_event=frames_ready)
+    try:
+        capture_camera(ip_address, cam_user, cam_password,
+                       resize_frame, ring, stop_event, decode_on_demand, negotiate=negotiate)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        ring.close()
+
+
+def start_capture_process(ip_address, cam_user, cam_password, resize_frame, ring, stop_event, decode_on_demand=True, negotiate=None, frames_ready=None):
+    """Starts a capture process writing into the given ring and returns it."""
+    process = multiprocessing.Process(
+        target=capture_camera_process,
+        args=(ip_address, cam_user, cam_password, resize_frame,
+              ring.name, ring.frame_shape, ring.slots, stop_event, decode_on_demand, negotiate,
+              frames_ready),
+        name=f"Capture-{ip_address}")
+    process.daemon = True  # Capture processes must not outlive the streaming process
+    process.start()
+    return process
+
+
+class CaptureManager:
+    """Runs one capture worker (thread or process) per camera and keeps the CameraSet in sync.
+
+    Cameras can be added and removed while streaming. A camera keeps the same id for
+    the lifetime of the streaming process, also if it disappears and comes back, so
+    the receiver's stream URLs stay valid. Dead capture processes are restarted with
+    exponential backoff per camera.
+
+    With negotiate_substream enabled, each worker first configures its camera's
+    substream to resize_frame (see Core/substream.py). Profiles from
+    settings['stream_profiles'] (ip -> profile, e.g. from the discovery cache) skip
+    the capabilities query; negotiated profiles are put on profile_updates.
+
+    Every camera's slot sets frames_ready when it receives a frame (packets_ready in
+    passthrough mode), which is what wakes the streaming thread.
+    """
+
+    def __init__(self, cam_user, cam_password, resize_frame, settings, camera_set, profile_updates=None):
+        self.cam_user = cam_user
+        self.cam_password = cam_password
+        self.resize_frame = resize_frame
+        self.camera_set = camera_set
+        self.decode_on_demand = settings.get('decode_on_demand', True)
+        self.ring_slots = settings.get('ring_slots', DEFAULT_RING_SLOTS)
+        self.capture_mode = settings.get('capture_mode', CAPTURE_MODE_THREAD)
+        self.passthrough = settings.get('stream_mode') == STREAM_MODE_PASSTHROUGH
+        self.packets_ready = Event()  # Set by every camera's PacketQueue in passthrough mode
+        if self.passthrough and self.capture_mode == CAPTURE_MODE_PROCESS:
+            logging.info("stream_mode = passthrough does not decode frames; relaying from capture threads.")
+            self.capture_mode = CAPTURE_MODE_THREAD
+        if self.capture_mode == CAPTURE_MODE_PROCESS and not (resize_frame[0] > 0 and resize_frame[1] > 0):
+            logging.warning(
+                "capture_mode = process needs a fixed resize_frame for its shared-memory rings. "
+                "Falling back to capture threads.")
+            self.capture_mode = CAPTURE_MODE_THREAD
+        # Set by every camera's frame slot; capture processes need a cross-process event
+        self.frames_ready = multiprocessing.Event() if self.capture_mode == CAPTURE_MODE_PROCESS else Event()
+        self.negotiate_substream = settings.get('negotiate_substream', False) and \
+            resize_frame[0] > 0 and resize_frame[1] > 0
+        self.substream_fps = settings.get('substream_fps') or None
+        self.substream_codec = settings.get('substream_codec', DEFAULT_SUBSTREAM_CODEC) or None
+        self.stream_profiles = dict(settings.get('stream_profiles') or {})
+        self.profile_updates = profile_updates
+
+        self._ids = {}      # ip -> camera id, kept after removal
+        self._next_id = 0
+        self._workers = {}  # ip -> dict(camera_id, slot, worker, stop_event, restart_at, backoff)
+        self._retired = []  # Workers of removed cameras that have not exited yet
+
+    @property
+    def ip_addresses(self):
+        return list(self._workers)
+
+    def _start_worker(self, ip_address, slot, stop_event):
+        negotiate = None
+        if self.negotiate_substream:
+            negotiate = partial(negotiate_substream, ip_address, self.cam_user, self.cam_password,
+                                self.resize_frame, self.substream_fps, self.substream_codec,
+                                cached_profile=self.stream_profiles.get(ip_address),
+                                profile_updates=self.profile_updates)
+        if self.capture_mode == CAPTURE_MODE_PROCESS:
+            return start_capture_process(ip_address, self.cam_user, self.cam_password,
+                                         self.resize_frame, slot, stop_event, self.decode_on_demand,
+                                         negotiate, self.frames_ready)
+        if self.passthrough:
+            thread = Thread(target=relay_camera,
+                            args=(ip_address, self.cam_user, self.cam_password, slot, stop_event),
+                            kwargs={'negotiate': negotiate},
+                            name=f"Relay-{ip_address}", daemon=True)
+            thread.start()
+            return thread
+        thread = Thread(target=capture_camera,
+                        args=(ip_address, self.cam_user, self.cam_password, self.resize_frame,
+                              slot, stop_event, self.decode_on_demand),
+                        kwargs={'negotiate': negotiate},
+                        name=f"Capture-{ip_address}")
+        thread.daemon = True  # Allow main process to exit even if threads are running
+        thread.start()
+        return thread
+
+    def add(self, ip_address):
+        if ip_address in self._workers:
+            return
+        camera_id = self._ids.get(ip_address)
+        if camera_id is None:
+            camera_id = self._next_id
+            self._next_id += 1
+            self._ids[ip_address] = camera_id
+
+        if self.passthrough:
+            slot = PacketQueue(self.packets_ready)
+            stop_event = Event()
+        elif self.capture_mode == CAPTURE_MODE_PROCESS:
+            # Each capture process writes into its own shared-memory ring
+            slot = FrameRing((self.resize_frame[1], self.resize_frame[0], 3), slots=self.ring_slots)
+            stop_event = multiprocessing.Event()
+        else:
+            slot = LatestFrameSlot(ready_event=self.frames_ready)
+            stop_event = Event()
+        worker = self._start_worker(ip_address, slot, stop_event)
+        self._workers[ip_address] = {'camera_id': camera_id, 'slot': slot, 'worker': worker,
+                                     'stop_event': stop_event, 'restart_at': None,
+                                     'backoff': INITIAL_RESTART_BACKOFF}
+        self.camera_set.add(camera_id, ip_address, slot)
+        logging.info(f"Added camera {ip_address} as camera {camera_id}.")
+
+    def remove(self, ip_address):
+        entry = self._workers.pop(ip_address, None)
+        if entry is None:
+            return
+        # Stop the merger from reading the slot before the worker goes away
+        self.camera_set.remove(entry['camera_id'])
+        entry['stop_event'].set()
+        entry['retired_at'] = time.time()
+        self._retired.append(entry)
+        logging.info(f"Removed camera {ip_address} (camera {entry['camera_id']}).")
+
+    def update(self, ip_addresses):
+        """Adds cameras that are new in ip_addresses and removes the ones no longer in it."""
+        for ip_address in self.ip_addresses:
+            if ip_address not in ip_addresses:
+                self.remove(ip_address)
+        for ip_address in ip_addresses:
+            self.add(ip_address)
+
+    def supervise(self):
+        """Restarts dead capture processes and cleans up after removed cameras."""
+        now = time.time()
+        if self.capture_mode == CAPTURE_MODE_PROCESS:
+            for ip_address, entry in self._workers.items():
+                if entry['worker'].is_alive():
+                    continue
+                if entry['restart_at'] is None:
+                    logging.error(
+                        f"Capture process for {ip_address} exited with code {entry['worker'].exitcode}. "
+                        f"Restarting in {entry['backoff']:.0f}s.")
+                    entry['restart_at'] = now + entry['backoff']
+                elif now >= entry['restart_at']:
+                    logging.info(f"Restarting capture process for {ip_address}...")
+                    entry['worker'] = self._start_worker(ip_address, entry['slot'], entry['stop_event'])
+                    entry['restart_at'] = None
+                    entry['backoff'] = min(entry['backoff'] * 2, MAX_RESTART_BACKOFF)
+
+        for entry in list(self._retired):
+            worker = entry['worker']
+            if worker.is_alive():
+                if isinstance(worker, multiprocessing.Process) and now - entry['retired_at'] > 5.0:
+                    worker.terminate()
                 continue
+            # The worker is gone and the merger stopped reading a pass ago
+            if isinstance(entry['slot'], FrameRing):
+                entry['slot'].close()
+            self._retired.remove(entry)
 
-            end_time = time.time()
-            processing_time = end_time - start_time
+    def stop(self):
+        """Stops every capture worker and releases the shared-memory rings."""
+        entries = list(self._workers.values()) + self._retired
+        for entry in entries:
+            entry['stop_event'].set()
+        for entry in entries:
+            worker = entry['worker']
+            worker.join(timeout=2.0)  # Wait for capture workers to finish
+            if isinstance(worker, multiprocessing.Process) and worker.is_alive():
+                logging.warning(
+                    f"{worker.name} did not stop in time, terminating it.")
+                worker.terminate()
+                worker.join(timeout=1.0)
+        for entry in entries:
+            if isinstance(entry['slot'], FrameRing):
+                entry['slot'].close()
+        self._workers.clear()
+        self._retired = []
 
-        except socket.timeout:
-            logging.error(
-                "Socket timeout occurred, attempting to reconnect...")
-            if video_socket:
-                try:
-                    video_socket.shutdown(socket.SHUT_RDWR)
-                except OSError as e:
-                    logging.error(f"Error during socket shutdown: {e}")
-                finally:
-                    video_socket.close()
-            video_socket = None
-            time.sleep(reconnect_delay)
-
-        except socket.error as e:
-            logging.error(f"Streaming error: {e}")
-            if video_socket:
-                try:
-                    video_socket.shutdown(socket.SHUT_RDWR)
-                except OSError as e:
-                    logging.error(f"Error during socket shutdown: {e}")
-                finally:
-                    video_socket.close()
-            video_socket = None
-            time.sleep(reconnect_delay)
-
-        except Exception as e:
-            logging.error(f"Unexpected error in stream_merged_frames: {e}")
-
-    if video_socket:
-        try:
-            video_socket.shutdown(socket.SHUT_RDWR)
-        except OSError as e:
-            logging.error(f"Error during socket shutdown: {e}")
-        finally:
-            video_socket.close()
-    logging.info("Streaming thread stopped.")
-
-
-def stream_multiple_cameras(ip_addresses, video_port, control_port, vps_ip, cam_user, cam_password, resize_frame=(0, 0)):
-    """Starts capture threads for multiple cameras and a stream thread for merged frames."""
+
+def create_rate_controller(settings):
+    """Builds an AdaptiveController from the [Adaptive] settings, or None if it is disabled."""
+    if not settings.get('adaptive_enabled', False):
+        return None
+    return AdaptiveController(
+        min_quality=settings.get('adaptive_min_quality', 30),
+        max_quality=settings.get('jpeg_quality', DEFAULT_JPEG_QUALITY),
+        min_scale=settings.get('adaptive_min_scale', 0.5),
+        min_fps=settings.get('adaptive_min_fps', 2.0),
+        max_fps=settings.get('adaptive_max_fps', 25.0),
+        adjust_interval=settings.get('adaptive_interval', 1.0))
+
+
+def create_change_detector(settings):
+    """Builds a ChangeDetector from the [Motion] settings, or None if gating is disabled."""
+    if not settings.get('motion_enabled', False):
+        return None
+    return ChangeDetector(
+        change_ratio=settings.get('motion_change_ratio', 0.01),
+        pixel_threshold=settings.get('motion_pixel_threshold', 25),
+        refresh_interval=settings.get('motion_refresh_interval', 30.0),
+        keepalive_interval=settings.get('motion_keepalive_interval', 2.0))
+
+
+def create_tile_encoder(settings):
+    """Builds a TileDeltaEncoder from the [Tiles] settings, or None if delta updates are disabled."""
+    if not settings.get('tiles_enabled', False):
+        return None
+    return TileDeltaEncoder(
+        grid=parse_tile_grid(settings.get('tiles_grid', '8x6')),
+        keyframe_interval=settings.get('tiles_keyframe_interval', 10.0),
+        pixel_threshold=settings.get('tiles_pixel_threshold', 25),
+        change_ratio=settings.get('tiles_change_ratio', 0.005))
+
+
+def create_simulcast(settings):
+    """Builds a SimulcastScheduler from the [Simulcast] settings, or None if simulcast is disabled."""
+    if not settings.get('simulcast_enabled', False):
+        return None
+    tiers = parse_tiers(settings.get('simulcast_tiers', ''), settings.get('jpeg_quality', DEFAULT_JPEG_QUALITY))
+    if not tiers:
+        logging.warning("[Simulcast] is enabled but has no tiers.")
+        return None
+    return SimulcastScheduler(tiers)
+
+
+def create_spools(settings, channels=1):
+    """Builds one FrameSpool per uplink channel from the [Spool] settings, or None if
+    spooling is disabled. The channels share the configured disk space."""
+    if not settings.get('spool_enabled', False):
+        return None
+    directory = settings.get('spool_directory', 'spool')
+    max_bytes = int(settings.get('spool_max_mb', 1024) * 1024 * 1024) // channels
+    return [FrameSpool(directory if channels == 1 else os.path.join(directory, f'channel-{index}'),
+                       max_bytes=max_bytes, max_fps=settings.get('spool_fps', 5.0))
+            for index in range(channels)]
+
+
+def stream_multiple_cameras(ip_addresses, video_port, control_port, vps_ip, cam_user, cam_password, resize_frame=(0, 0), settings=None, camera_updates=None, profile_updates=None, shutdown_event=None):
+    """Starts capture threads (or processes) for multiple cameras and a stream thread for merged frames.
+
+    Args:
+        settings: Optional dict of extra streaming options (as returned by
+                  load_configuration), e.g. 'stream_mode', 'jpeg_quality' and 'capture_mode'.
+        camera_updates: Optional queue (e.g. multiprocessing.Queue) of camera IP lists.
+                        Each list received replaces the camera set while streaming:
+                        new cameras get a capture worker, missing ones are retired.
+        profile_updates: Optional queue that receives (ip, profile) for every camera
+                         whose substream was negotiated (see CaptureManager).
+        shutdown_event: Optional multiprocessing.Event another process sets to stop
+                        streaming; capture workers are then stopped and their
+                        shared-memory rings released before this function returns.
+    """
+    settings = settings or {}
     logging.info(
         f"Starting video stream from multiple cameras: {ip_addresses}...")
 
@@ -254,49 +985,80 @@ def stream_multiple_cameras(ip_addresses, video_port, control_port, vps_ip, cam_
         logging.error("No cameras provided to stream.")
         return
 
-    # Create socket for video streaming
-    video_socket = create_socket(vps_ip, video_port)
-    if video_socket is None:
-        logging.error("Failed to establish video socket connection. Aborting.")
-        return
-
-    # Queues for frames from each camera
-    frame_queues = [Queue(maxsize=3) for _ in ip_addresses]
     stop_event = Event()  # Event to signal threads to stop
+    camera_set = CameraSet()
+    captures = CaptureManager(cam_user, cam_password, resize_frame, settings, camera_set, profile_updates)
+    captures.update(ip_addresses)
 
-    capture_threads = []
-    for ip_address, queue in zip(ip_addresses, frame_queues):
-        thread = Thread(target=capture_camera,
-                        args=(ip_address, cam_user, cam_password, resize_frame, queue, stop_event))
-        thread.daemon = True  # Allow main process to exit even if threads are running
-        thread.start()
-        capture_threads.append(thread)
-
-    stream_thread = Thread(target=stream_merged_frames,
-                           args=(frame_queues, video_socket, vps_ip, video_port, stop_event, len(ip_addresses)))
+    stream_mode = settings.get('stream_mode', STREAM_MODE_SPLIT)
+    uplink_channels = settings.get('uplink_channels', 1) if stream_mode != STREAM_MODE_MOSAIC else 1
+    transport = settings.get('transport', TRANSPORT_TCP)
+    datagram_options = {'mtu': settings.get('udp_mtu', DEFAULT_MTU),
+                        'fec_group': settings.get('udp_fec_group', DEFAULT_FEC_GROUP)}
+    if stream_mode == STREAM_MODE_PASSTHROUGH:
+        stream_thread = Thread(target=stream_passthrough,
+                               args=(camera_set, None, vps_ip, video_port, stop_event, captures.packets_ready),
+                               kwargs={'uplink_channels': uplink_channels,
+                                       'transport': transport,
+                                       'datagram_options': datagram_options})
+    else:
+        stream_thread = Thread(target=stream_merged_frames,
+                               args=(camera_set, None, vps_ip, video_port, stop_event, len(ip_addresses)),
+                               kwargs={'resize_frame': resize_frame,
+                                       'stream_mode': stream_mode,
+                                       'jpeg_quality': settings.get('jpeg_quality', DEFAULT_JPEG_QUALITY),
+                                       'mosaic_layout': settings.get('mosaic_layout', LAYOUT_HORIZONTAL),
+                                       'rate_controller': create_rate_controller(settings),
+                                       'encode_workers': settings.get('encode_workers', DEFAULT_ENCODE_WORKERS),
+                                       'change_detector': create_change_detector(settings),
+                                       'tile_encoder': create_tile_encoder(settings),
+                                       'simulcast': create_simulcast(settings),
+                                       'frames_ready': captures.frames_ready,
+                                       'target_fps': settings.get('target_fps', DEFAULT_TARGET_FPS),
+                                       'batch_window': settings.get('batch_window_ms', DEFAULT_BATCH_WINDOW * 1000) / 1000.0,
+                                       'spools': create_spools(settings, uplink_channels),
+                                       'uplink_channels': uplink_channels,
+                                       'transport': transport,
+                                       'datagram_options': datagram_options,
+                                       'replay_rate': int(settings.get('spool_replay_kbps', 2000) * 1000 / 8)})
     stream_thread.daemon = True  # Allow main process to exit even if thread is running
     stream_thread.start()
 
+    if settings.get('metrics_enabled', False):
+        start_metrics_server(settings.get('metrics_port', 9108),
+                             settings.get('metrics_bind', '127.0.0.1'))
+    if control_port:
+        # Served from the streaming process so STATS sees this process's metrics and
+        # commands can address every camera in the live camera set
+        start_control_server(control_port, cam_user, cam_password, camera_set)
+
     try:
-        while True:
+        while not stop_event.is_set():
             # Keep main thread alive and responsive to keyboard interrupts
-            time.sleep(1)
+            if shutdown_event is not None:
+                if shutdown_event.wait(timeout=1):
+                    logging.info("Shutdown requested. Shutting down...")
+                    break
+            else:
+                time.sleep(1)
+            if camera_updates is not None:
+                latest = None
+                try:
+                    while True:  # Only the newest camera list matters
+                        latest = camera_updates.get_nowait()
+                except Empty:
+                    pass
+                if latest is not None:
+                    captures.update(latest)
+            captures.supervise()
     except KeyboardInterrupt:
         logging.info("Keyboard interrupt received. Shutting down...")
         stop_event.set()  # Signal all threads to stop
     finally:
         logging.info("Cleaning up threads and sockets...")
         stop_event.set()  # Ensure stop_event is set again in finally block
-        for thread in capture_threads:
-            thread.join(timeout=2.0)  # Wait for capture threads to finish
         stream_thread.join(timeout=2.0)  # Wait for stream thread to finish
-        if video_socket:
-            try:
-                # Properly shutdown socket
-                video_socket.shutdown(socket.SHUT_RDWR)
-            except OSError as e:
-                logging.error(f"Error during socket shutdown: {e}")
-            finally:
-                video_socket.close()  # Ensure socket is closed
+        ip_addresses = captures.ip_addresses
+        captures.stop()
 
         logging.info(f"Streaming ended for cameras {ip_addresses}.")
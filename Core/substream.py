@@ -0,0 +1,89 @@
+import logging
+from Core.isapi import IsapiClient
+
+logging.basicConfig(level=logging.INFO,
+                    format="%(asctime)s - %(levelname)s - %(message)s")
+
+SUBSTREAM_CHANNEL = 102  # The RTSP stream capture_camera opens
+DEFAULT_SUBSTREAM_CODEC = "H.264"
+
+
+def pick_stream_profile(capabilities, resize_frame, fps=None, codec=None):
+    """Chooses substream settings from a channel's capabilities (see IsapiClient.get_capabilities).
+
+    The resolution is resize_frame if the camera offers it. Otherwise it is the
+    smallest offered resolution that still covers resize_frame, so the CPU only
+    scales down a little, or the largest one if none covers it. The frame rate is
+    the lowest offered rate of at least fps. Settings the camera does not list, or
+    that were not asked for, are None (left unchanged).
+    """
+    width, height = resize_frame
+    resolutions = capabilities.get('resolutions') or []
+    resolution = (None, None)
+    if (width, height) in resolutions:
+        resolution = (width, height)
+    elif resolutions:
+        covering = [option for option in resolutions if option[0] >= width and option[1] >= height]
+        if covering:
+            resolution = min(covering, key=lambda option: option[0] * option[1])
+        else:
+            resolution = max(resolutions, key=lambda option: option[0] * option[1])
+
+    frame_rate = None
+    frame_rates = capabilities.get('frame_rates') or []
+    if fps and frame_rates:
+        fast_enough = [rate for rate in frame_rates if rate >= fps]
+        frame_rate = min(fast_enough) if fast_enough else max(frame_rates)
+
+    codec = codec if codec in (capabilities.get('codecs') or []) else None
+    return {'width': resolution[0], 'height': resolution[1], 'fps': frame_rate, 'codec': codec}
+
+
+def negotiate_substream(ip_address, cam_user, cam_password, resize_frame, fps=None,
+                        codec=DEFAULT_SUBSTREAM_CODEC, channel=SUBSTREAM_CHANNEL,
+                        cached_profile=None, profile_updates=None):
+    """Configures a camera's substream to deliver frames of resize_frame, so capture
+    does not have to resize them. Called by capture workers before they connect.
+
+    A cached_profile negotiated earlier for the same request skips the capabilities
+    query; the channel is only written if its settings differ. The resulting profile
+    (a JSON-friendly dict) is returned and, if given, put on profile_updates as
+    (ip_address, profile) for the discovery cache. Returns None if the camera could
+    not be configured; capture then resizes on the CPU as before.
+
+    Args:
+        fps: Wanted frame rate, or None to keep the camera's.
+        codec: Wanted ISAPI codec name, or None to keep the camera's.
+    """
+    requested = {'width': resize_frame[0], 'height': resize_frame[1], 'fps': fps, 'codec': codec}
+    client = IsapiClient(ip_address, cam_user, cam_password)
+    try:
+        if cached_profile and cached_profile.get('requested') == requested:
+            target = cached_profile
+        else:
+            capabilities = client.get_capabilities(channel)
+            if capabilities is None:
+                logging.warning(
+                    f"Could not read substream capabilities of {ip_address}; resizing frames on the CPU.")
+                return None
+            target = pick_stream_profile(capabilities, resize_frame, fps, codec)
+
+        if not client.update_video(channel, width=target['width'], height=target['height'],
+                                   fps=target['fps'], codec=target['codec']):
+            logging.warning(f"Could not configure the substream of {ip_address}; resizing frames on the CPU.")
+            return None
+    finally:
+        client.close()
+
+    profile = {'channel': channel, 'width': target['width'], 'height': target['height'],
+               'fps': target['fps'], 'codec': target['codec'], 'requested': requested}
+    if target['width'] is None:
+        logging.info(f"Substream of {ip_address} lists no resolutions; resizing frames on the CPU.")
+    elif (target['width'], target['height']) == tuple(resize_frame):
+        logging.info(f"Substream of {ip_address} set to {target['width']}x{target['height']}; no resizing needed.")
+    else:
+        logging.info(f"Substream of {ip_address} has no {resize_frame[0]}x{resize_frame[1]} mode; "
+                     f"using {target['width']}x{target['height']} and resizing on the CPU.")
+    if profile_updates is not None:
+        profile_updates.put((ip_address, profile))
+    return profile
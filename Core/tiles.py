@@ -0,0 +1,162 @@
+import struct
+import time
+import cv2
+import numpy as np
+from Core.protocol import PAYLOAD_JPEG, PAYLOAD_TILES
+
+# PAYLOAD_TILES body: a frame header followed by the changed tiles, each with its
+# position in the frame and its own JPEG.
+#
+#   frame_width(2) frame_height(2) tile_count(2)
+#   tile_count * [x(2) y(2) width(2) height(2) jpeg_length(4) jpeg(jpeg_length)]
+TILES_HEADER_STRUCT = struct.Struct('>HHH')
+TILE_STRUCT = struct.Struct('>HHHHI')
+
+
+def parse_tile_grid(value):
+    """Parses a '<columns>x<rows>' tile grid setting."""
+    try:
+        columns, rows = (int(part) for part in value.lower().split('x'))
+    except ValueError:
+        raise ValueError(f"Invalid tile grid '{value}'. Expected '<columns>x<rows>'.")
+    if columns <= 0 or rows <= 0:
+        raise ValueError(f"Invalid tile grid '{value}'.")
+    return columns, rows
+
+
+def pack_tiles(frame_width, frame_height, tiles):
+    """Builds a PAYLOAD_TILES body from a list of (x, y, width, height, jpeg) tuples."""
+    parts = [TILES_HEADER_STRUCT.pack(frame_width, frame_height, len(tiles))]
+    for x, y, width, height, jpeg in tiles:
+        parts.append(TILE_STRUCT.pack(x, y, width, height, len(jpeg)))
+        parts.append(jpeg)
+    return b''.join(parts)
+
+
+def unpack_tiles(payload):
+    """Parses a PAYLOAD_TILES body.
+
+    Returns:
+        (frame_width, frame_height, tiles) where tiles is a list of
+        (x, y, width, height, jpeg) tuples; jpeg is a memoryview into payload.
+    """
+    view = memoryview(payload)
+    frame_width, frame_height, tile_count = TILES_HEADER_STRUCT.unpack_from(view, 0)
+    offset = TILES_HEADER_STRUCT.size
+    tiles = []
+    for _ in range(tile_count):
+        x, y, width, height, length = TILE_STRUCT.unpack_from(view, offset)
+        offset += TILE_STRUCT.size
+        tiles.append((x, y, width, height, view[offset:offset + length]))
+        offset += length
+    return frame_width, frame_height, tiles
+
+
+class TileDeltaEncoder:
+    """Encodes each camera frame as either a full keyframe or only its changed tiles.
+
+    The frame is cut into a fixed grid. Each tile is compared with the same tile of the
+    last transmitted frame; only tiles where enough pixels changed are JPEG-encoded and
+    sent with their coordinates. A full keyframe goes out every keyframe_interval
+    seconds, when most tiles changed anyway, and whenever request_keyframe() or reset()
+    was called (e.g. a delta was dropped, or the connection was re-established).
+    """
+
+    def __init__(self, grid=(8, 6), keyframe_interval=10.0, pixel_threshold=25, change_ratio=0.005, max_delta_ratio=0.5):
+        """
+        Args:
+            grid: (columns, rows) of tiles per frame.
+            keyframe_interval: Seconds between forced full frames.
+            pixel_threshold: Per-channel difference for a pixel to count as changed.
+            change_ratio: Fraction of a tile's pixels that must change to resend it.
+            max_delta_ratio: If more than this fraction of tiles changed, send a keyframe.
+        """
+        self.columns, self.rows = grid
+        self.keyframe_interval = keyframe_interval
+        self.pixel_threshold = pixel_threshold
+        self.change_ratio = change_ratio
+        self.max_delta_ratio = max_delta_ratio
+
+        self._references = {}       # camera id -> copy of the last transmitted image
+        self._last_keyframe = {}    # camera id -> time of the last keyframe
+        self._keyframe_requests = set()
+        self._generation = 0        # Bumped by reset(); references from older generations are stale
+        self._reference_generation = {}
+
+    def request_keyframe(self, camera_id):
+        """Forces the next frame of this camera to be a full keyframe."""
+        self._keyframe_requests.add(camera_id)
+
+    def reset(self):
+        """Forces a keyframe for every camera (e.g. after a reconnect)."""
+        self._generation += 1
+
+    def forget(self, camera_id):
+        """Drops the reference frame of a camera that is no longer streamed."""
+        self._references.pop(camera_id, None)
+        self._last_keyframe.pop(camera_id, None)
+        self._reference_generation.pop(camera_id, None)
+        self._keyframe_requests.discard(camera_id)
+
+    def _tile_bounds(self, width, height):
+        for row in range(self.rows):
+            y0 = row * height // self.rows
+            y1 = (row + 1) * height // self.rows
+            for column in range(self.columns):
+                x0 = column * width // self.columns
+                x1 = (column + 1) * width // self.columns
+                yield x0, y0, x1, y1
+
+    def encode(self, camera_id, image, quality, now=None):
+        """Encodes one frame.
+
+        Returns:
+            A (payload_type, payload) tuple: (PAYLOAD_JPEG, jpeg) for a keyframe,
+            (PAYLOAD_TILES, body) for a delta, or None if encoding failed or nothing changed.
+        """
+        now = time.monotonic() if now is None else now
+        encode_params = [int(cv2.IMWRITE_JPEG_QUALITY), quality]
+        reference = self._references.get(camera_id)
+
+        keyframe = (reference is None
+                    or reference.shape != image.shape
+                    or camera_id in self._keyframe_requests
+                    or self._reference_generation.get(camera_id) != self._generation
+                    or now - self._last_keyframe.get(camera_id, 0.0) >= self.keyframe_interval)
+
+        changed = []
+        if not keyframe:
+            mask = cv2.absdiff(image, reference).max(axis=2) > self.pixel_threshold
+            for x0, y0, x1, y1 in self._tile_bounds(image.shape[1], image.shape[0]):
+                tile_mask = mask[y0:y1, x0:x1]
+                if np.count_nonzero(tile_mask) > self.change_ratio * tile_mask.size:
+                    changed.append((x0, y0, x1, y1))
+            if len(changed) > self.max_delta_ratio * self.columns * self.rows:
+                keyframe = True
+
+        if keyframe:
+            ok, jpeg = cv2.imencode('.jpg', image, encode_params)
+            if not ok:
+                return None
+            self._keyframe_requests.discard(camera_id)
+            self._last_keyframe[camera_id] = now
+            self._reference_generation[camera_id] = self._generation
+            if reference is None or reference.shape != image.shape:
+                self._references[camera_id] = image.copy()
+            else:
+                np.copyto(reference, image)
+            return PAYLOAD_JPEG, jpeg
+
+        if not changed:
+            return None
+
+        tiles = []
+        for x0, y0, x1, y1 in changed:
+            ok, jpeg = cv2.imencode('.jpg', image[y0:y1, x0:x1], encode_params)
+            if not ok:
+                # Reference may already be partly updated; resync with a keyframe
+                self.request_keyframe(camera_id)
+                return None
+            tiles.append((x0, y0, x1 - x0, y1 - y0, jpeg.tobytes()))
+            reference[y0:y1, x0:x1] = image[y0:y1, x0:x1]
+        return PAYLOAD_TILES, pack_tiles(image.shape[1], image.shape[0], tiles)
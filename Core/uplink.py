@@ -0,0 +1,138 @@
+import logging
+import time
+
+logging.basicConfig(level=logging.INFO,
+                    format="%(asctime)s - %(levelname)s - %(message)s")
+
+MIN_RATE_WINDOW = 1.0  # Seconds a camera is observed before its frame rate is trusted
+REBALANCE_INTERVAL = 5.0  # Seconds between rebalances from fresh measurements
+# Periodic rebalances leave channels alone while the heaviest is within this fraction
+# of the lightest's load, so measurement noise does not move cameras back and forth
+REBALANCE_TOLERANCE = 0.1
+
+
+class UplinkChannels:
+    """Spreads the cameras over several uplink channels, each a FrameSender with its
+    own socket (fed by its own encoder pool in stream_merged_frames), so the edge is
+    not limited to one TCP flow's congestion window.
+
+    Every camera goes over one channel, chosen by weight: the pixels per second it
+    produces (resolution x fps). rebalance() keeps cameras on their channel where it
+    can, puts new ones on the lightest channel and then moves cameras off the
+    heaviest channel while that lowers its load. The streamer calls it whenever the
+    camera set changes and, since weights are only known once cameras have been
+    measured, every REBALANCE_INTERVAL (see rebalance_due). Messages that concern all cameras
+    (the camera set) are sticky on every channel. The receiver accepts any number of
+    connections and keys everything by camera id, so it needs no notion of channels.
+    """
+
+    def __init__(self, senders):
+        self.senders = senders
+        self._assignment = {}  # camera id -> channel index
+        self._rates = {}  # camera id -> (time.monotonic(), frames_published) at the start of its window
+        self._weights = {}  # camera id -> weight from its last full window
+        self._rebalanced = time.monotonic()
+
+    def __len__(self):
+        return len(self.senders)
+
+    def start(self):
+        for sender in self.senders:
+            sender.start()
+
+    def stop(self):
+        for sender in self.senders:
+            sender.stop()
+
+    def channel(self, camera_id):
+        """Index of the channel the camera is assigned to (0 if it is not assigned)."""
+        return self._assignment.get(camera_id, 0)
+
+    def sender(self, camera_id):
+        return self.senders[self.channel(camera_id)]
+
+    @property
+    def connections(self):
+        """Connection count of every channel, in channel order."""
+        return [sender.connections for sender in self.senders]
+
+    def set_sticky(self, name, payload_type, camera_id, payload):
+        """Registers a sticky message on every channel."""
+        for sender in self.senders:
+            sender.set_sticky(name, payload_type, camera_id, payload)
+
+    def measure(self, cameras, pixels):
+        """Weights of cameras ((camera_id, ip, slot) tuples) whose frames all have
+        `pixels` pixels, from the rate their slots published frames at since the last
+        measurement (at least MIN_RATE_WINDOW ago; until then, the previous one).
+
+        A camera not measured for MIN_RATE_WINDOW yet gets the mean weight of the
+        others (1.0 if there are none).
+        """
+        now = time.monotonic()
+        current = {camera_id for camera_id, _, _ in cameras}
+        for camera_id in list(self._rates):
+            if camera_id not in current:
+                del self._rates[camera_id]
+                self._weights.pop(camera_id, None)
+        for camera_id, _, slot in cameras:
+            started, published = self._rates.setdefault(camera_id, (now, slot.frames_published))
+            if now - started >= MIN_RATE_WINDOW:
+                self._weights[camera_id] = pixels * (slot.frames_published - published) / (now - started)
+                self._rates[camera_id] = (now, slot.frames_published)
+        weights = self._weights
+        default = sum(weights.values()) / len(weights) if weights else 1.0
+        return {camera_id: weights.get(camera_id, default) for camera_id in current}
+
+    def rebalance_due(self):
+        """True every REBALANCE_INTERVAL if there is more than one channel."""
+        return len(self.senders) > 1 and time.monotonic() - self._rebalanced >= REBALANCE_INTERVAL
+
+    def rebalance(self, weights, tolerance=0.0):
+        """Assigns the cameras in weights (camera id -> weight) to channels. Cameras
+        are only moved while the heaviest channel's load exceeds the lightest's by
+        more than tolerance (a fraction of the heaviest load).
+
+        Returns:
+            camera id -> previous channel index of every camera that moved.
+        """
+        assignment = {camera_id: channel for camera_id, channel in self._assignment.items()
+                      if camera_id in weights}
+        loads = [0.0] * len(self.senders)
+        for camera_id, channel in assignment.items():
+            loads[channel] += weights[camera_id]
+        for camera_id in sorted((camera_id for camera_id in weights if camera_id not in assignment),
+                                key=weights.get, reverse=True):
+            channel = loads.index(min(loads))
+            assignment[camera_id] = channel
+            loads[channel] += weights[camera_id]
+
+        moved = {}
+        for _ in range(len(weights)):
+            heaviest = loads.index(max(loads))
+            lightest = loads.index(min(loads))
+            gap = loads[heaviest] - loads[lightest]
+            if gap <= tolerance * loads[heaviest]:
+                break
+            # Moving a camera lighter than the gap lowers the heaviest load
+            candidates = [camera_id for camera_id, channel in assignment.items()
+                          if channel == heaviest and 0 < weights[camera_id] < gap]
+            if not candidates:
+                break
+            camera_id = max(candidates, key=weights.get)
+            moved.setdefault(camera_id, heaviest)
+            assignment[camera_id] = lightest
+            loads[heaviest] -= weights[camera_id]
+            loads[lightest] += weights[camera_id]
+
+        moved = {camera_id: channel for camera_id, channel in moved.items()
+                 if camera_id in self._assignment and assignment[camera_id] != channel}
+        changed = assignment != self._assignment
+        self._assignment = assignment
+        self._rebalanced = time.monotonic()
+        if len(self.senders) > 1 and changed:
+            total = sum(loads) or 1.0
+            logging.info("Uplink channels: " + ", ".join(
+                f"{index}: cameras {sorted(c for c, ch in assignment.items() if ch == index)} "
+                f"({loads[index] / total:.0%})" for index in range(len(self.senders))))
+        return moved
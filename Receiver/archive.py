@@ -0,0 +1,43 @@
+import logging
+import os
+from datetime import datetime, timezone
+from Core.protocol import MOSAIC_CAMERA_ID
+
+logging.basicConfig(level=logging.INFO,
+                    format="%(asctime)s - %(levelname)s - %(message)s")
+
+
+class FrameArchive:
+    """Stores the frames an edge replays from its spool after an uplink outage.
+
+    Every frame becomes one JPEG file, <directory>/<camera id or 'mosaic'>/<date>/
+    <capture time>_<seq>.jpg, named by its capture time in UTC. A frame replayed
+    twice (the edge resends what it had not seen acknowledged) overwrites its own
+    file. Files are written under a temporary name and renamed, so a file that
+    exists is complete.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.frames_saved = 0
+
+    def path(self, header):
+        camera = 'mosaic' if header.camera_id == MOSAIC_CAMERA_ID else str(header.camera_id)
+        captured = datetime.fromtimestamp(header.capture_time or 0, timezone.utc)
+        return os.path.join(self.directory, camera, captured.strftime('%Y-%m-%d'),
+                            f"{captured.strftime('%H%M%S.%f')}_{header.seq}.jpg")
+
+    def save(self, header, jpeg):
+        """Writes one frame (header is its Core.protocol.FrameHeader) and returns the path.
+
+        Raises:
+            OSError: If the file cannot be written.
+        """
+        path = self.path(header)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary = path + '.tmp'
+        with open(temporary, 'wb') as f:
+            f.write(jpeg)
+        os.replace(temporary, path)
+        self.frames_saved += 1
+        return path
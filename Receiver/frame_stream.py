@@ -0,0 +1,94 @@
+import threading
+import time
+
+MJPEG_BOUNDARY = 'frame'
+_PART_HEADER = b'--' + MJPEG_BOUNDARY.encode('ascii') + b'\r\nContent-Type: image/jpeg\r\nContent-Length: %d\r\n\r\n'
+
+
+class FrameStream:
+    """The newest JPEG of one camera (or of the mosaic), shared by all of its viewers.
+
+    publish() builds the frame's multipart/x-mixed-replace part once, so every MJPEG
+    viewer writes the same bytes object instead of concatenating its own copy, and
+    wakes the viewers through a condition instead of having them poll. Viewers keep
+    the seq of the last frame they sent and wait for a newer one; a slow viewer skips
+    straight to the newest frame.
+
+    Viewers register with add_viewer(), so the receiver can skip decoding and
+    re-encoding frames for streams nobody watches (see Receiver.refresh).
+    """
+
+    def __init__(self, camera_id):
+        self.camera_id = camera_id
+        self._cond = threading.Condition()
+        self._seq = 0       # Frames published so far
+        self._part = None   # Multipart part of the newest frame
+        self._jpeg_start = 0
+        self.closed = False
+        self._viewers = 0
+        self.last_seen = None  # time.time() the camera was last heard from
+        # Receiver-side state for frames built here rather than received whole,
+        # guarded by lock: the mosaic seq the newest frame was cut from, and the
+        # decoded canvas plus not yet applied tile updates (see Receiver.apply_tiles)
+        self.lock = threading.Lock()
+        self.source_seq = 0
+        self.canvas = None
+        self.pending_tiles = []
+
+    @property
+    def seq(self):
+        return self._seq
+
+    @property
+    def viewers(self):
+        return self._viewers
+
+    def add_viewer(self):
+        with self._cond:
+            self._viewers += 1
+
+    def remove_viewer(self):
+        with self._cond:
+            self._viewers -= 1
+
+    def publish(self, jpeg):
+        """Makes jpeg (any bytes-like object; it is copied) the newest frame and wakes the viewers."""
+        header = _PART_HEADER % len(jpeg)
+        part = b''.join((header, jpeg, b'\r\n'))
+        with self._cond:
+            self._part = part
+            self._jpeg_start = len(header)
+            self._seq += 1
+            self.last_seen = time.time()
+            self._cond.notify_all()
+
+    def touch(self):
+        """Records that the camera is alive although its image did not change."""
+        self.last_seen = time.time()
+
+    def latest_jpeg(self):
+        """The newest JPEG as a memoryview, or None if nothing was published yet."""
+        with self._cond:
+            if self._part is None:
+                return None
+            return memoryview(self._part)[self._jpeg_start:-2]
+
+    def wait_frame(self, after_seq, timeout=None):
+        """Waits for a frame newer than after_seq.
+
+        Returns:
+            (seq, multipart part) of the newest frame, or None on timeout or once the
+            stream is closed.
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._seq > after_seq or self.closed, timeout):
+                return None
+            if self.closed:
+                return None
+            return self._seq, self._part
+
+    def close(self):
+        """Ends the stream (e.g. its camera was removed); waiting viewers return."""
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
@@ -0,0 +1,506 @@
+import json
+import logging
+import socket
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+from Core.protocol import (FrameReader, ProtocolError, PAYLOAD_JPEG, PAYLOAD_MOSAIC_JPEG, PAYLOAD_LAYOUT,
+                           PAYLOAD_KEEPALIVE, PAYLOAD_TILES, PAYLOAD_CAMERAS, PAYLOAD_VIDEO_PACKET,
+                           PAYLOAD_VIDEO_CONFIG, PAYLOAD_SPOOLED, PAYLOAD_SPOOL_ACK, PAYLOAD_TIER_JPEG, SPOOL_ID_STRUCT,
+                           MOSAIC_CAMERA_ID, unpack_message, parse_video_flags, send_frame)
+from Core.datagram import FrameAssembler, MAX_DATAGRAM_SIZE
+from Core.tiles import TILES_HEADER_STRUCT, TILE_STRUCT
+from Receiver.archive import FrameArchive
+from Receiver.frame_stream import FrameStream
+from Receiver.stats import CameraStats
+from Receiver.video import VideoStream
+
+logging.basicConfig(level=logging.INFO,
+                    format="%(asctime)s - %(levelname)s - %(message)s")
+
+DEFAULT_JPEG_QUALITY = 75  # For frames the receiver has to re-encode (tiles, mosaic splits, decoded video)
+SOCKET_TIMEOUT = 10        # Seconds without a message before an edge connection is dropped
+DEFAULT_DECODE_WORKERS = 4
+# Tile updates held for an unwatched camera before they are patched into its canvas
+# (without re-encoding it), so memory stays bounded between keyframes
+MAX_PENDING_TILES = 100
+DATAGRAM_RECEIVE_BUFFER = 8 * 1024 * 1024  # Absorbs bursts of datagrams while a frame is handled
+DATAGRAM_IDLE_TIMEOUT = 60  # Seconds without datagrams before a sender's partial messages are dropped
+# Message types that carry a camera frame, and so count for latency and loss
+_FRAME_PAYLOADS = (PAYLOAD_JPEG, PAYLOAD_TILES, PAYLOAD_MOSAIC_JPEG, PAYLOAD_VIDEO_PACKET)
+
+
+class Receiver:
+    """VPS side of the uplink: accepts edge connections and keeps the newest frame of
+    every camera for the web viewers (see Receiver/web.py).
+
+    Each connection is read by a Core.protocol.FrameReader into reusable buffers;
+    a JPEG is copied once, into the FrameStream part all of its viewers share.
+
+    Frames the receiver has to decode and re-encode are only built for streams
+    with viewers: mosaic frames are cut (on a small worker pool) into the watched
+    cameras only, tile updates are queued until someone watches the camera, and
+    passthrough video is only decoded while watched. When a viewer joins, refresh()
+    brings its stream up to date from the newest mosaic or the queued tiles. Idle
+    streams cost no decoding or encoding.
+
+    Frames an edge spooled during an uplink outage arrive later as PAYLOAD_SPOOLED
+    messages. They are not shown live; they are written to the archive_dir (see
+    Receiver/archive.py), if one is given, and acknowledged to the edge.
+
+    With simulcast, the edge also sends smaller encodings of each camera (tiers,
+    PAYLOAD_TIER_JPEG), each kept in a FrameStream of its own; stream_for_size()
+    picks the smallest one that covers what a viewer asks for, so thumbnails cost
+    neither the uplink nor the receiver a full-size frame.
+
+    An edge using the UDP transport sends the same messages as datagrams, which
+    serve_datagrams() puts back together (Core.datagram.FrameAssembler, one per
+    sender) and hands to handle_message().
+
+    Attributes:
+        cameras: camera id -> IP, as last announced by the edge (PAYLOAD_CAMERAS).
+        tiers: Simulcast tiers announced with the cameras, each a dict with tier,
+               width, height and fps; tier 0 is the main stream. Empty without simulcast.
+        merged: FrameStream of the mosaic (stream_mode = mosaic).
+    """
+
+    def __init__(self, jpeg_quality=DEFAULT_JPEG_QUALITY, decode_workers=DEFAULT_DECODE_WORKERS, archive_dir=None):
+        self.jpeg_quality = jpeg_quality
+        self.archive = FrameArchive(archive_dir) if archive_dir else None
+        self._lock = threading.Lock()
+        self._streams = {}        # camera id -> FrameStream
+        self._video_streams = {}  # camera id -> VideoStream
+        self._tier_streams = {}   # (camera id, tier number) -> FrameStream
+        self._stats = {}          # camera id (or MOSAIC_CAMERA_ID) -> CameraStats
+        self.cameras = {}
+        self.tiers = []
+        self.merged = FrameStream(MOSAIC_CAMERA_ID)
+        # Grid of the mosaic stream, announced by the edge before mosaic frames
+        self.layout = {'columns': 1, 'rows': 1, 'num_cameras': 1}
+        self._executor = ThreadPoolExecutor(max_workers=decode_workers, thread_name_prefix='FrameProcessor')
+        self._server = None
+        self._datagram_socket = None
+        self._connections = set()  # Open edge connections, closed by close()
+
+    # --- Per-camera state ---
+
+    def stream(self, camera_id, create=True):
+        """The camera's FrameStream, created on first use so the edge can send any number of cameras."""
+        with self._lock:
+            stream = self._streams.get(camera_id)
+            if stream is None and create:
+                stream = FrameStream(camera_id)
+                self._streams[camera_id] = stream
+                logging.info(f"New camera stream {camera_id}")
+            return stream
+
+    def streams(self):
+        """Snapshot of camera id -> FrameStream."""
+        with self._lock:
+            return dict(self._streams)
+
+    def tier_stream(self, camera_id, tier, create=True):
+        """The FrameStream of one simulcast tier (1..) of a camera."""
+        with self._lock:
+            stream = self._tier_streams.get((camera_id, tier))
+            if stream is None and create:
+                stream = self._tier_streams[(camera_id, tier)] = FrameStream(camera_id)
+            return stream
+
+    def stream_for_size(self, camera_id, width=0, height=0):
+        """The cheapest stream of a camera that is at least width x height: the smallest
+        simulcast tier that covers it and has a frame, else the main stream (or None if
+        the camera is unknown). 0 leaves that dimension open."""
+        main = self.stream(camera_id, create=False)
+        if main is None or (not width and not height):
+            return main
+        candidates = sorted((tier['width'] * tier['height'], tier['tier']) for tier in self.tiers
+                            if tier['tier'] and tier['width'] >= width and tier['height'] >= height)
+        for _, tier in candidates:
+            stream = self.tier_stream(camera_id, tier, create=False)
+            if stream is not None and stream.latest_jpeg() is not None:
+                return stream
+        return main
+
+    def video_stream(self, camera_id, create=True):
+        frame_stream = self.stream(camera_id) if create else None
+        with self._lock:
+            video_stream = self._video_streams.get(camera_id)
+            if video_stream is None and create:
+                video_stream = VideoStream(camera_id, frame_stream, self.jpeg_quality)
+                self._video_streams[camera_id] = video_stream
+            return video_stream
+
+    def stats(self, camera_id):
+        with self._lock:
+            stats = self._stats.get(camera_id)
+            if stats is None:
+                stats = self._stats[camera_id] = CameraStats()
+            return stats
+
+    def stats_summary(self):
+        """camera id -> CameraStats.summary() of every camera heard from."""
+        with self._lock:
+            stats = dict(self._stats)
+        return {camera_id: stats[camera_id].summary() for camera_id in sorted(stats)}
+
+    def update_cameras(self, cameras, addr):
+        """Applies a camera set message: remembers each camera's IP and drops streams of removed cameras.
+        Streams of new cameras are created right away, so viewers can join before their first frame."""
+        current = {camera['id']: camera['ip'] for camera in cameras}
+        for camera_id in current:
+            self.stream(camera_id)
+        with self._lock:
+            if current == self.cameras:
+                return  # Repeated, e.g. on every uplink channel or periodically over UDP
+            removed = [camera_id for camera_id in self._streams if camera_id not in current]
+            for camera_id in removed:
+                self._streams.pop(camera_id).close()
+                self._video_streams.pop(camera_id, None)
+            for key in [key for key in self._tier_streams if key[0] not in current]:
+                self._tier_streams.pop(key).close()
+            for camera_id in [camera_id for camera_id in self._stats
+                              if camera_id not in current and camera_id != MOSAIC_CAMERA_ID]:
+                del self._stats[camera_id]
+            self.cameras = current
+        logging.info(f"Camera set from {addr}: {current}" + (f", removed {removed}" if removed else ''))
+
+    def update_tiers(self, tiers, addr):
+        """Applies the simulcast tiers announced with the camera set."""
+        tiers = [{'tier': int(tier['tier']), 'width': int(tier['width']), 'height': int(tier['height']),
+                  'fps': tier.get('fps')} for tier in tiers]
+        if tiers == self.tiers:
+            return
+        self.tiers = tiers
+        logging.info(f"Simulcast tiers from {addr}: " + (", ".join(
+            f"{tier['tier']}: {tier['width']}x{tier['height']} @ {tier['fps']} fps" for tier in tiers) or 'none'))
+
+    # --- Messages ---
+
+    def handle_message(self, header, payload, addr):
+        """Applies one message; payload is a buffer that is only valid during the call."""
+        payload_type = header.payload_type
+        camera_id = header.camera_id
+        if payload_type in _FRAME_PAYLOADS or payload_type == PAYLOAD_KEEPALIVE:
+            self.stats(camera_id).record(header, time.time())
+
+        if payload_type == PAYLOAD_JPEG:
+            # Already a standalone JPEG for one camera: serve the bytes as received
+            stream = self.stream(camera_id)
+            with stream.lock:
+                # A keyframe: tile updates start over from it
+                stream.canvas = None
+                stream.pending_tiles.clear()
+                stream.publish(payload)
+        elif payload_type == PAYLOAD_KEEPALIVE:
+            # Camera is alive but its image hasn't changed; keep serving the last frame
+            self.stream(camera_id).touch()
+        elif payload_type == PAYLOAD_TILES:
+            self.apply_tiles(camera_id, payload, addr)
+        elif payload_type == PAYLOAD_VIDEO_PACKET:
+            _, keyframe = parse_video_flags(header.flags)
+            video_stream = self.video_stream(camera_id)
+            video_stream.frame_stream.touch()
+            video_stream.push(bytes(payload), keyframe, header.seq)
+        elif payload_type == PAYLOAD_VIDEO_CONFIG:
+            try:
+                self.video_stream(camera_id).set_config(json.loads(bytes(payload)))
+            except ValueError as e:
+                logging.warning(f"Invalid video config from {addr}: {e}")
+        elif payload_type == PAYLOAD_MOSAIC_JPEG:
+            self.merged.publish(payload)
+            watched = []
+            for mosaic_camera_id in self.mosaic_camera_ids():
+                stream = self.stream(mosaic_camera_id)
+                stream.touch()
+                if stream.viewers:
+                    watched.append(mosaic_camera_id)
+            if watched:
+                self._executor.submit(self.split_mosaic, self.merged.latest_jpeg(), self.merged.seq,
+                                      watched, addr)
+        elif payload_type == PAYLOAD_LAYOUT:
+            try:
+                layout = {**self.layout, **json.loads(bytes(payload))}
+                if layout == self.layout:
+                    return
+                self.layout = layout
+                logging.info(f"Mosaic layout from {addr}: {self.layout}")
+                for mosaic_camera_id in self.mosaic_camera_ids():
+                    self.stream(mosaic_camera_id)
+            except ValueError as e:
+                logging.warning(f"Invalid layout message from {addr}: {e}")
+        elif payload_type == PAYLOAD_TIER_JPEG:
+            # Tiers of a camera that left the camera set are dropped, not resurrected
+            if header.flags and self.stream(camera_id, create=False) is not None:
+                self.tier_stream(camera_id, header.flags).publish(payload)
+        elif payload_type == PAYLOAD_CAMERAS:
+            try:
+                camera_info = json.loads(bytes(payload))
+                self.update_tiers(camera_info.get('tiers') or [], addr)
+                self.update_cameras(camera_info['cameras'], addr)
+            except (ValueError, KeyError, TypeError) as e:
+                logging.warning(f"Invalid camera set message from {addr}: {e}")
+        else:
+            logging.warning(f"Unknown payload type {payload_type} from {addr}, skipping.")
+
+    def handle_spooled(self, payload, addr):
+        """Stores a frame the edge replayed from its spool (PAYLOAD_SPOOLED).
+
+        Returns:
+            The spool id to acknowledge. A malformed frame is acknowledged too, since
+            sending it again would not help.
+
+        Raises:
+            OSError: If the archive cannot store the frame. The connection is then
+                     dropped, so the edge keeps the frame and replays it later.
+        """
+        try:
+            spool_id, = SPOOL_ID_STRUCT.unpack_from(payload)
+        except struct.error:
+            raise ProtocolError("Spooled frame without a spool id")
+        try:
+            header, jpeg = unpack_message(payload[SPOOL_ID_STRUCT.size:])
+        except (ProtocolError, struct.error) as e:
+            logging.warning(f"Invalid spooled frame {spool_id} from {addr}: {e}")
+            return spool_id
+        if header.payload_type in (PAYLOAD_JPEG, PAYLOAD_MOSAIC_JPEG):
+            if self.archive is not None:
+                self.archive.save(header, jpeg)
+            self.stats(header.camera_id).record_recovered()
+        return spool_id
+
+    def refresh(self, stream):
+        """Brings a stream that just got a viewer up to date: cuts it from the newest
+        mosaic, or applies its queued tile updates."""
+        if stream.camera_id in self.mosaic_camera_ids() and self.merged.seq > stream.source_seq:
+            self._executor.submit(self.split_mosaic, self.merged.latest_jpeg(), self.merged.seq,
+                                  [stream.camera_id], None)
+        with stream.lock:
+            if stream.pending_tiles:
+                self._render_tiles(stream)
+
+    def apply_tiles(self, camera_id, payload, addr):
+        """Queues changed tiles (Core/tiles.py) for the camera's canvas; while the camera
+        is watched, patches them in right away and publishes the result."""
+        stream = self.stream(camera_id)
+        with stream.lock:
+            stream.pending_tiles.append(bytes(payload))
+            stream.touch()
+            if stream.viewers:
+                self._render_tiles(stream)
+            elif len(stream.pending_tiles) > MAX_PENDING_TILES:
+                self._patch_canvas(stream)
+
+    def _patch_canvas(self, stream):
+        """Applies the stream's queued tile updates to its canvas. Called with stream.lock held."""
+        pending, stream.pending_tiles = stream.pending_tiles, []
+        for payload in pending:
+            try:
+                frame_width, frame_height, tile_count = TILES_HEADER_STRUCT.unpack_from(payload, 0)
+                canvas = stream.canvas
+                if canvas is None:
+                    latest = stream.latest_jpeg()
+                    if latest is not None:
+                        canvas = cv2.imdecode(np.frombuffer(latest, dtype=np.uint8), cv2.IMREAD_COLOR)
+                    if canvas is None or canvas.shape[:2] != (frame_height, frame_width):
+                        # No keyframe yet: start from black until the next keyframe arrives
+                        canvas = np.zeros((frame_height, frame_width, 3), dtype=np.uint8)
+                    stream.canvas = canvas
+
+                offset = TILES_HEADER_STRUCT.size
+                for _ in range(tile_count):
+                    x, y, width, height, length = TILE_STRUCT.unpack_from(payload, offset)
+                    offset += TILE_STRUCT.size
+                    tile = cv2.imdecode(np.frombuffer(payload, dtype=np.uint8, count=length, offset=offset),
+                                        cv2.IMREAD_COLOR)
+                    offset += length
+                    if tile is not None and tile.shape[:2] == (height, width):
+                        canvas[y:y + height, x:x + width] = tile
+            except (struct.error, ValueError, cv2.error) as e:
+                logging.error(f"Invalid tile update for camera {stream.camera_id}: {e}")
+
+    def _render_tiles(self, stream):
+        """Applies the queued tile updates and publishes the canvas. Called with stream.lock held."""
+        self._patch_canvas(stream)
+        if stream.canvas is not None:
+            ok, jpeg = cv2.imencode('.jpg', stream.canvas, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+            if ok:
+                stream.publish(jpeg)
+
+    def mosaic_camera_ids(self):
+        """Camera ids of the mosaic tiles, in tile order."""
+        # Older edges send no ids and tiles map to 0..n-1
+        return self.layout.get('camera_ids') or list(range(self.layout['num_cameras']))
+
+    def split_mosaic(self, jpeg, seq, camera_ids, addr):
+        """Cuts the given cameras out of mosaic frame seq (stream_mode = mosaic), following the layout.
+
+        The mosaic is decoded once per call. A camera whose stream already shows
+        this mosaic (or a newer one) is not encoded again, and a call for a mosaic
+        that has since been replaced does nothing; the newer one is cut instead.
+        """
+        if seq != self.merged.seq:
+            return
+        try:
+            merged_frame = cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), cv2.IMREAD_COLOR)
+            if merged_frame is None:
+                logging.error(f"Failed to decode mosaic frame from {addr}. Size: {len(jpeg)} bytes.")
+                return
+            layout = self.layout
+            height, width = merged_frame.shape[:2]
+            tile_width = width // layout['columns']
+            tile_height = height // layout['rows']
+            if tile_width <= 0 or tile_height <= 0:
+                return
+            tile_indexes = {camera_id: index for index, camera_id in enumerate(self.mosaic_camera_ids())}
+            for camera_id in camera_ids:
+                if camera_id not in tile_indexes:
+                    continue
+                row, column = divmod(tile_indexes[camera_id], layout['columns'])
+                tile = merged_frame[row * tile_height:(row + 1) * tile_height,
+                                    column * tile_width:(column + 1) * tile_width]
+                if tile.size == 0:
+                    continue
+                stream = self.stream(camera_id)
+                with stream.lock:
+                    if stream.source_seq >= seq:
+                        continue
+                    ok, tile_jpeg = cv2.imencode('.jpg', tile, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+                    if ok:
+                        stream.source_seq = seq
+                        stream.publish(tile_jpeg)
+        except Exception as e:
+            logging.error(f"Error splitting mosaic frame from {addr}: {e}")
+
+    # --- Uplink server ---
+
+    def handle_connection(self, conn, addr):
+        """Reads messages from one edge connection until it closes."""
+        logging.info(f"Connected to {addr}")
+        conn.settimeout(SOCKET_TIMEOUT)
+        reader = FrameReader(conn)
+        with self._lock:
+            self._connections.add(conn)
+        try:
+            while True:
+                message = reader.read()
+                if message is None:
+                    break
+                header, payload = message
+                if header.payload_type == PAYLOAD_SPOOLED:
+                    spool_id = self.handle_spooled(payload, addr)
+                    send_frame(conn, PAYLOAD_SPOOL_ACK, header.camera_id, 0, SPOOL_ID_STRUCT.pack(spool_id))
+                    continue
+                self.handle_message(header, payload, addr)
+        except ProtocolError as e:
+            logging.warning(f"Bad message from {addr}: {e}. Disconnecting.")
+        except socket.timeout:
+            logging.warning(f"Socket timeout for client {addr}.")
+        except OSError as e:
+            logging.warning(f"Connection to {addr} failed: {e}")
+        except Exception as e:
+            logging.error(f"Unexpected error with client {addr}: {e}")
+        finally:
+            with self._lock:
+                self._connections.discard(conn)
+            conn.close()
+            logging.info(f"Disconnected from {addr}")
+
+    def handle_datagram(self, assembler, datagram, addr):
+        """Adds one datagram of an edge's message; applies the message once it is complete."""
+        result = assembler.add(datagram)
+        if result is None:
+            return
+        message, repaired = result
+        try:
+            header, payload = unpack_message(message)
+        except ProtocolError as e:
+            logging.warning(f"Bad message from {addr}: {e}")
+            return
+        if repaired:
+            self.stats(header.camera_id).record_repaired()
+        self.handle_message(header, payload, addr)
+
+    def serve_datagrams(self, host='0.0.0.0', port=8000):
+        """Receives edges' datagrams (transport = udp) on one socket until close()."""
+        self._datagram_socket = sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, DATAGRAM_RECEIVE_BUFFER)
+        sock.settimeout(1.0)  # close() cannot wake recvfrom_into, so check for it every second
+        sock.bind((host, port))
+        logging.info(f"Receiver listening for datagrams on {host}:{port}")
+        buffer = bytearray(MAX_DATAGRAM_SIZE)
+        view = memoryview(buffer)
+        assemblers = {}  # Sender address -> FrameAssembler
+        with sock:
+            while self._datagram_socket is not None:
+                try:
+                    count, addr = sock.recvfrom_into(buffer)
+                except socket.timeout:
+                    count = 0
+                except OSError:
+                    break  # Closed by close()
+                now = time.monotonic()
+                for idle in [idle for idle, assembler in assemblers.items()
+                             if now - assembler.last_received > DATAGRAM_IDLE_TIMEOUT]:
+                    logging.info(f"No datagrams from {idle} for {DATAGRAM_IDLE_TIMEOUT} s")
+                    del assemblers[idle]
+                if not count:
+                    continue
+                assembler = assemblers.get(addr)
+                if assembler is None:
+                    assembler = assemblers[addr] = FrameAssembler()
+                    logging.info(f"Receiving datagrams from {addr}")
+                try:
+                    self.handle_datagram(assembler, view[:count], addr)
+                except Exception as e:
+                    logging.error(f"Unexpected error with datagrams from {addr}: {e}")
+
+    def serve(self, host='0.0.0.0', port=8000):
+        """Accepts edge connections until close(), one reader thread per connection."""
+        self._server = socket.create_server((host, port))
+        logging.info(f"Receiver listening on {host}:{port}")
+        with self._server:
+            while True:
+                try:
+                    conn, addr = self._server.accept()
+                except OSError:
+                    break  # Closed by close()
+                conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                threading.Thread(target=self.handle_connection, args=(conn, addr), daemon=True,
+                                 name=f"Client-{addr[0]}:{addr[1]}").start()
+
+    def start(self, host='0.0.0.0', port=8000, datagram_port=None):
+        """Runs serve() in a daemon thread and returns the thread. If a datagram_port
+        is given, serve_datagrams() runs on it in another daemon thread."""
+        if datagram_port:
+            threading.Thread(target=self.serve_datagrams, args=(host, datagram_port), daemon=True,
+                             name="DatagramServer").start()
+        thread = threading.Thread(target=self.serve, args=(host, port), daemon=True, name="ReceiverServer")
+        thread.start()
+        return thread
+
+    def close(self):
+        if self._server is not None:
+            try:
+                self._server.shutdown(socket.SHUT_RDWR)  # Wakes the blocked accept()
+            except OSError:
+                pass
+            self._server.close()
+        if self._datagram_socket is not None:
+            datagram_socket, self._datagram_socket = self._datagram_socket, None
+            datagram_socket.close()
+        with self._lock:
+            connections = list(self._connections)
+        for conn in connections:
+            try:
+                conn.shutdown(socket.SHUT_RDWR)  # Ends the connection's reader thread
+            except OSError:
+                pass
+        with self._lock:
+            tier_streams = list(self._tier_streams.values())
+        for stream in list(self.streams().values()) + tier_streams + [self.merged]:
+            stream.close()
+        self._executor.shutdown(wait=True, cancel_futures=True)
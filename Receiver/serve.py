@@ -0,0 +1,59 @@
+"""VPS receiver: accepts the edge's uplink and serves the cameras to browsers.
+
+Run from the repository root, e.g.:
+
+    python -m Receiver.serve --port 8000 --http-port 8001
+"""
+import argparse
+import logging
+from Receiver.receiver import Receiver, DEFAULT_JPEG_QUALITY, DEFAULT_DECODE_WORKERS
+from Receiver.web import create_app
+
+logging.basicConfig(level=logging.INFO,
+                    format="%(asctime)s - %(threadName)s - %(levelname)s - %(message)s")
+
+
+DEFAULT_ARCHIVE_DIR = 'archive'
+
+
+def run_receiver(port=8000, http_port=8001, host='0.0.0.0', jpeg_quality=DEFAULT_JPEG_QUALITY,
+                 decode_workers=DEFAULT_DECODE_WORKERS, archive_dir=DEFAULT_ARCHIVE_DIR, udp_port=None):
+    """Starts the uplink server and serves the web app until interrupted.
+
+    Frames the edge spooled during an uplink outage are stored under archive_dir.
+    Edges using the UDP transport are received on udp_port (default: port; 0 = off).
+
+    The web server is werkzeug's threaded server: one thread per viewer, each asleep
+    on its stream's condition between frames. create_app() is a plain WSGI app, so
+    it can also be hosted by any threaded WSGI server.
+    """
+    receiver = Receiver(jpeg_quality, decode_workers, archive_dir)
+    receiver.start(host, port, port if udp_port is None else udp_port)
+    app = create_app(receiver)
+    logging.info(f"Web server starting on http://{host}:{http_port}")
+    try:
+        app.run(host=host, port=http_port, debug=False, threaded=True)
+    finally:
+        receiver.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8000, help="Port the edge streams to (video_port)")
+    parser.add_argument('--http-port', type=int, default=8001, help="Port of the web viewer")
+    parser.add_argument('--jpeg-quality', type=int, default=DEFAULT_JPEG_QUALITY,
+                        help="Quality of frames the receiver re-encodes")
+    parser.add_argument('--decode-workers', type=int, default=DEFAULT_DECODE_WORKERS,
+                        help="Threads splitting mosaic frames")
+    parser.add_argument('--archive-dir', default=DEFAULT_ARCHIVE_DIR,
+                        help="Where frames the edge replays after an outage are stored ('' to discard them)")
+    parser.add_argument('--udp-port', type=int, default=None,
+                        help="UDP port for edges with transport = udp (default: --port, 0 to disable)")
+    args = parser.parse_args()
+    run_receiver(args.port, args.http_port, args.host, args.jpeg_quality, args.decode_workers,
+                 args.archive_dir, args.udp_port)
+
+
+if __name__ == '__main__':
+    main()
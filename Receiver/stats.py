@@ -0,0 +1,87 @@
+import threading
+from collections import deque
+import numpy as np
+
+STATS_WINDOW = 500  # Latency samples kept per camera for the percentiles
+# A seq at most this far behind the newest is a late frame (e.g. from the channel a
+# camera was moved off); further behind, the edge has restarted its numbering
+REORDER_WINDOW = 64
+
+
+class CameraStats:
+    """Latency and loss of one camera's frames, from the timing in their headers.
+
+    Latency is split into edge (capture until the edge started sending, of which
+    encode is the part until the frame was encoded) and network (the rest, until
+    the frame was fully received here). Total and network compare the edge's wall
+    clock with ours, so they are only meaningful if both are NTP-synced. A gap in
+    seq counts the frames in between as lost, until one of them arrives late (within
+    REORDER_WINDOW); a late frame never moves the newest seq back, so the gap is not
+    counted twice. Frames the edge spooled during an uplink outage and replayed
+    later are counted as recovered, not in the latencies.
+    Frames received over UDP that needed a parity fragment to complete count as
+    repaired (and as received).
+    """
+
+    def __init__(self, window=STATS_WINDOW):
+        self._lock = threading.Lock()
+        self.frames = 0
+        self.lost = 0
+        self.recovered = 0
+        self.repaired = 0
+        self.last_seq = None
+        self._missing = set()  # Seqs counted as lost, at most REORDER_WINDOW behind last_seq
+        self._samples = deque(maxlen=window)  # (total, edge, encode, network) seconds
+
+    def record(self, header, received):
+        """Counts one message of the camera; header is a Core.protocol.FrameHeader and
+        received the time.time() it was fully received."""
+        with self._lock:
+            seq = header.seq
+            last_seq = self.last_seq
+            if last_seq is not None and last_seq - REORDER_WINDOW <= seq <= last_seq:
+                # A repeated seq is a keepalive; a late frame only counts if it was lost
+                if seq not in self._missing:
+                    return
+                self._missing.discard(seq)
+                self.lost -= 1
+            elif last_seq is not None and seq > last_seq:
+                if seq > last_seq + 1:
+                    self.lost += seq - last_seq - 1
+                    self._missing.update(range(max(last_seq + 1, seq - REORDER_WINDOW), seq))
+                if self._missing:
+                    self._missing = {missing for missing in self._missing if missing >= seq - REORDER_WINDOW}
+                self.last_seq = seq
+            else:
+                # The first frame, or the edge restarted
+                self._missing.clear()
+                self.last_seq = seq
+            self.frames += 1
+            if header.capture_time is None:
+                return
+            total = received - header.capture_time
+            self._samples.append((total, header.send_delay, header.encode_delay, total - header.send_delay))
+
+    def record_recovered(self):
+        """Counts one frame replayed from the edge's spool."""
+        with self._lock:
+            self.recovered += 1
+
+    def record_repaired(self):
+        """Counts one frame completed with a parity fragment (UDP transport)."""
+        with self._lock:
+            self.repaired += 1
+
+    def summary(self):
+        """JSON-friendly dict of frames, lost, recovered, repaired, loss_ratio and p50/p95 latencies in ms."""
+        with self._lock:
+            samples = np.array(self._samples) if self._samples else None
+            summary = {'frames': self.frames, 'lost': self.lost, 'recovered': self.recovered,
+                       'repaired': self.repaired,
+                       'loss_ratio': self.lost / (self.frames + self.lost) if self.frames + self.lost else 0.0}
+        if samples is not None:
+            for column, name in enumerate(('total', 'edge', 'encode', 'network')):
+                p50, p95 = np.percentile(samples[:, column], (50, 95))
+                summary[f'{name}_p50_ms'] = round(float(p50) * 1000, 1)
+                summary[f'{name}_p95_ms'] = round(float(p95) * 1000, 1)
+        return summary
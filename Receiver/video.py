@@ -0,0 +1,135 @@
+import base64
+import logging
+import queue
+import threading
+import cv2
+from Core.protocol import SEQ_MODULO
+
+try:
+    import av  # Optional: decodes passthrough H.264/H.265 streams for the MJPEG pages
+except ImportError:
+    av = None
+
+logging.basicConfig(level=logging.INFO,
+                    format="%(asctime)s - %(levelname)s - %(message)s")
+
+RAW_SUBSCRIBER_QUEUE = 300  # Packets buffered per raw viewer before it is restarted at a keyframe
+RAW_CONTENT_TYPES = {'h264': 'video/h264', 'hevc': 'video/h265', 'mpeg4': 'video/mp4v-es',
+                     'mjpeg': 'video/x-motion-jpeg'}
+
+
+class VideoStream:
+    """One camera's encoded stream in passthrough mode (PAYLOAD_VIDEO_PACKET).
+
+    Packets are fanned out unchanged to raw subscribers. Each subscriber starts at a
+    keyframe, preceded by the codec extradata (SPS/PPS), so what it receives is a
+    decodable elementary stream. MJPEG packets are JPEGs already and are published
+    to the camera's FrameStream as they are; other codecs are decoded into it if
+    PyAV is installed, but only while the FrameStream has viewers, starting at the
+    first keyframe after a viewer joins. A gap in the packets' seq (packets lost on
+    the way, e.g. over UDP) restarts subscribers and decoder at the next keyframe,
+    since the packets up to it cannot be decoded.
+    """
+
+    def __init__(self, camera_id, frame_stream, jpeg_quality=75):
+        self.camera_id = camera_id
+        self.frame_stream = frame_stream
+        self.jpeg_quality = jpeg_quality
+        self._lock = threading.Lock()
+        self.config = None
+        self.extradata = b''
+        self._subscribers = {}  # queue -> True once it has started at a keyframe
+        self._decoder = None
+        self._decoding = False  # False while unwatched: decoding restarts at a keyframe
+        self._last_seq = None
+
+    def set_config(self, config):
+        """Applies a PAYLOAD_VIDEO_CONFIG message (already parsed from JSON)."""
+        with self._lock:
+            if config == self.config:
+                return  # Repeated, e.g. periodically over UDP
+            self.config = config
+            self.extradata = base64.b64decode(config.get('extradata') or '')
+            # New stream parameters: restart every subscriber and the decoder at the next keyframe
+            for subscriber in self._subscribers:
+                self._subscribers[subscriber] = False
+            self._decoder = None
+            self._decoding = False
+            if av is not None and config.get('codec') not in ('mjpeg', 'unknown', None):
+                try:
+                    self._decoder = av.CodecContext.create(config['codec'], 'r')
+                    if self.extradata:
+                        self._decoder.extradata = self.extradata
+                except Exception as e:
+                    logging.warning(f"Cannot decode {config.get('codec')} of camera {self.camera_id}: {e}")
+        logging.info(f"Camera {self.camera_id} stream: {config.get('codec')} "
+                     f"{config.get('width')}x{config.get('height')} @ {config.get('fps')} fps")
+
+    @property
+    def content_type(self):
+        codec = self.config.get('codec') if self.config else None
+        return RAW_CONTENT_TYPES.get(codec, 'application/octet-stream')
+
+    def push(self, packet, keyframe, seq=None):
+        """Hands one packet (bytes, shared by every subscriber) to the subscribers and the decoder."""
+        with self._lock:
+            if seq is not None:
+                if not keyframe and self._last_seq is not None and seq != (self._last_seq + 1) % SEQ_MODULO:
+                    self._resync()
+                self._last_seq = seq
+            for subscriber, started in list(self._subscribers.items()):
+                if not started:
+                    if not keyframe:
+                        continue
+                    with subscriber.mutex:
+                        subscriber.queue.clear()
+                    if self.extradata:
+                        subscriber.put_nowait(self.extradata)
+                    self._subscribers[subscriber] = True
+                try:
+                    subscriber.put_nowait(packet)
+                except queue.Full:
+                    # Slow viewer: drop its backlog and resume at the next keyframe
+                    with subscriber.mutex:
+                        subscriber.queue.clear()
+                    self._subscribers[subscriber] = False
+            codec = self.config.get('codec') if self.config else None
+            decoder = self._decoder
+            if decoder is not None:
+                if not self.frame_stream.viewers:
+                    self._decoding = False
+                elif keyframe:
+                    self._decoding = True
+            decoding = self._decoding
+        if codec == 'mjpeg':
+            self.frame_stream.publish(packet)
+        elif decoding:
+            self._decode(decoder, packet)
+
+    def _resync(self):
+        """Restarts every subscriber and the decoder at the next keyframe. Called with the lock held."""
+        for subscriber in self._subscribers:
+            self._subscribers[subscriber] = False
+        self._decoding = False
+
+    def _decode(self, decoder, packet):
+        try:
+            for frame in decoder.decode(av.Packet(packet)):
+                ok, jpeg = cv2.imencode('.jpg', frame.to_ndarray(format='bgr24'),
+                                        [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+                if ok:
+                    self.frame_stream.publish(jpeg)
+        except Exception as e:
+            # Undecodable until the next keyframe, e.g. right after a reconnect
+            logging.debug(f"Decode error on camera {self.camera_id}: {e}")
+
+    def subscribe(self):
+        """Returns a queue that receives the stream's packets, starting at the next keyframe."""
+        subscriber = queue.Queue(maxsize=RAW_SUBSCRIBER_QUEUE)
+        with self._lock:
+            self._subscribers[subscriber] = False
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.pop(subscriber, None)
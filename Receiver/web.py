@@ -0,0 +1,127 @@
+import logging
+import queue
+import time
+from flask import Flask, Response, request
+from Receiver.frame_stream import MJPEG_BOUNDARY
+
+VIEWER_WAIT = 10.0  # Seconds a viewer waits for a frame before re-checking its stream
+WALL_TILE_WIDTH = 320  # Default width of a camera on /wall
+
+
+def mjpeg_parts(stream, on_join=None):
+    """Yields the multipart parts of a FrameStream's frames as they are published.
+
+    Every viewer blocks on the stream's condition and is woken by publish(); the part
+    it yields is the same bytes object for every viewer, so a frame costs each viewer
+    one socket write and nothing else. The viewer counts as one of the stream's
+    viewers until the response ends, and on_join(stream) is called when it starts.
+    """
+    stream.add_viewer()
+    try:
+        if on_join is not None:
+            on_join(stream)
+        seq = 0
+        while not stream.closed:
+            frame = stream.wait_frame(seq, VIEWER_WAIT)
+            if frame is not None:
+                seq, part = frame
+                yield part
+    finally:
+        stream.remove_viewer()
+
+
+def create_app(receiver):
+    """Flask app serving a Receiver's streams:
+
+    /                       Camera list with latency and loss
+    /merged_frame           MJPEG of the mosaic (stream_mode = mosaic)
+    /split_frame/<id>       MJPEG of one camera; with ?width=&height= (pixels), its
+                            smallest simulcast tier at least that large
+    /wall                   Every camera side by side (?width=, default WALL_TILE_WIDTH)
+    /raw/<id>               The camera's encoded elementary stream (stream_mode = passthrough)
+    /stats                  Latency percentiles, lost, recovered and repaired frames per camera, as JSON
+    """
+    app = Flask(__name__)
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    app.logger.setLevel(logging.WARNING)
+    mjpeg_type = f'multipart/x-mixed-replace; boundary={MJPEG_BOUNDARY}'
+
+    @app.route('/')
+    def index():
+        links = '<h1>Video Streams</h1>'
+        links += ('<p><a href="/merged_frame" target="_blank">Merged Stream</a> - <a href="/wall">all cameras</a>'
+                  ' - <a href="/stats">latency and loss</a></p>')
+        stats = receiver.stats_summary()
+        now = time.time()
+        for camera_id, stream in sorted(receiver.streams().items()):
+            status = f' (last seen {now - stream.last_seen:.0f}s ago)' if stream.last_seen else ''
+            camera_stats = stats.get(camera_id, {})
+            if 'total_p50_ms' in camera_stats:
+                status += f" latency {camera_stats['total_p50_ms']:.0f} ms (edge {camera_stats['edge_p50_ms']:.0f} ms)"
+            if camera_stats.get('lost'):
+                status += f", {camera_stats['lost']} lost"
+            if camera_stats.get('repaired'):
+                status += f", {camera_stats['repaired']} repaired by FEC"
+            if camera_stats.get('recovered'):
+                status += f", {camera_stats['recovered']} recovered from the edge spool"
+            ip_address = f' - {receiver.cameras[camera_id]}' if camera_id in receiver.cameras else ''
+            raw = ''
+            video_stream = receiver.video_stream(camera_id, create=False)
+            if video_stream is not None and video_stream.config:
+                raw = f' <a href="/raw/{camera_id}">(raw {video_stream.config.get("codec")})</a>'
+            if stream.viewers:
+                status += f", {stream.viewers} watching"
+            links += (f'<p><a href="/split_frame/{camera_id}" target="_blank">Camera {camera_id} Stream</a>'
+                      f'{raw}{ip_address}{status}</p>')
+        return links
+
+    @app.route('/merged_frame')
+    def merged_frame_feed():
+        return Response(mjpeg_parts(receiver.merged), mimetype=mjpeg_type)
+
+    @app.route('/split_frame/<int:camera_id>')
+    def split_frame_feed(camera_id):
+        stream = receiver.stream_for_size(camera_id, request.args.get('width', 0, type=int),
+                                          request.args.get('height', 0, type=int))
+        if stream is None:
+            return "Invalid camera ID", 404
+        # Only the main stream is built here (from mosaics or tiles); tiers arrive whole
+        on_join = receiver.refresh if stream is receiver.stream(camera_id, create=False) else None
+        return Response(mjpeg_parts(stream, on_join), mimetype=mjpeg_type)
+
+    @app.route('/wall')
+    def wall():
+        """Every camera on one page, each at the cheapest stream of the requested width."""
+        width = request.args.get('width', WALL_TILE_WIDTH, type=int)
+        tiles = ''.join(f'<a href="/split_frame/{camera_id}" target="_blank">'
+                        f'<img src="/split_frame/{camera_id}?width={width}" width="{width}" '
+                        f'title="Camera {camera_id}"></a>'
+                        for camera_id in sorted(receiver.streams()))
+        return f'<h1>All cameras</h1><div>{tiles}</div>'
+
+
+    @app.route('/raw/<int:camera_id>')
+    def raw_stream_feed(camera_id):
+        """The camera's encoded elementary stream as received, e.g. for ffplay or ffmpeg -c copy."""
+        video_stream = receiver.video_stream(camera_id, create=False)
+        if video_stream is None or not video_stream.config:
+            return "No passthrough stream for this camera", 404
+        subscriber = video_stream.subscribe()
+
+        def generate():
+            try:
+                while not video_stream.frame_stream.closed:
+                    try:
+                        yield subscriber.get(timeout=VIEWER_WAIT)
+                    except queue.Empty:
+                        pass
+            finally:
+                video_stream.unsubscribe(subscriber)
+
+        return Response(generate(), mimetype=video_stream.content_type)
+
+    @app.route('/stats')
+    def stats_feed():
+        return {str(camera_id): summary for camera_id, summary in receiver.stats_summary().items()}
+
+    return app
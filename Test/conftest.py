@@ -0,0 +1,6 @@
+import os
+import sys
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))  # Tests live in Test/
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
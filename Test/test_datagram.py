@@ -0,0 +1,172 @@
+import random
+import socket
+import threading
+import time
+import pytest
+from Core.datagram import (FrameAssembler, iter_fragments, fragment_size, FRAGMENT_STRUCT, FLAG_PARITY,
+                           MESSAGE_ID_MODULO)
+from Core.protocol import pack_header, unpack_message, PAYLOAD_JPEG, PAYLOAD_KEEPALIVE, PAYLOAD_TIER_JPEG
+from Core.sender import DatagramSender
+from Receiver.receiver import Receiver
+
+MTU = 200
+
+
+def build_message(camera_id, seq, size, payload_type=PAYLOAD_JPEG, flags=0):
+    payload = bytes(random.Random(seq).getrandbits(8) for _ in range(size))
+    return bytes(pack_header(payload_type, camera_id, seq, size, flags)) + payload
+
+
+def fragments(message, message_id, camera_id=0, fec_group=0):
+    return [bytes(header) + bytes(data)
+            for header, data in iter_fragments(message, message_id, camera_id, MTU, fec_group)]
+
+
+def is_parity(datagram):
+    return FRAGMENT_STRUCT.unpack_from(datagram)[2] & FLAG_PARITY
+
+
+def add_all(assembler, datagrams):
+    results = [assembler.add(datagram) for datagram in datagrams]
+    return [result for result in results if result is not None]
+
+
+def test_fragments_fit_the_mtu():
+    message = build_message(0, 0, 5000)
+    datagrams = fragments(message, 0, fec_group=4)
+    data = [datagram for datagram in datagrams if not is_parity(datagram)]
+    assert len(data) == -(-len(message) // fragment_size(MTU))
+    assert len(datagrams) == len(data) + -(-len(data) // 4)
+    assert all(len(datagram) + 28 <= MTU for datagram in datagrams)
+
+
+def test_mtu_too_small():
+    with pytest.raises(ValueError):
+        fragment_size(FRAGMENT_STRUCT.size + 28)
+
+
+@pytest.mark.parametrize('size', [1, 100, 171, 5000])
+def test_reassembles_in_any_order(size):
+    message = build_message(2, 7, size)
+    datagrams = fragments(message, 9, camera_id=2)
+    random.Random(size).shuffle(datagrams)
+    results = add_all(FrameAssembler(), datagrams)
+    assert results == [(bytearray(message), False)]
+    header, payload = unpack_message(results[0][0])
+    assert (header.camera_id, header.seq, header.length) == (2, 7, size)
+
+
+@pytest.mark.parametrize('lost', ['first', 'middle', 'last'])
+def test_parity_restores_one_lost_fragment_per_group(lost):
+    message = build_message(0, 1, 1900)  # The last group is shorter than fec_group
+    datagrams = fragments(message, 1, fec_group=4)
+    data_index = [index for index, datagram in enumerate(datagrams) if not is_parity(datagram)]
+    assert len(data_index) % 4
+    del datagrams[{'first': data_index[0], 'middle': data_index[5], 'last': data_index[-1]}[lost]]
+    assembler = FrameAssembler()
+    assert add_all(assembler, datagrams) == [(bytearray(message), True)]
+    assert assembler.messages_repaired == 1
+
+
+def test_parity_cannot_restore_two_lost_fragments_of_a_group():
+    message = build_message(0, 1, 1900)
+    datagrams = fragments(message, 1, fec_group=4)
+    del datagrams[1]
+    del datagrams[0]
+    assembler = FrameAssembler()
+    assert add_all(assembler, datagrams) == []
+    assert assembler.messages_completed == 0
+
+
+def test_newer_complete_frame_drops_older_incomplete_one():
+    assembler = FrameAssembler()
+    old = fragments(build_message(0, 1, 1000), 1)
+    new = fragments(build_message(0, 2, 1000), 2)
+    other_camera = fragments(build_message(1, 1, 1000), 3, camera_id=1)
+    assert add_all(assembler, old[:-1] + other_camera[:-1]) == []
+    results = add_all(assembler, new)
+    assert [unpack_message(message)[0].seq for message, _ in results] == [2]
+    assert assembler.messages_dropped == 1
+    # The old frame's last fragment arrives late: it is not delivered behind the new one
+    assert assembler.add(old[-1]) is None
+    # Another camera's incomplete frame is unaffected
+    assert add_all(assembler, other_camera[-1:]) == [(bytearray(build_message(1, 1, 1000)), False)]
+
+
+def test_keepalive_does_not_supersede_a_frame_in_flight():
+    assembler = FrameAssembler()
+    frame = fragments(build_message(0, 5, 1000), 1)
+    keepalive = fragments(build_message(0, 4, 0, PAYLOAD_KEEPALIVE), 2)
+    assert add_all(assembler, frame[:-1]) == []
+    assert len(add_all(assembler, keepalive)) == 1
+    assert add_all(assembler, frame[-1:]) == [(bytearray(build_message(0, 5, 1000)), False)]
+    assert assembler.messages_dropped == 0
+
+
+def test_tier_and_main_frames_do_not_supersede_each_other():
+    assembler = FrameAssembler()
+    main = build_message(0, 7, 3000)
+    tiers = [build_message(0, 3, 500, PAYLOAD_TIER_JPEG, 1), build_message(0, 2, 1000, PAYLOAD_TIER_JPEG, 2)]
+    main_fragments = fragments(main, 10)
+    tier_fragments = [fragments(tiers[0], 11), fragments(tiers[1], 12)]
+    # The tiers of a frame complete while its larger main frame is still arriving
+    results = add_all(assembler, main_fragments[:3] + tier_fragments[0] + main_fragments[3:-1] + tier_fragments[1])
+    assert [bytes(message) for message, _ in results] == tiers
+    # The main frame's last fragment, arriving after both tiers, still completes it
+    assert add_all(assembler, main_fragments[-1:]) == [(bytearray(main), False)]
+    assert assembler.messages_dropped == 0
+    # A newer tier 1 frame still supersedes an older incomplete one
+    add_all(assembler, fragments(build_message(0, 4, 500, PAYLOAD_TIER_JPEG, 1), 13)[:-1])
+    add_all(assembler, fragments(build_message(0, 5, 500, PAYLOAD_TIER_JPEG, 1), 14))
+    assert assembler.messages_dropped == 1
+
+
+def test_incomplete_message_times_out():
+    assembler = FrameAssembler(timeout=0.05)
+    datagrams = fragments(build_message(0, 1, 1000), 1)
+    assert add_all(assembler, datagrams[:-1]) == []
+    time.sleep(0.1)
+    add_all(assembler, fragments(build_message(1, 1, 10), 2, camera_id=1))
+    assert assembler.messages_dropped == 1
+
+
+def test_restarted_sender_is_not_taken_for_late_fragments():
+    assembler = FrameAssembler()
+    add_all(assembler, fragments(build_message(0, 1, 100), MESSAGE_ID_MODULO - 10))
+    # Message ids wrap around, and a restarted sender starts over at 0
+    assert len(add_all(assembler, fragments(build_message(0, 2, 100), 5))) == 1
+    assert len(add_all(assembler, fragments(build_message(0, 3, 100), 1000000))) == 1
+
+
+def test_invalid_datagrams_are_counted():
+    assembler = FrameAssembler()
+    datagram = fragments(build_message(0, 1, 1000), 1)[0]
+    assert assembler.add(b'xx') is None
+    assert assembler.add(b'XX' + datagram[2:]) is None
+    assert assembler.add(datagram[:FRAGMENT_STRUCT.size]) is None
+    assert assembler.datagrams_invalid == 3
+
+
+def test_loopback_with_simulated_loss():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    receiver = Receiver()
+    receiver.start('127.0.0.1', port, port)
+    stop = threading.Event()
+    sender = DatagramSender('127.0.0.1', port, stop, fec_group=4, simulated_loss=0.02)
+    sender.start()
+    try:
+        payload = bytes(random.Random(0).getrandbits(8) for _ in range(20000))
+        for seq in range(200):
+            sender.submit(PAYLOAD_JPEG, 0, seq, payload)
+            time.sleep(0.01)
+        time.sleep(0.5)
+        stats = receiver.stats_summary()[0]
+        assert stats['frames'] > 100
+        assert stats['repaired'] > 0
+        assert receiver.stream(0, create=False).latest_jpeg() == payload
+    finally:
+        stop.set()
+        sender.stop()
+        receiver.close()
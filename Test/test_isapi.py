@@ -0,0 +1,134 @@
+import threading
+import cv2
+import numpy as np
+import pytest
+from Bench.fake_isapi import FakeIsapiCamera
+from Core.isapi import IsapiClient, IsapiClients
+
+
+@pytest.fixture
+def camera():
+    camera = FakeIsapiCamera('admin', 'secret').start()
+    yield camera
+    camera.stop()
+
+
+@pytest.fixture
+def client(camera):
+    client = IsapiClient(camera.host, 'admin', 'secret')
+    yield client
+    client.close()
+
+
+def run_threads(count, target):
+    threads = [threading.Thread(target=target) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def test_nonce_is_shared_across_threads(camera, client):
+    results = []
+
+    def work():
+        for _ in range(5):
+            results.append(client.get_video())
+
+    assert client.get_video() is not None
+    run_threads(8, work)
+    assert len(results) == 40 and all(results)
+    # Only the very first request is challenged; every thread reuses its nonce
+    assert camera.challenges == 1
+    assert camera.requests == 42
+    # Connections are kept alive, at most one per concurrent request
+    assert camera.connections <= 2
+
+
+def test_wrong_password_fails(camera):
+    client = IsapiClient(camera.host, 'admin', 'wrong')
+    assert client.get_video() is None
+    assert client.set_fps(10) is False
+    client.close()
+
+
+def test_requests_per_camera_are_bounded(camera):
+    camera.delay = 0.05
+    client = IsapiClient(camera.host, 'admin', 'secret', max_concurrent=3)
+    lock = threading.Lock()
+    in_flight = [0, 0]  # current, most
+    request = client.session.request
+
+    def counting_request(*args, **kwargs):
+        with lock:
+            in_flight[0] += 1
+            in_flight[1] = max(in_flight)
+        try:
+            return request(*args, **kwargs)
+        finally:
+            with lock:
+                in_flight[0] -= 1
+
+    client.session.request = counting_request
+    run_threads(12, client.get_video)
+    client.close()
+    assert in_flight[1] == 3
+    assert camera.connections <= 3
+
+
+def test_update_video_changes_only_the_requested_settings(camera, client):
+    assert client.update_video(102, width=704, height=576, fps=20) is True
+    assert camera.channels[102] == {'width': 704, 'height': 576, 'bitrate': 512,
+                                    'max_frame_rate': 2000, 'codec': 'H.265'}
+    assert client.set_bitrate(1024, channel=102) is True
+    assert camera.channels[102]['bitrate'] == 1024
+    assert client.get_video(102) == {'width': 704, 'height': 576, 'fps': 20.0, 'codec': 'H.265'}
+    # The main stream is untouched
+    assert camera.channels[101]['width'] == 1920
+
+
+def test_update_video_writes_nothing_when_settings_match(camera, client):
+    assert client.set_fps(25) is True
+    requests = camera.requests
+    assert client.update_video(width=1920, height=1080, fps=25, codec='H.264') is True
+    # Only the read: no PUT for settings the channel already has
+    assert camera.requests == requests + 1
+    assert camera.channels[101]['max_frame_rate'] == 2500
+
+
+def test_update_video_of_a_missing_channel(client):
+    assert client.set_resolution(640, 480, channel=105) is False
+
+
+def test_move_and_stop(camera, client):
+    assert client.move(50, -20) is True
+    assert camera.ptz == {'pan': 50, 'tilt': -20, 'zoom': 0}
+    # Speeds are clamped to -100..100
+    assert client.move(250, 0, -300) is True
+    assert camera.ptz == {'pan': 100, 'tilt': 0, 'zoom': -100}
+    assert client.stop_move() is True
+    assert camera.ptz == {'pan': 0, 'tilt': 0, 'zoom': 0}
+
+
+def test_snapshot(client):
+    jpeg = client.snapshot()
+    frame = cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), cv2.IMREAD_COLOR)
+    assert frame.shape == (270, 480, 3)
+
+
+def test_unreachable_camera():
+    client = IsapiClient('127.0.0.1:9', 'admin', 'secret', timeout=1.0)
+    assert client.snapshot() is None
+    assert client.move(10, 10) is False
+    client.close()
+
+
+def test_clients_are_shared_and_retained(camera):
+    clients = IsapiClients('admin', 'secret')
+    first = clients.get(camera.host)
+    assert clients.get(camera.host) is first
+    clients.get('127.0.0.1:9')
+    clients.retain([camera.host])
+    assert clients.get(camera.host) is first
+    assert clients.get('127.0.0.1:9') is not first
+    clients.close()
@@ -0,0 +1,95 @@
+import threading
+import pytest
+import Core.rate_control as rate_control
+from Core.rate_control import AdaptiveController
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rate_control.time, 'monotonic', clock)
+    return clock
+
+
+def controller(**options):
+    options = {'min_quality': 30, 'max_quality': 70, 'min_scale': 0.5, 'max_scale': 1.0,
+               'min_fps': 2.0, 'max_fps': 25.0, 'adjust_interval': 1.0, **options}
+    return AdaptiveController(**options)
+
+
+def test_congested_link_lowers_quality_then_scale_then_fps(clock):
+    rc = controller()
+    for _ in range(30):
+        clock.now += 1.0
+        rc.record_send(10000, 0.9)
+    assert (rc.quality, rc.scale, rc.fps) == (30, 0.5, 2.0)
+
+
+def test_idle_link_recovers_in_reverse_order(clock):
+    rc = controller()
+    rc.quality, rc.scale, rc.fps = 30, 0.5, 20.0
+    clock.now += 1.0
+    rc.record_send(1000, 0.01)
+    assert (rc.quality, rc.scale, rc.fps) == (30, 0.5, 21.0)
+    for _ in range(200):
+        clock.now += 1.0
+        rc.record_send(1000, 0.01)
+    assert (rc.quality, rc.scale, rc.fps) == (70, 1.0, 25.0)
+
+
+def test_replaced_frames_count_as_congestion(clock):
+    rc = controller()
+    rc.record_drop()
+    clock.now += 1.0
+    rc.record_send(1000, 0.01)
+    assert rc.quality < 70
+
+
+def test_nothing_changes_within_the_adjust_interval(clock):
+    rc = controller()
+    clock.now += 0.5
+    rc.record_send(10000, 0.5)
+    assert rc.quality == 70
+
+
+def test_busy_ratio_is_per_channel(clock):
+    rc = controller()
+    rc.quality = 60
+    clock.now += 1.0
+    for channel in range(4):
+        rc.record_send(1000, 0.25, channel)
+    # Four channels each 25% busy are not one congested link
+    assert rc.quality == 62
+
+
+def test_one_busy_channel_is_congestion(clock):
+    rc = controller()
+    rc.record_send(1000, 0.1, 0)
+    clock.now += 1.0
+    rc.record_send(1000, 0.8, 1)
+    assert rc.quality < 70
+
+
+def test_reports_from_many_threads(clock):
+    rc = controller()
+
+    def report():
+        for _ in range(10000):
+            rc.record_send(1, 0.0, 0)
+
+    threads = [threading.Thread(target=report) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    clock.now += 1.0
+    rc.record_send(0, 0.0, 0)
+    assert rc.bytes_per_second == 40000
@@ -0,0 +1,70 @@
+import asyncio
+import pytest
+from Bench.fake_isapi import FakeIsapiCamera
+from Core.camera_set import CameraSet
+from Core.receive_command import ControlServer, parse_command
+
+
+@pytest.fixture
+def camera():
+    camera = FakeIsapiCamera('admin', 'secret').start()
+    yield camera
+    camera.stop()
+
+
+def control_server(cameras):
+    camera_set = CameraSet()
+    for camera_id, ip in cameras:
+        camera_set.add(camera_id, ip, None)
+    return ControlServer(0, 'admin', 'secret', camera_set)
+
+
+def test_parse_command():
+    assert parse_command("3 resolution 1280 720") == (3, "RESOLUTION", ["1280", "720"])
+    assert parse_command("ALL FPS 15") == (None, "FPS", ["15"])
+    assert parse_command("MOVE STOP") == (None, "MOVE", ["STOP"])
+    assert parse_command("  ") == (None, None, [])
+
+
+def test_commands_for_cameras(camera):
+    server = control_server([(0, camera.host), (1, '127.0.0.1:9')])
+    assert asyncio.run(server.execute("CAMERAS")) == f"OK 0={camera.host} 1=127.0.0.1:9\n".encode()
+    assert asyncio.run(server.execute("0 FPS 10")) == b"OK 0=ok\n"
+    assert camera.channels[101]['max_frame_rate'] == 1000
+    # Camera 1 refuses the connection; the reply reports each camera
+    assert asyncio.run(server.execute("FPS 12")) == b"ERR 0=ok 1=failed\n"
+    assert asyncio.run(server.execute("5 FPS 10")) == b"ERR unknown camera 5\n"
+    assert asyncio.run(server.execute("FPS fast")) == b"ERR expected 'FPS <fps>'\n"
+    assert asyncio.run(server.execute("ZOOM 2")) == b"ERR unknown command ZOOM\n"
+
+
+def test_camera_command_without_cameras():
+    assert asyncio.run(control_server([]).execute("FPS 10")) == b"ERR no cameras\n"
+
+
+def test_connection_is_closed_after_the_client_leaves():
+    server = control_server([])
+
+    async def session():
+        handlers = []
+
+        async def handle(reader, writer):
+            handlers.append(asyncio.current_task())
+            await server._handle_client(reader, writer)
+
+        listener = await asyncio.start_server(handle, '127.0.0.1', 0)
+        port = listener.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(b"FPS 10\n\nSTATS\n")
+        replies = [await reader.readline()]
+        stats = await reader.readuntil(b"\n\n")
+        writer.close()
+        await writer.wait_closed()
+        await asyncio.wait_for(handlers[0], timeout=2)
+        listener.close()
+        await listener.wait_closed()
+        return replies, stats
+
+    replies, stats = asyncio.run(session())
+    assert replies == [b"ERR no cameras\n"]
+    assert b"control_commands_total" in stats
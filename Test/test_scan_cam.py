@@ -0,0 +1,169 @@
+import asyncio
+import socket
+import pytest
+from Core.scan_cam import (expand_networks, matches_filter, normalize_mac, vendor_for_mac, probe_rtsp,
+                           probe_http, scan_network)
+
+CAMERA_IP = '127.0.0.2'  # RTSP and ISAPI with a Hikvision realm
+OTHER_IP = '127.0.0.3'   # HTTP only, another vendor's realm
+ONVIF_IP = '127.0.0.4'   # Only answers WS-Discovery
+
+
+def free_port(ip, kind=socket.SOCK_STREAM):
+    with socket.socket(socket.AF_INET, kind) as s:
+        s.bind((ip, 0))
+        return s.getsockname()[1]
+
+
+def result(**fields):
+    entry = {'ip': '10.0.0.2', 'mac': None, 'vendor': None, 'rtsp': True, 'http_server': None,
+             'http_realm': None, 'onvif_scopes': None}
+    entry.update(fields)
+    return entry
+
+
+def test_expand_networks():
+    assert expand_networks('10.0.0.0/30') == ['10.0.0.1', '10.0.0.2']
+    assert expand_networks('10.0.0.4/31') == ['10.0.0.4', '10.0.0.5']
+    assert expand_networks(['10.0.0.7', ' 10.0.0.6/31 ']) == ['10.0.0.7', '10.0.0.6']
+    assert len(expand_networks('10.1.0.0/16')) == 65534
+    with pytest.raises(ValueError):
+        expand_networks('10.0.0.0/15')
+    with pytest.raises(ValueError):
+        expand_networks('not-a-network')
+
+
+def test_mac_vendor_lookup():
+    assert normalize_mac('e8-a0-ed-1-2-3') == 'E8:A0:ED:01:02:03'
+    assert vendor_for_mac('e8:a0:ed:11:22:33') == 'Hikvision'
+    assert vendor_for_mac('00:11:22:33:44:55') is None
+
+
+def test_matches_filter():
+    hikvision_mac = result(mac='E8:A0:ED:11:22:33', vendor='Hikvision')
+    assert matches_filter(hikvision_mac, ['E8:A0:ED'])
+    assert matches_filter(hikvision_mac, ['e8-a0-ed'])
+    assert matches_filter(hikvision_mac, ['hikvision'])
+    assert not matches_filter(hikvision_mac, ['00:11:22'])
+    assert matches_filter(result(http_realm='DS-2CD2143G0-I'), ['DS-2CD'])
+    assert matches_filter(result(onvif_scopes='onvif://www.onvif.org/hardware/Hikvision'), ['Hikvision'])
+    assert not matches_filter(result(http_realm='Dahua'), ['Hikvision', 'AA:BB:CC'])
+    # Without a filter, anything with an open RTSP port is a camera
+    assert matches_filter(result(), [])
+    assert not matches_filter(result(rtsp=False), [])
+
+
+async def serve(ip, port, reply):
+    async def handle(reader, writer):
+        await reader.read(4096)
+        if reply is not None:
+            writer.write(reply)
+            await writer.drain()
+        else:
+            await asyncio.sleep(5)  # Accepts, then never answers
+        writer.close()
+    return await asyncio.start_server(handle, ip, port)
+
+
+def http_reply(realm):
+    return (f'HTTP/1.1 401 Unauthorized\r\nServer: App-webs/\r\n'
+            f'WWW-Authenticate: Digest realm="{realm}", nonce="abc", qop="auth"\r\n'
+            f'Content-Length: 0\r\n\r\n').encode()
+
+
+RTSP_REPLY = b'RTSP/1.0 200 OK\r\nCSeq: 1\r\nServer: Hikvision-Webs\r\nPublic: OPTIONS, DESCRIBE\r\n\r\n'
+
+
+class WSDiscoveryResponder(asyncio.DatagramProtocol):
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        if b'Probe' in data:
+            self.transport.sendto(
+                b'<e:Envelope><e:Body><d:ProbeMatches><d:ProbeMatch>'
+                b'<d:Scopes>onvif://www.onvif.org/type/video_encoder onvif://www.onvif.org/name/Hikvision</d:Scopes>'
+                b'<d:XAddrs>http://127.0.0.4/onvif/device_service</d:XAddrs>'
+                b'</d:ProbeMatch></d:ProbeMatches></e:Body></e:Envelope>', addr)
+
+
+def test_probes():
+    async def run():
+        rtsp_port, http_port, silent_port = free_port(CAMERA_IP), free_port(CAMERA_IP), free_port(CAMERA_IP)
+        servers = [await serve(CAMERA_IP, rtsp_port, RTSP_REPLY),
+                   await serve(CAMERA_IP, http_port, http_reply('Hikvision')),
+                   await serve(CAMERA_IP, silent_port, None)]
+        try:
+            assert await probe_rtsp(CAMERA_IP, rtsp_port, 1.0) == (True, 'Hikvision-Webs')
+            assert await probe_http(CAMERA_IP, http_port, 1.0) == (True, 401, 'App-webs/', 'Hikvision', True)
+            assert await probe_rtsp(CAMERA_IP, free_port(CAMERA_IP), 1.0) == (False, None)
+            # An open port that never answers is open, without details, after the timeout
+            loop = asyncio.get_running_loop()
+            start = loop.time()
+            assert await probe_http(CAMERA_IP, silent_port, 0.2) == (True, None, None, None, False)
+            assert loop.time() - start < 1.0
+        finally:
+            for server in servers:
+                server.close()
+    asyncio.run(run())
+
+
+def test_scan_network_with_stand_ins():
+    async def run():
+        rtsp_port = free_port(CAMERA_IP)
+        http_port = free_port(CAMERA_IP)
+        ws_port = free_port(ONVIF_IP, socket.SOCK_DGRAM)
+        servers = [await serve(CAMERA_IP, rtsp_port, RTSP_REPLY),
+                   await serve(CAMERA_IP, http_port, http_reply('Hikvision DS-2CD2143')),
+                   await serve(OTHER_IP, http_port, http_reply('Other Vendor'))]
+        responder, _ = await asyncio.get_running_loop().create_datagram_endpoint(
+            WSDiscoveryResponder, local_addr=(ONVIF_IP, ws_port))
+        try:
+            return await scan_network('127.0.0.0/29', ['Hikvision'], timeout=0.3, onvif=True,
+                                      rtsp_port=rtsp_port, http_port=http_port,
+                                      ws_discovery_address=(ONVIF_IP, ws_port))
+        finally:
+            responder.close()
+            for server in servers:
+                server.close()
+
+    results = {entry['ip']: entry for entry in asyncio.run(run()) if entry['ip'] in (CAMERA_IP, OTHER_IP, ONVIF_IP)}
+    camera = results[CAMERA_IP]
+    assert (camera['rtsp'], camera['rtsp_server'], camera['http_status'], camera['http_realm'], camera['isapi']) == \
+        (True, 'Hikvision-Webs', 401, 'Hikvision DS-2CD2143', True)
+    assert camera['matched']
+    other = results[OTHER_IP]
+    assert (other['rtsp'], other['http'], other['http_realm'], other['matched']) == (False, True, 'Other Vendor', False)
+    onvif = results[ONVIF_IP]
+    assert onvif['onvif'] and not onvif['rtsp'] and not onvif['http']
+    assert onvif['onvif_xaddrs'] == 'http://127.0.0.4/onvif/device_service'
+    assert onvif['matched']
+
+
+def test_scan_network_limits_concurrency():
+    active = 0
+    most = 0
+
+    async def run():
+        port = free_port('127.0.0.1')
+
+        async def handle(reader, writer):
+            nonlocal active, most
+            active += 1
+            most = max(most, active)
+            await asyncio.sleep(0.1)
+            active -= 1
+            writer.close()
+
+        # Every loopback address answers on the port, slowly
+        server = await asyncio.start_server(handle, '0.0.0.0', port)
+        try:
+            return await scan_network('127.0.1.0/28', timeout=0.5, concurrency=3,
+                                      rtsp_port=port, http_port=port)
+        finally:
+            server.close()
+
+    results = asyncio.run(run())
+    assert len(results) == 14
+    # Each host is probed on both ports at once
+    assert 2 < most <= 2 * 3
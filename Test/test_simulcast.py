@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+from Core.protocol import PAYLOAD_TIER_JPEG
+from Core.simulcast import SimulcastScheduler, SimulcastTier, parse_tiers, fit_size
+import Core.stream_image as stream_image
+from Core.stream_image import encode_tiers
+
+
+class Sender:
+    def __init__(self):
+        self.frames = []
+
+    def submit(self, payload_type, camera_id, seq, payload, flags=0, key=None, captured=None):
+        self.frames.append((payload_type, camera_id, seq, flags))
+
+
+def test_parse_tiers():
+    assert parse_tiers('320x180@5:50, 640X360@10', 70) == [
+        SimulcastTier(320, 180, 5.0, 50), SimulcastTier(640, 360, 10.0, 70)]
+    assert parse_tiers('', 70) == []
+
+
+@pytest.mark.parametrize('value', ['320@5', '320x180@fast', '0x180@5', '320x180@5:0', '320x180@-1'])
+def test_parse_tiers_rejects(value):
+    with pytest.raises(ValueError):
+        parse_tiers(value, 70)
+
+
+def test_fit_size_keeps_aspect_ratio():
+    assert fit_size(SimulcastTier(320, 240, 5, 50), 1280, 720) == (320, 180)
+    assert fit_size(SimulcastTier(320, 240, 5, 50), 720, 480) == (320, 213)
+    assert fit_size(SimulcastTier(1920, 1080, 5, 50), 720, 480) == (720, 480)
+
+
+def test_due_follows_each_tier_fps():
+    scheduler = SimulcastScheduler(parse_tiers('320x180@5, 640x360@10', 70))
+    counts = {1: 0, 2: 0}
+    seqs = {1: [], 2: []}
+    for frame in range(100):  # 4 s at 25 fps
+        due = scheduler.due(0, now=frame * 0.04)
+        assert [number for number, _, _ in due] == sorted((number for number, _, _ in due), reverse=True)
+        for number, _, seq in due:
+            counts[number] += 1
+            seqs[number].append(seq)
+    assert counts == {1: 20, 2: 40}
+    assert seqs[1] == list(range(20))
+
+
+def test_due_does_not_burst_after_a_stall():
+    scheduler = SimulcastScheduler(parse_tiers('320x180@5', 70))
+    scheduler.due(0, now=0.0)
+    assert len(scheduler.due(0, now=10.0)) == 1
+    assert scheduler.due(0, now=10.04) == []
+
+
+def test_forget_restarts_the_camera():
+    scheduler = SimulcastScheduler(parse_tiers('320x180@5', 70))
+    scheduler.due(0, now=0.0)
+    scheduler.forget(0)
+    assert scheduler.due(0, now=0.01)[0][2] == 0
+
+
+def test_describe_announces_the_encoded_sizes():
+    scheduler = SimulcastScheduler(parse_tiers('320x240@5, 1920x1080@10', 70))
+    assert scheduler.describe(1280, 720, 25) == [
+        {'tier': 0, 'width': 1280, 'height': 720, 'fps': 25},
+        {'tier': 1, 'width': 320, 'height': 180, 'fps': 5.0},
+        {'tier': 2, 'width': 1280, 'height': 720, 'fps': 10.0}]
+
+
+def test_encode_tiers_sends_fitted_frames(monkeypatch):
+    sizes = []
+    encode = stream_image.cv2.imencode
+
+    def imencode(ext, image, params):
+        sizes.append(image.shape[:2])
+        return encode(ext, image, params)
+
+    monkeypatch.setattr(stream_image.cv2, 'imencode', imencode)
+    sender = Sender()
+    scheduler = SimulcastScheduler(parse_tiers('320x240@0, 640x480@0', 70))
+    encode_tiers(sender, 3, np.zeros((720, 1280, 3), np.uint8), scheduler.due(3))
+    assert sizes == [(360, 640), (180, 320)]
+    assert sender.frames == [(PAYLOAD_TIER_JPEG, 3, 0, 2), (PAYLOAD_TIER_JPEG, 3, 0, 1)]
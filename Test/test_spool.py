@@ -0,0 +1,159 @@
+import os
+import socket
+import threading
+import time
+from Core.protocol import pack_header, unpack_header, header_size, PAYLOAD_JPEG, CaptureTime
+from Core.sender import FrameSender
+from Core.spool import FrameSpool, RECORD_STRUCT, SEGMENT_SUFFIX
+from Receiver.receiver import Receiver
+
+
+def message(camera_id, seq, size=100):
+    return pack_header(PAYLOAD_JPEG, camera_id, seq, size), bytes([seq % 256]) * size
+
+
+def replay_all(spool):
+    records = []
+    while True:
+        record = spool.next_replay()
+        if record is None:
+            return records
+        records.append(record)
+
+
+def segment_files(directory):
+    return sorted(name for name in os.listdir(directory) if name.endswith(SEGMENT_SUFFIX))
+
+
+def test_replays_in_order(tmp_path):
+    spool = FrameSpool(str(tmp_path), max_bytes=1 << 20, segment_size=4096)
+    for seq in range(5):
+        assert spool.append(seq % 2, *message(seq % 2, seq))
+    assert spool.pending == 5
+    assert spool.backlog() == {0: 3, 1: 2}
+    records = replay_all(spool)
+    assert [spool_id for spool_id, _, _ in records] == [1, 2, 3, 4, 5]
+    assert [camera_id for _, camera_id, _ in records] == [0, 1, 0, 1, 0]
+    header, payload = message(1, 3)
+    assert records[3][2] == header + payload
+    assert not spool.has_replay()
+    spool.close()
+
+
+def test_ack_trims_and_rewind_replays_the_rest(tmp_path):
+    spool = FrameSpool(str(tmp_path), max_bytes=1 << 20, segment_size=1024)
+    for seq in range(20):
+        spool.append(0, *message(0, seq))
+    files = len(segment_files(tmp_path))
+    assert files > 2
+    replay_all(spool)
+    spool.ack(12)
+    assert spool.pending == 8
+    assert len(segment_files(tmp_path)) < files
+    # The connection failed after id 12 was acknowledged: the rest goes again
+    spool.rewind()
+    assert [spool_id for spool_id, _, _ in replay_all(spool)] == list(range(13, 21))
+    spool.ack(20)
+    assert spool.pending == 0
+    assert not spool.has_replay()
+    spool.close()
+
+
+def test_full_spool_evicts_the_oldest_segment(tmp_path):
+    spool = FrameSpool(str(tmp_path), max_bytes=2048, segment_size=1024)
+    for seq in range(30):
+        assert spool.append(0, *message(0, seq))
+    assert spool.frames_evicted > 0
+    assert spool.pending == 30 - spool.frames_evicted
+    assert len(segment_files(tmp_path)) <= 2
+    records = replay_all(spool)
+    assert records[-1][0] == 30
+    assert records[0][0] == spool.frames_evicted + 1
+    spool.close()
+
+
+def test_max_fps_skips_frames(tmp_path):
+    spool = FrameSpool(str(tmp_path), max_bytes=1 << 20, segment_size=4096, max_fps=1.0)
+    assert spool.append(0, *message(0, 0))
+    assert not spool.append(0, *message(0, 1))
+    assert spool.append(1, *message(1, 0))
+    spool.close()
+
+
+def test_oversized_frame_is_refused(tmp_path):
+    spool = FrameSpool(str(tmp_path), max_bytes=1 << 20, segment_size=1024)
+    assert not spool.append(0, *message(0, 0, size=2000))
+    assert spool.pending == 0
+    spool.close()
+
+
+def test_reload_after_restart(tmp_path):
+    spool = FrameSpool(str(tmp_path), max_bytes=1 << 20, segment_size=1024)
+    for seq in range(20):
+        spool.append(seq % 3, *message(seq % 3, seq))
+    files = len(segment_files(tmp_path))
+    spool.ack(12)
+    assert len(segment_files(tmp_path)) < files
+    spool.close()
+
+    # Acknowledged segments are gone; what is left is replayed (at least once)
+    spool = FrameSpool(str(tmp_path), max_bytes=1 << 20, segment_size=1024)
+    records = replay_all(spool)
+    ids = [spool_id for spool_id, _, _ in records]
+    assert ids == list(range(ids[0], 21))
+    assert ids[0] <= 13
+    assert spool.pending == len(ids)
+    assert sum(spool.backlog().values()) == len(ids)
+    for spool_id, camera_id, data in records:
+        header = unpack_header(data[:header_size(data)])
+        assert header.camera_id == camera_id == (spool_id - 1) % 3
+        assert header.seq == spool_id - 1
+    # New records continue the numbering
+    spool.append(0, *message(0, 20))
+    assert replay_all(spool)[0][0] == 21
+    spool.close()
+
+
+def test_record_cut_short_reads_as_the_end(tmp_path):
+    spool = FrameSpool(str(tmp_path), max_bytes=1 << 20, segment_size=4096)
+    for seq in range(3):
+        spool.append(0, *message(0, seq))
+    spool.close()
+    path = os.path.join(tmp_path, segment_files(tmp_path)[0])
+    with open(path, 'r+b') as f:
+        # The third record's header is written last; a crash before it leaves zeros
+        f.seek(2 * (RECORD_STRUCT.size + len(b''.join(message(0, 0)))))
+        f.write(bytes(RECORD_STRUCT.size))
+    spool = FrameSpool(str(tmp_path), max_bytes=1 << 20, segment_size=4096)
+    assert spool.pending == 2
+    spool.close()
+
+
+def test_frames_spooled_while_down_reach_the_archive(tmp_path):
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    stop = threading.Event()
+    spool = FrameSpool(str(tmp_path / 'spool'), max_bytes=1 << 20, segment_size=1 << 16)
+    sender = FrameSender('127.0.0.1', port, stop, reconnect_delay=0.2, spool=spool)
+    sender.start()
+    receiver = None
+    try:
+        for seq in range(5):
+            sender.submit(PAYLOAD_JPEG, 0, seq, b'\xff\xd8' + bytes(100) + b'\xff\xd9',
+                          captured=CaptureTime(1700000000.0 + seq, time.monotonic()))
+        assert spool.pending == 5
+        receiver = Receiver(archive_dir=str(tmp_path / 'archive'))
+        receiver.start('127.0.0.1', port)
+        deadline = time.monotonic() + 10
+        while spool.pending and time.monotonic() < deadline:
+            time.sleep(0.1)
+        assert spool.pending == 0
+        saved = [name for _, _, names in os.walk(tmp_path / 'archive') for name in names]
+        assert len(saved) == 5
+    finally:
+        stop.set()
+        sender.stop()
+        spool.close()
+        if receiver is not None:
+            receiver.close()
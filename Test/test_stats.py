@@ -0,0 +1,60 @@
+from Core.protocol import FrameHeader, PAYLOAD_JPEG, PAYLOAD_KEEPALIVE
+from Receiver.stats import CameraStats, REORDER_WINDOW
+
+
+def record(stats, *seqs, payload_type=PAYLOAD_JPEG):
+    for seq in seqs:
+        stats.record(FrameHeader(payload_type, 0, 0, seq, 0), 0.0)
+
+
+def counts(stats):
+    summary = stats.summary()
+    return summary['frames'], summary['lost']
+
+
+def test_gap_counts_lost_frames():
+    stats = CameraStats()
+    record(stats, 1, 2, 5, 6)
+    assert counts(stats) == (4, 2)
+    assert stats.summary()['loss_ratio'] == 2 / 6
+
+
+def test_keepalive_repeats_the_last_seq():
+    stats = CameraStats()
+    record(stats, 1, 2)
+    record(stats, 2, 2, payload_type=PAYLOAD_KEEPALIVE)
+    record(stats, 3)
+    assert counts(stats) == (3, 0)
+
+
+def test_out_of_order_pair_is_not_lost():
+    stats = CameraStats()
+    # 4 arrives before 3, e.g. right after the camera moved to another channel
+    record(stats, 1, 2, 4, 3, 5, 6)
+    assert counts(stats) == (6, 0)
+    assert stats.last_seq == 6
+
+
+def test_late_frame_does_not_count_the_gap_twice():
+    stats = CameraStats()
+    record(stats, 1, 5, 3, 6)
+    assert counts(stats) == (4, 2)  # 2 and 4 are still lost
+    record(stats, 3, 2)  # A duplicate is ignored, a late frame is not lost after all
+    assert counts(stats) == (5, 1)
+
+
+def test_frames_far_behind_are_a_restart():
+    stats = CameraStats()
+    record(stats, 1000, 1001)
+    record(stats, 0, 1, 3)
+    assert counts(stats) == (5, 1)
+    assert stats.last_seq == 3
+
+
+def test_late_frames_within_the_window():
+    stats = CameraStats()
+    record(stats, 0, REORDER_WINDOW * 3)
+    assert counts(stats) == (2, REORDER_WINDOW * 3 - 1)
+    record(stats, REORDER_WINDOW * 2)
+    assert counts(stats) == (3, REORDER_WINDOW * 3 - 2)
+    assert stats.last_seq == REORDER_WINDOW * 3
@@ -0,0 +1,132 @@
+import queue
+import xml.etree.ElementTree as ET
+import pytest
+from Bench.fake_isapi import FakeIsapiCamera
+from Core.isapi import IsapiClient
+from Core.substream import pick_stream_profile, negotiate_substream
+
+# Substream capabilities as cameras return them: options in 'opt' lists, widths and
+# heights as two parallel lists, frame rates in hundredths
+HIKVISION_CAPABILITIES = """<?xml version="1.0" encoding="UTF-8"?>
+<StreamingChannel version="2.0" xmlns="http://www.hikvision.com/ver20/XMLSchema">
+<id>102</id>
+<Video>
+<videoCodecType opt="H.264,MJPEG,H.265">H.264</videoCodecType>
+<videoResolutionWidth opt="704,640,640,352,320">640</videoResolutionWidth>
+<videoResolutionHeight opt="576,480,360,288,240">360</videoResolutionHeight>
+<maxFrameRate opt="2500,2200,2000,1800,1600,1500,1200,1000,800,600,400,200,100,50,25,12,6">2500</maxFrameRate>
+</Video>
+</StreamingChannel>
+"""
+
+# No namespace, no codec list, a malformed frame rate and a zero ("full") frame rate
+SPARSE_CAPABILITIES = """<StreamingChannel>
+<Video>
+<videoResolutionWidth opt="1280,640">640</videoResolutionWidth>
+<videoResolutionHeight opt="720,360">360</videoResolutionHeight>
+<maxFrameRate opt="0,1500, x ,3000">1500</maxFrameRate>
+</Video>
+</StreamingChannel>
+"""
+
+NO_OPTIONS_CAPABILITIES = """<StreamingChannel xmlns="http://www.hikvision.com/ver20/XMLSchema">
+<Video><videoCodecType>H.264</videoCodecType></Video>
+</StreamingChannel>
+"""
+
+
+def parse_capabilities(xml):
+    client = IsapiClient('127.0.0.1:9', 'admin', 'secret')
+    client.get_xml = lambda path: ET.fromstring(xml)
+    try:
+        return client.get_capabilities(102)
+    finally:
+        client.close()
+
+
+@pytest.fixture
+def hikvision():
+    return parse_capabilities(HIKVISION_CAPABILITIES)
+
+
+@pytest.fixture
+def camera():
+    camera = FakeIsapiCamera('admin', 'secret').start()
+    yield camera
+    camera.stop()
+
+
+def test_capabilities_are_parsed(hikvision):
+    assert hikvision['resolutions'] == [(704, 576), (640, 480), (640, 360), (352, 288), (320, 240)]
+    assert hikvision['frame_rates'][:3] == [25.0, 22.0, 20.0]
+    assert hikvision['frame_rates'][-1] == 0.06
+    assert hikvision['codecs'] == ['H.264', 'MJPEG', 'H.265']
+    assert parse_capabilities(SPARSE_CAPABILITIES) == {
+        'resolutions': [(1280, 720), (640, 360)], 'frame_rates': [15.0, 30.0], 'codecs': []}
+
+
+def test_exact_resolution(hikvision):
+    profile = pick_stream_profile(hikvision, (640, 360))
+    assert (profile['width'], profile['height']) == (640, 360)
+
+
+def test_smallest_covering_resolution(hikvision):
+    # 640x480 and 704x576 both cover 600x400; the CPU scales down least from 640x480
+    profile = pick_stream_profile(hikvision, (600, 400))
+    assert (profile['width'], profile['height']) == (640, 480)
+    profile = pick_stream_profile(hikvision, (330, 250))
+    assert (profile['width'], profile['height']) == (352, 288)
+
+
+def test_largest_resolution_when_none_covers(hikvision):
+    profile = pick_stream_profile(hikvision, (1920, 1080))
+    assert (profile['width'], profile['height']) == (704, 576)
+    # Covering both dimensions matters: 1280x720 is the only mode at least 700 wide
+    profile = pick_stream_profile(parse_capabilities(SPARSE_CAPABILITIES), (700, 300))
+    assert (profile['width'], profile['height']) == (1280, 720)
+
+
+def test_frame_rate(hikvision):
+    assert pick_stream_profile(hikvision, (640, 360), fps=15)['fps'] == 15.0
+    assert pick_stream_profile(hikvision, (640, 360), fps=13)['fps'] == 15.0
+    assert pick_stream_profile(hikvision, (640, 360), fps=60)['fps'] == 25.0
+    assert pick_stream_profile(hikvision, (640, 360))['fps'] is None
+
+
+def test_codec(hikvision):
+    assert pick_stream_profile(hikvision, (640, 360), codec='H.265')['codec'] == 'H.265'
+    assert pick_stream_profile(hikvision, (640, 360), codec='AV1')['codec'] is None
+    assert pick_stream_profile(parse_capabilities(SPARSE_CAPABILITIES), (640, 360), codec='H.264')['codec'] is None
+
+
+def test_nothing_listed():
+    profile = pick_stream_profile(parse_capabilities(NO_OPTIONS_CAPABILITIES), (640, 360), fps=10, codec='H.264')
+    assert profile == {'width': None, 'height': None, 'fps': None, 'codec': None}
+
+
+def test_negotiate_substream(camera):
+    updates = queue.Queue()
+    profile = negotiate_substream(camera.host, 'admin', 'secret', (600, 400), fps=12,
+                                  profile_updates=updates)
+    assert {key: profile[key] for key in ('channel', 'width', 'height', 'fps', 'codec')} == \
+        {'channel': 102, 'width': 640, 'height': 480, 'fps': 15.0, 'codec': 'H.264'}
+    assert camera.channels[102] == {'width': 640, 'height': 480, 'bitrate': 512,
+                                    'max_frame_rate': 1500, 'codec': 'H.264'}
+    assert updates.get_nowait() == (camera.host, profile)
+
+    # The cached profile skips the capabilities query, and the channel already has
+    # its settings: only the channel is read, nothing is written
+    requests, challenges = camera.requests, camera.challenges
+    assert negotiate_substream(camera.host, 'admin', 'secret', (600, 400), fps=12,
+                               cached_profile=profile) == profile
+    assert camera.requests - camera.challenges == requests - challenges + 1
+
+    # A profile cached for another request is not used
+    camera.capabilities['resolutions'] = [(800, 600)]
+    profile = negotiate_substream(camera.host, 'admin', 'secret', (640, 360), cached_profile=profile)
+    assert (profile['width'], profile['height'], profile['fps']) == (800, 600, None)
+    assert camera.channels[102]['max_frame_rate'] == 1500
+
+
+def test_negotiate_substream_without_camera():
+    assert negotiate_substream('127.0.0.1:9', 'admin', 'secret', (640, 360)) is None
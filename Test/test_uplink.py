@@ -0,0 +1,148 @@
+import json
+import socket
+import threading
+import time
+import pytest
+import Core.sender as sender
+import Core.uplink as uplink
+import Receiver.receiver as receiver
+from Core.protocol import PAYLOAD_CAMERAS, MOSAIC_CAMERA_ID
+from Core.uplink import UplinkChannels
+
+
+class Channel:
+    connections = 0
+
+
+class Slot:
+    def __init__(self):
+        self.frames_published = 0
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(uplink.time, 'monotonic', clock)
+    return clock
+
+
+def loads(channels, weights):
+    totals = [0] * len(channels)
+    for camera_id, weight in weights.items():
+        totals[channels.channel(camera_id)] += weight
+    return totals
+
+
+def test_new_cameras_go_to_the_lightest_channel():
+    channels = UplinkChannels([Channel(), Channel(), Channel()])
+    weights = {0: 10, 1: 10, 2: 10, 3: 10, 4: 10, 5: 10}
+    assert channels.rebalance(weights) == {}
+    assert loads(channels, weights) == [20, 20, 20]
+    weights[6] = 40
+    channels.rebalance(weights)
+    assert max(loads(channels, weights)) == 40
+
+
+def test_cameras_stay_on_their_channel_when_balanced():
+    channels = UplinkChannels([Channel(), Channel()])
+    channels.rebalance({0: 10, 1: 10, 2: 10, 3: 10})
+    before = {camera_id: channels.channel(camera_id) for camera_id in range(4)}
+    assert channels.rebalance({0: 10, 1: 10, 2: 10, 3: 10}) == {}
+    assert {camera_id: channels.channel(camera_id) for camera_id in range(4)} == before
+
+
+def test_heaviest_channel_sheds_cameras():
+    channels = UplinkChannels([Channel(), Channel()])
+    channels.rebalance({0: 1, 1: 1, 2: 1, 3: 1})
+    # Measured later: the cameras on one channel turn out to be much heavier
+    weights = {camera_id: 25 if channels.channel(camera_id) == 0 else 5 for camera_id in range(4)}
+    weights[4] = 5
+    weights[5] = 5
+    moved = channels.rebalance(weights)
+    assert all(channels.channel(camera_id) != previous for camera_id, previous in moved.items())
+    assert loads(channels, weights) == [35, 35]
+
+
+def test_tolerance_leaves_small_imbalance():
+    channels = UplinkChannels([Channel(), Channel()])
+    channels.rebalance({0: 50, 1: 45, 2: 2})
+    assert channels.rebalance({0: 50, 1: 45, 2: 2}, tolerance=0.1) == {}
+
+
+def test_measure_uses_recent_frame_rate(clock):
+    channels = UplinkChannels([Channel(), Channel()])
+    fast, slow = Slot(), Slot()
+    cameras = [(0, 'a', fast), (1, 'b', slow)]
+    assert channels.measure(cameras, 100) == {0: 1.0, 1: 1.0}
+    clock.now += 2.0
+    fast.frames_published, slow.frames_published = 50, 10
+    assert channels.measure(cameras, 100) == {0: 2500.0, 1: 500.0}
+    # Too soon for a new window: the last measurement stands
+    clock.now += 0.5
+    fast.frames_published = 60
+    assert channels.measure(cameras, 100) == {0: 2500.0, 1: 500.0}
+    clock.now += 0.5
+    assert channels.measure(cameras, 100) == {0: 1000.0, 1: 0.0}
+
+
+def test_measure_gives_new_cameras_the_mean_weight(clock):
+    channels = UplinkChannels([Channel(), Channel()])
+    slots = [Slot(), Slot()]
+    channels.measure([(0, 'a', slots[0]), (1, 'b', slots[1])], 1)
+    clock.now += 1.0
+    slots[0].frames_published, slots[1].frames_published = 20, 10
+    weights = channels.measure([(0, 'a', slots[0]), (1, 'b', slots[1]), (2, 'c', Slot())], 1)
+    assert weights == {0: 20.0, 1: 10.0, 2: 15.0}
+
+
+def test_rebalance_due_periodically(clock):
+    assert not UplinkChannels([Channel()]).rebalance_due()
+    channels = UplinkChannels([Channel(), Channel()])
+    assert not channels.rebalance_due()
+    clock.now += uplink.REBALANCE_INTERVAL
+    assert channels.rebalance_due()
+    channels.rebalance({})
+    assert not channels.rebalance_due()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def loopback_receiver():
+    port = free_port()
+    r = receiver.Receiver()
+    r.start('127.0.0.1', port)
+    yield r, port
+    r.close()
+
+
+def test_idle_channel_stays_connected(monkeypatch, loopback_receiver):
+    # A channel without cameras only has its sticky camera set to send
+    monkeypatch.setattr(receiver, 'SOCKET_TIMEOUT', 1.0)
+    monkeypatch.setattr(sender, 'IDLE_RESEND_INTERVAL', 0.3)
+    r, port = loopback_receiver
+    stop = threading.Event()
+    channel = sender.FrameSender('127.0.0.1', port, stop)
+    channel.set_sticky('cameras', PAYLOAD_CAMERAS, MOSAIC_CAMERA_ID,
+                       json.dumps({'cameras': [{'id': 0, 'ip': '10.0.0.1'}]}).encode())
+    channel.start()
+    try:
+        time.sleep(2.5)
+        assert channel.connections == 1
+        assert channel.messages_sent > 1
+        assert r.cameras == {0: '10.0.0.1'}
+    finally:
+        stop.set()
+        channel.stop()
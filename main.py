@@ -2,15 +2,122 @@ import multiprocessing
 import logging
 import time
 import sys
+import queue
+from threading import Thread
 from Config.load_config import load_configuration
 from Core.stream_image import stream_multiple_cameras
-from Core.scan_cam import get_host_IP, convert_to_CIDR, get_list_camera_IP
+from Core.scan_cam import get_host_IP, convert_to_CIDR, find_cameras
+from Core.discovery_cache import DiscoveryCache
+
+# A camera missing from this many consecutive rescans is removed from the stream, so a
+# single lost probe does not drop a working camera
+RESCAN_MISSES_BEFORE_REMOVAL = 2
+# Seconds the streaming process gets to stop its capture workers and release their
+# shared memory before it is terminated
+STREAM_STOP_TIMEOUT = 15
 
 
 logging.basicConfig(level=logging.INFO,
                     format="%(asctime)s - %(levelname)s - %(message)s")
 
 
+def start_stream_process(list_ip_address, config, camera_updates=None, profile_updates=None,
+                         shutdown_event=None):
+    """Starts the streaming process for the given cameras and returns it.
+    Camera lists put on camera_updates change the streamed cameras without a restart;
+    negotiated substream profiles come back on profile_updates. Setting shutdown_event
+    (a multiprocessing.Event) asks the process to stop (see stop_stream_process).
+    """
+    logging.info(
+        f"Starting streaming process for {len(list_ip_address)} cameras...")
+    stream_process = multiprocessing.Process(
+        target=stream_multiple_cameras,
+        args=(list_ip_address, config['video_port'], config['control_port'],
+              config['vps_ip'], config['cam_user'], config['cam_password'],
+              config['resize_frame'], config, camera_updates, profile_updates, shutdown_event)
+    )
+    # Daemonic processes cannot start children, so the streaming process must not be
+    # daemonic when it spawns one capture process per camera.
+    stream_process.daemon = config['capture_mode'] != 'process'
+    stream_process.start()
+    return stream_process
+
+
+def stop_stream_process(stream_process, shutdown_event=None):
+    """Stops the streaming process. It is asked to stop through shutdown_event first, so
+    it stops its capture processes and releases their shared memory (/dev/shm); it is
+    only terminated, and then killed, if it has not exited after STREAM_STOP_TIMEOUT.
+    """
+    if shutdown_event is not None:
+        shutdown_event.set()
+        stream_process.join(timeout=STREAM_STOP_TIMEOUT)
+    if stream_process.is_alive():
+        logging.warning(
+            "Streaming process did not stop gracefully. Terminating it.")
+        stream_process.terminate()
+        stream_process.join(timeout=5)
+    if stream_process.is_alive():
+        logging.warning(
+            "Streaming process did not terminate. Sending SIGKILL.")
+        stream_process.kill()
+        stream_process.join()
+    logging.info("Streaming process stopped.")
+
+
+def rescan_cameras(network_range, filter_devices, scan_options, cache, results, interval, scan_now):
+    """Background scans: refresh the discovery cache and put the found camera IPs on results.
+
+    Scans right away if scan_now (to verify cached cameras), then every interval
+    seconds; with an interval of 0 there are no periodic scans.
+    """
+    if not scan_now:
+        if not interval:
+            return
+        time.sleep(interval)
+    while True:
+        logging.info(
+            f"Rescanning {network_range} for devices: {filter_devices}")
+        cameras = find_cameras(network_range, filter_devices, **scan_options)
+        if cache is not None and cameras:
+            cache.update(cameras)
+            cache.save()
+        results.put([camera['ip'] for camera in cameras])
+        if not interval:
+            return
+        time.sleep(interval)
+
+
+def merge_rescan(current, found, misses):
+    """Returns the camera set after a rescan: new cameras are added right away, missing
+    ones only after RESCAN_MISSES_BEFORE_REMOVAL scans in a row. misses is updated in place.
+    """
+    for ip_address in found:
+        misses.pop(ip_address, None)
+    for ip_address in current:
+        if ip_address not in found:
+            misses[ip_address] = misses.get(ip_address, 0) + 1
+    kept = [ip_address for ip_address in current
+            if misses.get(ip_address, 0) < RESCAN_MISSES_BEFORE_REMOVAL]
+    for ip_address in list(misses):
+        if ip_address not in kept:
+            del misses[ip_address]
+    return kept + [ip_address for ip_address in found if ip_address not in kept]
+
+
+def store_stream_profiles(cache, profile_updates):
+    """Saves substream profiles negotiated by the streaming process in the discovery cache."""
+    updated = False
+    try:
+        while True:
+            ip_address, profile = profile_updates.get_nowait()
+            cache.set_stream_profile(ip_address, profile)
+            updated = True
+    except queue.Empty:
+        pass
+    if updated:
+        cache.save()
+
+
 def main():
     logging.info("Starting main process...")
     config = load_configuration()
@@ -18,50 +125,89 @@ def main():
         logging.critical("Failed to load configuration. Exiting.")
         sys.exit(1)
 
-    vps_ip = config['vps_ip']
-    video_port = config['video_port']
-    control_port = config['control_port']
-    cam_user = config['cam_user']
-    cam_password = config['cam_password']
-    resize_frame = config['resize_frame']
     filter_devices = config["filter_devices"]
 
-    try:
-        host_ip = get_host_IP()
-        if not host_ip:
-            logging.error("Could not determine host IP address.")
-            sys.exit(1)
-        network_range = convert_to_CIDR(host_ip)
-        if not network_range:
-            logging.error("Could not determine network range (CIDR).")
+    network_range = config['scan_networks']
+    if not network_range:
+        try:
+            host_ip = get_host_IP()
+            if not host_ip:
+                logging.error("Could not determine host IP address.")
+                sys.exit(1)
+            network_range = convert_to_CIDR(host_ip)
+            if not network_range:
+                logging.error("Could not determine network range (CIDR).")
+                sys.exit(1)
+            logging.info(f"Host IP: {host_ip}, Network Range: {network_range}")
+        except Exception as e:
+            logging.error(f"Error getting network information: {e}")
             sys.exit(1)
-        logging.info(f"Host IP: {host_ip}, Network Range: {network_range}")
-    except Exception as e:
-        logging.error(f"Error getting network information: {e}")
-        sys.exit(1)
 
-    logging.info(
-        f"Scanning network {network_range} for devices: {filter_devices}")
-    try:
-        list_ip_address = get_list_camera_IP(network_range, filter_devices)
+    scan_options = {'timeout': config['scan_timeout'],
+                    'concurrency': config['scan_concurrency'],
+                    'onvif': config['scan_onvif']}
+
+    cache = None
+    list_ip_address = []
+    if config['cache_enabled']:
+        cache = DiscoveryCache(config['cache_path'], config['cache_ttl']).load()
+        list_ip_address = cache.camera_ips()
+        if list_ip_address:
+            logging.info(f"Using cached cameras: {list_ip_address}")
+
+    started_from_cache = bool(list_ip_address)
+    if not started_from_cache:
+        logging.info(
+            f"Scanning network {network_range} for devices: {filter_devices}")
+        cameras = find_cameras(network_range, filter_devices, **scan_options)
+        list_ip_address = [camera['ip'] for camera in cameras]
         logging.info(f"Found cameras: {list_ip_address}")
-    except Exception as e:
-        logging.error(f"Error scanning for cameras: {e}")
-        list_ip_address = []
+        if cache is not None and cameras:
+            cache.update(cameras)
+            cache.save()
+
     if list_ip_address:
-        logging.info(
-            f"Starting streaming process for {len(list_ip_address)} cameras...")
-        stream_process = multiprocessing.Process(
-            target=stream_multiple_cameras,
-            args=(list_ip_address, video_port, control_port,
-                  vps_ip, cam_user, cam_password, resize_frame)
-        )
-        stream_process.daemon = True
-        stream_process.start()
+        profile_updates = None
+        if cache is not None:
+            # Cameras with a known substream profile skip the capabilities query
+            config['stream_profiles'] = {ip_address: cache.get_stream_profile(ip_address)
+                                         for ip_address in list_ip_address
+                                         if cache.get_stream_profile(ip_address)}
+            profile_updates = multiprocessing.Queue()
+        camera_updates = multiprocessing.Queue()
+        shutdown_event = multiprocessing.Event()
+        stream_process = start_stream_process(list_ip_address, config, camera_updates, profile_updates,
+                                              shutdown_event)
+
+        # Verify cached cameras right away, then keep looking for new and gone cameras
+        rescan_results = queue.Queue()
+        Thread(target=rescan_cameras,
+               args=(network_range, filter_devices, scan_options, cache, rescan_results,
+                     config['rescan_interval'], started_from_cache),
+               name="Rescan", daemon=True).start()
+        misses = {}
 
         try:
             while True:
-                time.sleep(10)
+                try:
+                    found = rescan_results.get(timeout=10)
+                except queue.Empty:
+                    found = None
+
+                if found == []:
+                    logging.warning(
+                        "Rescan found no cameras; keeping the current ones.")
+                elif found:
+                    new_ip_addresses = merge_rescan(list_ip_address, found, misses)
+                    if set(new_ip_addresses) != set(list_ip_address):
+                        logging.info(
+                            f"Camera set changed from {list_ip_address} to {new_ip_addresses}.")
+                        list_ip_address = new_ip_addresses
+                        camera_updates.put(list_ip_address)
+
+                if profile_updates is not None:
+                    store_stream_profiles(cache, profile_updates)
+
                 if not stream_process.is_alive():
                     logging.error(
                         "Streaming process has terminated unexpectedly. Exiting main process.")
@@ -70,14 +216,7 @@ def main():
         except KeyboardInterrupt:
             logging.info(
                 "Keyboard interrupt received. Shutting down gracefully...")
-            stream_process.terminate()
-            stream_process.join(timeout=5)
-            if stream_process.is_alive():
-                logging.warning(
-                    "Streaming process did not terminate gracefully. Sending SIGKILL.")
-                stream_process.kill()
-                stream_process.join()
-            logging.info("Streaming process stopped.")
+            stop_stream_process(stream_process, shutdown_event)
 
     else:
         logging.warning("No cameras found matching the criteria. Exiting.")